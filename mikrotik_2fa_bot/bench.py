@@ -0,0 +1,258 @@
+"""
+Benchmarks for router-facing code paths (development tool).
+
+Runs against a throwaway SQLite database and the local RouterOS simulator
+(routeros_sim), with a fake Telegram bot, so results are reproducible offline.
+
+Usage:
+    python -m mikrotik_2fa_bot.bench poll --sessions 1000 --cycles 3 --out poll.json
+
+poll: seeds N users with one UM account each and sessions spread across every
+SessionStatus, then times scheduler.poll_once() per cycle and reports wall time,
+DB statements and commits, router commands/round trips, Telegram sends and peak RSS.
+Cycle 1 includes the state transitions of freshly seeded sessions; later cycles
+show the steady state.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+
+@dataclass(slots=True)
+class CycleResult:
+    cycle: int
+    wall_seconds: float
+    db_statements: int
+    db_commits: int
+    router_commands: int
+    router_round_trips: int
+    router_rows: int
+    telegram_sends: int
+    peak_rss_mb: float
+
+
+class FakeBot:
+    """Stands in for telegram.Bot: counts sends, optionally with a per-send delay."""
+
+    def __init__(self, delay_seconds: float = 0.0):
+        self.delay_seconds = delay_seconds
+        self.sent = 0
+
+    async def send_message(self, chat_id: int, text: str, **kwargs: Any) -> None:  # noqa: ARG002
+        if self.delay_seconds > 0:
+            await asyncio.sleep(self.delay_seconds)
+        self.sent += 1
+
+
+class _DbCounter:
+    def __init__(self, engine) -> None:
+        from sqlalchemy import event
+
+        self.statements = 0
+        self.commits = 0
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+        event.listen(engine, "commit", self._on_commit)
+
+    def _on_execute(self, *_args: Any) -> None:
+        self.statements += 1
+
+    def _on_commit(self, *_args: Any) -> None:
+        self.commits += 1
+
+    def reset(self) -> None:
+        self.statements = 0
+        self.commits = 0
+
+
+def _reset_peak_rss() -> bool:
+    """Reset the kernel's peak-RSS mark (Linux) so it can be read per cycle."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    # Process lifetime peak: KiB on Linux, bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0
+
+
+def _seed_db(sessions: int, now: datetime) -> Dict[str, int]:
+    """N approved users, one account and one session each; statuses round-robin over SessionStatus."""
+    from mikrotik_2fa_bot.db import db_session
+    from mikrotik_2fa_bot.models import MikrotikAccount, SessionStatus, User, UserStatus, VpnSession
+
+    statuses = list(SessionStatus)
+    counts = {st.value: 0 for st in statuses}
+    with db_session() as db:
+        for i in range(sessions):
+            st = statuses[i % len(statuses)]
+            counts[st.value] += 1
+            username = f"user{i:06d}"
+            user = User(telegram_id=10_000_000 + i, full_name=f"Bench {i}", status=UserStatus.APPROVED, approved_at=now)
+            user.accounts.append(MikrotikAccount(mikrotik_username=username))
+            s = VpnSession(
+                mikrotik_username=username,
+                status=st,
+                created_at=now - timedelta(minutes=5),
+                expires_at=now + timedelta(hours=24),
+            )
+            if st != SessionStatus.REQUESTED:
+                s.connected_at = now - timedelta(minutes=4)
+                s.last_seen_at = now - timedelta(minutes=1)
+            if st in (SessionStatus.CONFIRM_REQUESTED, SessionStatus.ACTIVE):
+                s.confirm_requested_at = s.confirm_last_sent_at = now - timedelta(seconds=5)
+                s.confirm_sent_count = 1
+            if st == SessionStatus.ACTIVE:
+                s.confirmed_at = now - timedelta(seconds=1)
+            user.sessions.append(s)
+            db.add(user)
+            if i % 1000 == 999:
+                db.commit()
+        db.commit()
+    return counts
+
+
+async def _run_poll(args: argparse.Namespace) -> Dict[str, Any]:
+    from mikrotik_2fa_bot import __version__
+    from mikrotik_2fa_bot.config import settings
+    from mikrotik_2fa_bot.db import engine, init_db
+    from mikrotik_2fa_bot.routeros_sim import FaultConfig, RouterModel, RouterOSSimulator
+    from mikrotik_2fa_bot.services import mikrotik_api_async
+    from mikrotik_2fa_bot.services.notifier import get_notifier, stop_notifier
+    from mikrotik_2fa_bot.services.scheduler import poll_once
+
+    n = int(args.sessions)
+    connected = int(n * float(args.connected_ratio))
+    t0 = time.perf_counter()
+    model = RouterModel()
+    model.seed(users=n, sessions=int(args.history), active=connected)
+    sim = RouterOSSimulator(model, faults=FaultConfig(latency={"*": float(args.latency_ms) / 1000.0})).start()
+    settings.MIKROTIK_HOST = sim.host
+    settings.MIKROTIK_PORT = sim.port
+    settings.MIKROTIK_USE_SSL = False
+    settings.MIKROTIK_USERNAME = sim.username
+    settings.MIKROTIK_PASSWORD = sim.password
+    settings.POLL_MIKROTIK_TIMEOUT_SECONDS = max(int(settings.POLL_MIKROTIK_TIMEOUT_SECONDS), 600)
+    # FakeBot has no flood limits: measure the cycle, not Telegram pacing.
+    settings.NOTIFY_RATE_PER_SECOND = 0
+    settings.NOTIFY_CHAT_RATE_PER_SECOND = 0
+
+    init_db()
+    counts = _seed_db(n, datetime.utcnow())
+    seed_seconds = time.perf_counter() - t0
+
+    # Warm up the connection and the capability probe: cycles measure polling only.
+    await mikrotik_api_async.get_router_capabilities()
+
+    db_counter = _DbCounter(engine)
+    bot = FakeBot(delay_seconds=float(args.send_latency_ms) / 1000.0)
+    cycles: List[CycleResult] = []
+    per_cycle_rss = _reset_peak_rss()
+    try:
+        for c in range(1, int(args.cycles) + 1):
+            db_counter.reset()
+            sim.reset_stats()
+            bot.sent = 0
+            _reset_peak_rss()
+            t = time.perf_counter()
+            await poll_once(bot)
+            wall = time.perf_counter() - t
+            # Sends are queued by the cycle; count them once delivered.
+            await get_notifier(bot).drain()
+            st = sim.reset_stats()
+            cycles.append(
+                CycleResult(
+                    cycle=c,
+                    wall_seconds=round(wall, 4),
+                    db_statements=db_counter.statements,
+                    db_commits=db_counter.commits,
+                    router_commands=st.commands,
+                    router_round_trips=st.round_trips,
+                    router_rows=st.rows_sent,
+                    telegram_sends=bot.sent,
+                    peak_rss_mb=round(_peak_rss_mb(), 1),
+                )
+            )
+    finally:
+        await stop_notifier()
+        sim.stop()
+
+    return {
+        "benchmark": "poll",
+        "version": __version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "params": {
+            "sessions": n,
+            "router_connected": connected,
+            "router_history_sessions": int(args.history),
+            "router_latency_ms": float(args.latency_ms),
+            "send_latency_ms": float(args.send_latency_ms),
+            "cycles": int(args.cycles),
+        },
+        "seeded": {"seconds": round(seed_seconds, 3), "sessions_by_status": counts},
+        "peak_rss_per_cycle": per_cycle_rss,
+        "cycles": [asdict(r) for r in cycles],
+    }
+
+
+def _build_parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(prog="python -m mikrotik_2fa_bot.bench", description="Offline benchmarks")
+    sub = p.add_subparsers(dest="benchmark", required=True)
+    poll = sub.add_parser("poll", help="scheduler.poll_once() against the RouterOS simulator")
+    poll.add_argument("--sessions", type=int, default=1000, help="users/sessions to seed (spread across statuses)")
+    poll.add_argument("--connected-ratio", type=float, default=0.5, help="share of users with an active UM session")
+    poll.add_argument("--history", type=int, default=0, help="inactive historical UM sessions on the router")
+    poll.add_argument("--cycles", type=int, default=3)
+    poll.add_argument("--latency-ms", type=float, default=0.0, help="router latency per command")
+    poll.add_argument("--send-latency-ms", type=float, default=0.0, help="fake Telegram latency per send")
+    poll.add_argument("--db", default=None, help="new SQLite file to seed (default: a temporary one)")
+    poll.add_argument("--out", default=None, help="also write the JSON result to this file")
+    return p
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = _build_parser()
+    args = parser.parse_args(argv)
+    if args.db and os.path.exists(args.db):
+        parser.error(f"--db {args.db} already exists (the benchmark seeds a fresh database)")
+    # Must happen before the package's db module is imported (engine is created at import).
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix="mikrotik-2fa-bench-"), "bench.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.abspath(db_path)}"
+    logging.basicConfig(level=logging.WARNING)
+
+    result = asyncio.run(_run_poll(args))
+    text = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import asyncio
+from datetime import datetime
 import logging
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
@@ -43,16 +44,25 @@ from mikrotik_2fa_bot.handlers.admin import (
     add_admin_cmd,
     remove_admin_cmd,
     list_admins_cmd,
+    routers_cmd,
+    add_router_cmd,
+    remove_router_cmd,
 )
 from mikrotik_2fa_bot.handlers.callbacks import callback_handler
-from mikrotik_2fa_bot.services import scheduler as scheduler_service
+from mikrotik_2fa_bot.services import cache_refresher, scheduler as scheduler_service
 from mikrotik_2fa_bot.services.app_settings import apply_router_overrides_to_runtime_settings
+from mikrotik_2fa_bot.services.notifier import get_notifier, stop_notifier
 from mikrotik_2fa_bot.handlers.admin_users_panel import admin_users_panel_cmd
 from mikrotik_2fa_bot.handlers.um_link import (
     um_link_start,
     um_link_callback,
     CHOOSE_TG,
     CHOOSE_UM,
+    CHOOSE_ROUTER,
+    SEARCH_UM,
+    SEARCH_TG,
+    um_link_search_text,
+    um_link_tg_search_text,
 )
 from mikrotik_2fa_bot.handlers.firewall import firewall_list_cmd
 from mikrotik_2fa_bot.handlers.user_settings import (
@@ -62,6 +72,9 @@ from mikrotik_2fa_bot.handlers.user_settings import (
     US_ACTION,
     US_CHOOSE_UM,
     US_CHOOSE_FW,
+    US_CHOOSE_ROUTER,
+    US_SEARCH,
+    user_settings_search_text,
 )
 from mikrotik_2fa_bot.handlers.menu import (
     normalize_text,
@@ -141,6 +154,9 @@ async def main():
     app.add_handler(CommandHandler("create_user", create_user_cmd))
     app.add_handler(CommandHandler("test_router", test_router_cmd))
     app.add_handler(CommandHandler("sessions", admin_sessions_cmd))
+    app.add_handler(CommandHandler("routers", routers_cmd))
+    app.add_handler(CommandHandler("add_router", add_router_cmd))
+    app.add_handler(CommandHandler("remove_router", remove_router_cmd))
     app.add_handler(CommandHandler("restart_bot", restart_bot_cmd))
     app.add_handler(CommandHandler("add_admin", add_admin_cmd))
     app.add_handler(CommandHandler("remove_admin", remove_admin_cmd))
@@ -171,8 +187,11 @@ async def main():
                 CallbackQueryHandler(um_link_start, pattern=r"^admin_panel:link_um$"),
             ],
             states={
-                CHOOSE_TG: [CallbackQueryHandler(um_link_callback, pattern=r"^(tg_page:|tg_pick:|um_cancel$)")],
-                CHOOSE_UM: [CallbackQueryHandler(um_link_callback, pattern=r"^(um_page:|um_pick_id:|um_cancel$)")],
+                CHOOSE_TG: [CallbackQueryHandler(um_link_callback, pattern=r"^(tg_next:|tg_prev:|tg_pick:|tg_search$|tg_search_clear$|um_cancel$)")],
+                CHOOSE_UM: [CallbackQueryHandler(um_link_callback, pattern=r"^(um_next:|um_prev:|um_pick_id:|um_search$|um_search_clear$|um_refresh$|um_cancel$)")],
+                CHOOSE_ROUTER: [CallbackQueryHandler(um_link_callback, pattern=r"^(um_router:|um_cancel$)")],
+                SEARCH_UM: [MessageHandler(filters.TEXT & ~filters.COMMAND, um_link_search_text)],
+                SEARCH_TG: [MessageHandler(filters.TEXT & ~filters.COMMAND, um_link_tg_search_text)],
             },
             fallbacks=[CommandHandler("cancel", cancel_cmd)],
         )
@@ -186,10 +205,12 @@ async def main():
                 CallbackQueryHandler(user_settings_start, pattern=r"^admin_panel:user_settings$"),
             ],
             states={
-                US_CHOOSE_USER: [CallbackQueryHandler(user_settings_callback, pattern=r"^(us_user_page:|us_user_pick:|us_cancel$)")],
+                US_CHOOSE_USER: [CallbackQueryHandler(user_settings_callback, pattern=r"^(us_user_next:|us_user_prev:|us_user_pick:|us_user_search$|us_user_search_clear$|us_cancel$)")],
                 US_ACTION: [CallbackQueryHandler(user_settings_callback, pattern=r"^(us_action:|us_back:|us_cancel$)")],
-                US_CHOOSE_UM: [CallbackQueryHandler(user_settings_callback, pattern=r"^(us_um_page:|us_um_pick_id:|us_back:|us_cancel$)")],
-                US_CHOOSE_FW: [CallbackQueryHandler(user_settings_callback, pattern=r"^(us_fw_page:|us_fw_pick_id:|us_back:|us_cancel$)")],
+                US_CHOOSE_UM: [CallbackQueryHandler(user_settings_callback, pattern=r"^(us_um_next:|us_um_prev:|us_um_pick_id:|us_um_search$|us_um_search_clear$|us_um_refresh$|us_back:|us_cancel$)")],
+                US_CHOOSE_FW: [CallbackQueryHandler(user_settings_callback, pattern=r"^(us_fw_next:|us_fw_prev:|us_fw_pick_id:|us_fw_search$|us_fw_search_clear$|us_fw_refresh$|us_back:|us_cancel$)")],
+                US_CHOOSE_ROUTER: [CallbackQueryHandler(user_settings_callback, pattern=r"^(us_router:|us_back:|us_cancel$)")],
+                US_SEARCH: [MessageHandler(filters.TEXT & ~filters.COMMAND, user_settings_search_text)],
             },
             fallbacks=[CommandHandler("cancel", cancel_cmd)],
         )
@@ -236,8 +257,9 @@ async def main():
     app.add_error_handler(error_handler)
 
     scheduler = AsyncIOScheduler()
+    # Ticks at the shortest interval; tick() skips the cycles the adaptive pacer does not need.
     scheduler.add_job(
-        scheduler_service.poll_once,
+        scheduler_service.tick,
         trigger=IntervalTrigger(seconds=int(settings.POLL_INTERVAL_SECONDS)),
         args=[app.bot],
         id="poll_mikrotik",
@@ -245,10 +267,36 @@ async def main():
         max_instances=1,
         coalesce=True,
     )
+    if settings.SESSION_WATCH_ENABLED:
+        scheduler.add_job(
+            scheduler_service.reconcile,
+            trigger=IntervalTrigger(seconds=max(30, int(settings.SESSION_RECONCILE_SECONDS))),
+            args=[app.bot],
+            id="reconcile_mikrotik",
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True,
+        )
+
+    if int(settings.CACHE_TTL_SECONDS) > 0:
+        # Picker caches: refreshed at startup, then every TTL (pickers never wait for this job).
+        scheduler.add_job(
+            cache_refresher.refresh_all,
+            trigger=IntervalTrigger(seconds=int(settings.CACHE_TTL_SECONDS)),
+            id="refresh_router_caches",
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True,
+            next_run_time=datetime.now(),
+        )
 
     await app.initialize()
     await app.start()
+    # Outbound messages (2FA prompts, notices) are sent from a rate-limited queue.
+    get_notifier(app.bot).start()
     scheduler.start()
+    if settings.SESSION_WATCH_ENABLED:
+        await scheduler_service.sync_session_watchers(app.bot)
     await app.updater.start_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=True)
     logger.info("Bot started.")
 
@@ -257,6 +305,8 @@ async def main():
         await stop_event.wait()
     finally:
         scheduler.shutdown(wait=False)
+        await scheduler_service.stop_session_watchers()
+        await stop_notifier()
         await app.updater.stop()
         await app.stop()
         await app.shutdown()
@@ -28,10 +28,24 @@ class Settings(BaseSettings):
     MIKROTIK_USERNAME: str = ""
     MIKROTIK_PASSWORD: str = ""
     MIKROTIK_TIMEOUT_SECONDS: int = 5
+    # Circuit breaker: after N consecutive connection failures calls fail fast; the router is
+    # re-probed (system/identity) after an exponential, jittered backoff (base .. max seconds)
+    MIKROTIK_BREAKER_FAILURES: int = 3
+    MIKROTIK_BREAKER_BACKOFF_SECONDS: int = 5
+    MIKROTIK_BREAKER_MAX_BACKOFF_SECONDS: int = 300
 
     # Behavior
+    # Adaptive poll interval: POLL_INTERVAL_SECONDS while a session waits for connect/2FA, longer
+    # when all sessions are ACTIVE (grace / 3) or none are left, up to POLL_INTERVAL_MAX_SECONDS;
+    # widened when the router answers slowly. MAX <= POLL_INTERVAL_SECONDS: fixed interval.
     POLL_INTERVAL_SECONDS: int = 5
+    POLL_INTERVAL_MAX_SECONDS: int = 60
     POLL_MIKROTIK_TIMEOUT_SECONDS: int = 4
+    # Detect UM session changes via RouterOS `listen` (near-instant 2FA prompts, no router reads
+    # on the interval tick). Falls back to polling while the subscription is down.
+    SESSION_WATCH_ENABLED: bool = True
+    # Safety-net re-read of active sessions while the watcher is up
+    SESSION_RECONCILE_SECONDS: int = 300
     REQUIRE_CONFIRMATION: bool = True
     CONFIRMATION_TIMEOUT_SECONDS: int = 300
     # If >0: resend the 2FA confirmation message every N seconds while the client stays connected.
@@ -41,10 +55,38 @@ class Settings(BaseSettings):
     # When router no longer reports the session as active, wait this long before disconnecting
     # (handles short drops / polling jitter).
     DISCONNECT_GRACE_SECONDS: int = 30
+    # "Still connected" heartbeats are kept in memory; last_seen_at is written only once the stored
+    # value is older than this fraction of the grace period (or with a status change). 0: every poll.
+    HEARTBEAT_WRITE_FRACTION: float = 0.5
+    # Outbound Telegram messages: parallel sends, global and per-chat rate limits (msg/s, 0: no limit)
+    NOTIFY_CONCURRENCY: int = 8
+    NOTIFY_RATE_PER_SECOND: float = 30.0
+    NOTIFY_CHAT_RATE_PER_SECOND: float = 1.0
     SESSION_DURATION_HOURS: int = 24
     SESSION_SOURCE: str = "user_manager"  # strictly user_manager
+    # How access is revoked on disconnect/expiry:
+    #   steps  - separate API calls (firewall rule, kick sessions, disable UM user)
+    #   script - one /execute of a bot-managed RouterOS script doing all three on the router
+    REVOKE_MODE: str = "steps"
+    REVOKE_SCRIPT_NAME: str = "mikrotik-2fa-revoke"
+
+    # Picker caches (UM users, firewall rules) are re-downloaded only if the router's .id list
+    # changed, or at least this often (in-place edits keep the .id list)
+    CACHE_MAX_AGE_SECONDS: int = 600
+    # Picker caches are refreshed in the background every N seconds (and at startup); pickers
+    # render from the cache at once and revalidate in the background when it is older (0: no job)
+    CACHE_TTL_SECONDS: int = 300
 
     FIREWALL_COMMENT_PREFIX: str = "2FA"
+    # Rules are found by comment via the local firewall_rule_cache index; a lookup miss
+    # rescans the router only if the index is older than this
+    FIREWALL_INDEX_MAX_AGE_SECONDS: int = 300
+    # How a confirmed session gets network access:
+    #   rule         - enable the user's own (pre-created, disabled) filter rule
+    #   address_list - add the client's framed IP to FIREWALL_ADDRESS_LIST with a timeout equal
+    #                  to the remaining session lifetime; one static rule matches the list
+    FIREWALL_ACCESS_MODE: str = "rule"
+    FIREWALL_ADDRESS_LIST: str = "mikrotik-2fa"
 
     class Config:
         env_file = ".env"
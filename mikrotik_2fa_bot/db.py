@@ -2,6 +2,10 @@ from __future__ import annotations
 
 import os
 from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
 from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
 
@@ -47,6 +51,41 @@ if settings.DATABASE_URL.startswith("sqlite"):
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 
 
+@dataclass
+class DbCounters:
+    statements: int = 0
+    commits: int = 0
+
+
+# Counters of the current asyncio task (and the tasks it starts); None: not counting.
+_counters: ContextVar[Optional[DbCounters]] = ContextVar("db_counters", default=None)
+
+
+@event.listens_for(engine, "before_cursor_execute")
+def _count_statement(conn, cursor, statement, parameters, context, executemany):  # noqa: ARG001
+    c = _counters.get()
+    if c is not None:
+        c.statements += 1
+
+
+@event.listens_for(engine, "commit")
+def _count_commit(conn):  # noqa: ARG001
+    c = _counters.get()
+    if c is not None:
+        c.commits += 1
+
+
+@contextmanager
+def count_db_activity() -> Iterator[DbCounters]:
+    """Count SQL statements and commits issued inside the block (e.g. one poll cycle)."""
+    counters = DbCounters()
+    token = _counters.set(counters)
+    try:
+        yield counters
+    finally:
+        _counters.reset(token)
+
+
 def init_db() -> None:
     from mikrotik_2fa_bot import models  # noqa: F401
 
@@ -65,6 +104,20 @@ def init_db() -> None:
                 cur.execute("ALTER TABLE users ADD COLUMN require_confirmation BOOLEAN;")
             if "firewall_rule_id" not in cols:
                 cur.execute("ALTER TABLE users ADD COLUMN firewall_rule_id VARCHAR(255);")
+            if "firewall_router_id" not in cols:
+                cur.execute("ALTER TABLE users ADD COLUMN firewall_router_id INTEGER REFERENCES routers(id);")
+
+            cur.execute("PRAGMA table_info(mikrotik_accounts);")
+            cols = {row[1] for row in (cur.fetchall() or [])}
+            if "router_id" not in cols:
+                cur.execute("ALTER TABLE mikrotik_accounts ADD COLUMN router_id INTEGER REFERENCES routers(id);")
+                cur.execute("CREATE INDEX IF NOT EXISTS ix_mikrotik_accounts_router_id ON mikrotik_accounts (router_id);")
+            # Accounts became unique per router (same UM username on several routers)
+            cur.execute("DROP INDEX IF EXISTS uq_user_mikrotik_username;")
+            cur.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS uq_user_mikrotik_account "
+                "ON mikrotik_accounts (user_id, mikrotik_username, coalesce(router_id, 0));"
+            )
 
             cur.execute("PRAGMA table_info(vpn_sessions);")
             cols = {row[1] for row in (cur.fetchall() or [])}
@@ -72,18 +125,55 @@ def init_db() -> None:
                 cur.execute("ALTER TABLE vpn_sessions ADD COLUMN confirm_last_sent_at DATETIME;")
             if "confirm_sent_count" not in cols:
                 cur.execute("ALTER TABLE vpn_sessions ADD COLUMN confirm_sent_count INTEGER DEFAULT 0;")
+            if "router_id" not in cols:
+                cur.execute("ALTER TABLE vpn_sessions ADD COLUMN router_id INTEGER REFERENCES routers(id);")
+                cur.execute("CREATE INDEX IF NOT EXISTS ix_vpn_sessions_router_id ON vpn_sessions (router_id);")
+            if "client_address" not in cols:
+                cur.execute("ALTER TABLE vpn_sessions ADD COLUMN client_address VARCHAR(64);")
+            if "address_list_entry_id" not in cols:
+                cur.execute("ALTER TABLE vpn_sessions ADD COLUMN address_list_entry_id VARCHAR(64);")
+
+            cur.execute("PRAGMA table_info(cache_fingerprints);")
+            cols = {row[1] for row in (cur.fetchall() or [])}
+            if cols and "checked_at" not in cols:
+                cur.execute("ALTER TABLE cache_fingerprints ADD COLUMN checked_at DATETIME;")
+
+            # Picker caches became per-router (composite unique key). SQLite can't drop the
+            # old UNIQUE column constraint, but they are only caches: recreate empty.
+            # (firewall_rule_cache also gained comment_lc/position for the comment index,
+            # um_user_cache username_lc for case-insensitive search.)
+            stale_caches = []
+            for table, required in (
+                ("um_user_cache", {"router_id", "username_lc"}),
+                ("firewall_rule_cache", {"router_id", "comment_lc"}),
+            ):
+                cur.execute(f"PRAGMA table_info({table});")
+                if not required <= {row[1] for row in (cur.fetchall() or [])}:
+                    cur.execute(f"DROP TABLE {table};")
+                    # Otherwise an unchanged router fingerprint would skip refilling it.
+                    cur.execute("DELETE FROM cache_fingerprints WHERE table_name = ?;", (table,))
+                    stale_caches.append(table)
+
+            # Picker prefix search on firewall comments (a recreated table gets it from the model)
+            if "firewall_rule_cache" not in stale_caches:
+                cur.execute(
+                    "CREATE INDEX IF NOT EXISTS ix_firewall_rule_cache_router_comment "
+                    "ON firewall_rule_cache (router_id, comment_lc);"
+                )
 
             conn.commit()
             cur.close()
             conn.close()
+            if stale_caches:
+                Base.metadata.create_all(bind=engine, tables=[Base.metadata.tables[t] for t in stale_caches])
         except Exception:
             # Best-effort: DB will still work, features will just be unavailable.
             pass
 
 
 @contextmanager
-def db_session():
-    db = SessionLocal()
+def db_session(**kwargs):
+    db = SessionLocal(**kwargs)
     try:
         yield db
     finally:
@@ -9,7 +9,7 @@ from mikrotik_2fa_bot.db import db_session
 from mikrotik_2fa_bot.handlers.util import is_admin
 from mikrotik_2fa_bot.handlers.menu import main_menu
 from mikrotik_2fa_bot.models import UserStatus, VpnSession
-from mikrotik_2fa_bot.services import mikrotik_api
+from mikrotik_2fa_bot.services import mikrotik_api_async
 from mikrotik_2fa_bot.config import settings
 from mikrotik_2fa_bot.services.users import (
     list_pending_users,
@@ -21,6 +21,17 @@ from mikrotik_2fa_bot.services.users import (
     create_or_update_user,
 )
 from mikrotik_2fa_bot.services.vpn_sessions import list_active_sessions_all_users
+from mikrotik_2fa_bot.services.circuit_breaker import BreakerState, get_breaker
+from mikrotik_2fa_bot.services.ros_async import get_async_pool
+from mikrotik_2fa_bot.services.routers import (
+    DEFAULT_ROUTER_NAME,
+    create_router,
+    delete_router,
+    list_router_targets,
+    require_router_config,
+    resolve_router_name,
+    router_name,
+)
 from mikrotik_2fa_bot.services.app_settings import (
     add_admin_id,
     add_admin_username,
@@ -88,13 +99,19 @@ async def bind_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Недостаточно прав.")
         return
     if len(context.args) < 2:
-        await update.message.reply_text("Использование: /bind <telegram_id> <mikrotik_username>")
+        await update.message.reply_text("Использование: /bind <telegram_id> <mikrotik_username> [router]")
         return
     tid = int(context.args[0])
     uname = context.args[1].strip()
     with db_session() as db:
-        bind_account(db, tid, uname)
-    await update.message.reply_text(f"✅ Привязано: telegram_id={tid} → {uname}")
+        try:
+            router_id = resolve_router_name(db, context.args[2] if len(context.args) > 2 else None)
+        except ValueError:
+            await update.message.reply_text("Роутер не найден. Список: /routers")
+            return
+        bind_account(db, tid, uname, router_id)
+        where = router_name(db, router_id)
+    await update.message.reply_text(f"✅ Привязано: telegram_id={tid} → {uname} (router={where})")
 
 
 async def unbind_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -102,13 +119,22 @@ async def unbind_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Недостаточно прав.")
         return
     if len(context.args) < 2:
-        await update.message.reply_text("Использование: /unbind <telegram_id> <mikrotik_username>")
+        await update.message.reply_text("Использование: /unbind <telegram_id> <mikrotik_username> [router]")
         return
     tid = int(context.args[0])
     uname = context.args[1].strip()
     with db_session() as db:
-        unbind_account(db, tid, uname)
-    await update.message.reply_text(f"✅ Отвязано: telegram_id={tid} → {uname}")
+        try:
+            router_id = resolve_router_name(db, context.args[2] if len(context.args) > 2 else None)
+            unbind_account(db, tid, uname, router_id)
+        except ValueError as e:
+            if str(e) == "router_not_found":
+                await update.message.reply_text("Роутер не найден. Список: /routers")
+            else:
+                await update.message.reply_text("Такая привязка не найдена.")
+            return
+        where = router_name(db, router_id)
+    await update.message.reply_text(f"✅ Отвязано: telegram_id={tid} → {uname} (router={where})")
 
 
 async def set_fw_comment_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -147,18 +173,35 @@ async def test_router_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(update.effective_chat.id, update.effective_user.id, update.effective_user.username):
         await update.message.reply_text("Недостаточно прав.")
         return
-    from mikrotik_2fa_bot.config import settings
+    with db_session() as db:
+        try:
+            router_id = resolve_router_name(db, context.args[0] if context.args else None)
+            cfg = require_router_config(db, router_id)
+        except ValueError:
+            await update.message.reply_text("Роутер не найден. Список: /routers")
+            return
+    breaker = get_breaker(cfg)
+    br = breaker.snapshot()
+    if br.state == BreakerState.CLOSED:
+        br_line = f"Circuit breaker: closed (ошибок подряд: {br.failures})"
+    else:
+        since = f"{br.unreachable_since:%Y-%m-%d %H:%M:%S} UTC" if br.unreachable_since else "-"
+        br_line = f"Circuit breaker: {br.state.value}, недоступен с {since}\nПоследняя ошибка: {br.last_error}"
+    # Diagnostics must reach the router even while the circuit is open.
+    breaker.force_probe()
     await update.message.reply_text(
         "⏳ Тестирую подключение к роутеру...\n"
-        f"Host: {settings.MIKROTIK_HOST}:{settings.MIKROTIK_PORT}\n"
-        f"SSL: {settings.MIKROTIK_USE_SSL}\n"
-        f"Timeout: {settings.MIKROTIK_TIMEOUT_SECONDS}s"
+        f"Host: {cfg.host}:{cfg.port}\n"
+        f"SSL: {cfg.use_ssl}\n"
+        f"Timeout: {cfg.timeout_seconds}s\n"
+        f"{br_line}"
     )
     try:
-        report = await asyncio.to_thread(mikrotik_api.test_connection_report)
+        report = await mikrotik_api_async.test_connection_report(cfg)
         lines = [
             "✅ RouterOS API: OK",
             f"- identity: {report.identity or 'unknown'}",
+            f"- RouterOS: {report.router_version or 'unknown'}",
             f"- tcp: {'OK' if report.tcp_ok else 'FAIL'}",
         ]
         if report.ip_service_api_enabled is not None:
@@ -166,9 +209,40 @@ async def test_router_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if report.ip_service_api_ssl_enabled is not None:
             lines.append(f"- /ip/service api-ssl enabled: {report.ip_service_api_ssl_enabled}")
         if report.user_manager_ok is not None:
-            lines.append(f"- user-manager доступ: {'OK' if report.user_manager_ok else 'FAIL'}")
+            um_where = f" (/{report.user_manager_path})" if report.user_manager_path else ""
+            lines.append(f"- user-manager доступ: {'OK' if report.user_manager_ok else 'FAIL'}{um_where}")
         if report.firewall_ok is not None:
             lines.append(f"- firewall read: {'OK' if report.firewall_ok else 'FAIL'}")
+        pool = get_async_pool()
+        lines.append(f"- API pool: open={pool.size()} opened={pool.opened}")
+        lines.append(f"- circuit breaker: {breaker.snapshot().state.value}")
+        from mikrotik_2fa_bot.services.scheduler import get_session_watchers, last_poll_stats
+        from mikrotik_2fa_bot.services.notifier import notifier_stats
+        from mikrotik_2fa_bot.services.poll_pacer import pacer_stats
+
+        w = get_session_watchers().get(router_id)
+        if w is not None:
+            state = "listen OK" if w.healthy else "нет подписки (опрос роутера)"
+            lines.append(f"- session watcher: {state}, events={w.events}")
+        cycle = last_poll_stats(router_id)
+        if cycle is not None:
+            lines.append(
+                f"- последний цикл опроса: сессий={cycle.sessions}, изменено={cycle.changed}, "
+                f"SQL={cycle.statements}, commit={cycle.commits}, {cycle.seconds}s"
+            )
+        pacer = pacer_stats()
+        if pacer is not None:
+            rtt = "—" if pacer.rtt_ms is None else f"{pacer.rtt_ms} мс"
+            lines.append(
+                f"- интервал опроса: {pacer.interval}s ({pacer.reason}), ожидают={pacer.pending}, "
+                f"активных={pacer.active}, RTT роутера={rtt}"
+            )
+        ns = notifier_stats()
+        if ns is not None:
+            lines.append(
+                f"- очередь сообщений: {ns.queued}, отправлено={ns.sent}, ошибок={ns.failed}, "
+                f"flood={ns.flood_waits}, задержка avg/max={ns.avg_latency_ms}/{ns.max_latency_ms} мс"
+            )
         if report.notes:
             lines.append("")
             lines.extend([f"ℹ️ {n}" for n in report.notes[:5]])
@@ -189,8 +263,9 @@ async def admin_sessions_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE)
         lines = []
         kb = []
         for s in sessions[:15]:
+            where = "" if s.router_id is None else f"@{router_name(db, s.router_id)}"
             lines.append(
-                f"- {s.id[:8]}… | user={s.user.telegram_id if s.user else s.user_id} | mt={s.mikrotik_username} | {s.status.value}"
+                f"- {s.id[:8]}… | user={s.user.telegram_id if s.user else s.user_id} | mt={s.mikrotik_username}{where} | {s.status.value}"
             )
             kb.append([InlineKeyboardButton(f"🔌 Отключить {s.mikrotik_username}", callback_data=f"admin_disconnect:{s.id}")])
     await update.message.reply_text(
@@ -199,6 +274,82 @@ async def admin_sessions_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE)
     )
 
 
+async def routers_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.effective_chat.id, update.effective_user.id, update.effective_user.username):
+        await update.message.reply_text("Недостаточно прав.")
+        return
+    with db_session() as db:
+        targets = list_router_targets(db)
+    lines = ["Роутеры:"]
+    for t in targets:
+        lines.append(f"- {t.name}: {t.cfg.host}:{t.cfg.port} ssl={t.cfg.use_ssl} user={t.cfg.username}")
+    if not targets:
+        lines.append("- нет (настройте /router_settings)")
+    lines.append(
+        "\n"
+        f"{DEFAULT_ROUTER_NAME} — роутер из /router_settings.\n"
+        "Добавить: /add_router <name> <host> <port> <username> <password> [ssl]\n"
+        "Удалить: /remove_router <name>"
+    )
+    await update.message.reply_text("\n".join(lines))
+
+
+async def _sync_watchers(bot) -> None:
+    if not settings.SESSION_WATCH_ENABLED:
+        return
+    from mikrotik_2fa_bot.services.scheduler import sync_session_watchers
+
+    await sync_session_watchers(bot)
+
+
+async def add_router_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.effective_chat.id, update.effective_user.id, update.effective_user.username):
+        await update.message.reply_text("Недостаточно прав.")
+        return
+    if len(context.args) < 5:
+        await update.message.reply_text("Использование: /add_router <name> <host> <port> <username> <password> [ssl]")
+        return
+    name, host, port, username, password = context.args[:5]
+    use_ssl = len(context.args) > 5 and context.args[5].strip().lower() in {"1", "true", "yes", "on", "ssl"}
+    # The message contains the router password: don't leave it in the chat history.
+    try:
+        await update.message.delete()
+    except Exception:
+        pass
+    try:
+        with db_session() as db:
+            r = create_router(db, name, host, int(port), username, password, use_ssl=use_ssl)
+            rname, rhost, rport = r.name, r.host, r.port
+    except ValueError as e:
+        await update.effective_chat.send_message(f"❌ Роутер не добавлен: {e}")
+        return
+    await _sync_watchers(context.bot)
+    await update.effective_chat.send_message(
+        f"✅ Роутер добавлен: {rname} ({rhost}:{rport}, ssl={use_ssl}).\nПроверка: /test_router {rname}"
+    )
+
+
+async def remove_router_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.effective_chat.id, update.effective_user.id, update.effective_user.username):
+        await update.message.reply_text("Недостаточно прав.")
+        return
+    if not context.args:
+        await update.message.reply_text("Использование: /remove_router <name>")
+        return
+    name = context.args[0].strip()
+    try:
+        with db_session() as db:
+            delete_router(db, name)
+    except ValueError as e:
+        if str(e) == "router_in_use":
+            await update.message.reply_text("❌ К роутеру привязаны UM-учётки или активные сессии. Сначала отвяжите их.")
+        else:
+            await update.message.reply_text(f"❌ Роутер не удалён: {e}")
+        return
+    await _sync_watchers(context.bot)
+    await update.message.reply_text(f"✅ Роутер удалён: {name}")
+
+
 async def restart_bot_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Admin: restart bot process.
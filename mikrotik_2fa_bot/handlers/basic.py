@@ -51,7 +51,8 @@ async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "- /pending, /approve, /reject\n"
             "- /bind, /unbind\n"
             "- /router_settings\n"
-            "- /test_router\n"
+            "- /routers, /add_router, /remove_router (несколько роутеров)\n"
+            "- /test_router [router]\n"
         )
     else:
         text = (
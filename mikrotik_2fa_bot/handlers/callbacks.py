@@ -7,9 +7,9 @@ from telegram.ext import ContextTypes
 
 from mikrotik_2fa_bot.db import db_session
 from mikrotik_2fa_bot.models import VpnSession
-from mikrotik_2fa_bot.services.vpn_sessions import confirm_session, disconnect_session
+from mikrotik_2fa_bot.services.vpn_sessions import confirm_session, disconnect_session_async
 from mikrotik_2fa_bot.services.users import get_user_by_telegram_id
-from mikrotik_2fa_bot.handlers.user import _create_request_for_username
+from mikrotik_2fa_bot.handlers.user import _create_request_for_account
 from mikrotik_2fa_bot.handlers.util import is_admin
 from mikrotik_2fa_bot.services.users import approve_user, reject_user
 from mikrotik_2fa_bot.handlers.um_link import um_link_start
@@ -89,8 +89,8 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return await help_cmd(fake_update, context)
 
     if data.startswith("request:"):
-        username = data.split("request:", 1)[1]
-        await _create_request_for_username(context.bot, q.message.chat_id, q.from_user.id, username)
+        account_key = data.split("request:", 1)[1]
+        await _create_request_for_account(context.bot, q.message.chat_id, q.from_user.id, account_key)
         return
 
     if data.startswith("confirm:"):
@@ -106,14 +106,14 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await q.edit_message_text("Сессия не найдена или не принадлежит вам.")
                 return
             if decision == "no":
-                disconnect_session(db, s)
+                await disconnect_session_async(db, s)
                 await q.edit_message_text("❌ Отклонено. Доступ отключен.")
                 return
             # yes
             try:
                 from mikrotik_2fa_bot.services.scheduler import _try_enable_firewall_for_user
 
-                _try_enable_firewall_for_user(db, s)
+                await _try_enable_firewall_for_user(db, s)
             except Exception:
                 pass
             confirm_session(db, s, firewall_rule_id=s.firewall_rule_id)
@@ -132,7 +132,7 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             if not s or s.user_id != user.id:
                 await q.edit_message_text("Сессия не найдена или не принадлежит вам.")
                 return
-            disconnect_session(db, s)
+            await disconnect_session_async(db, s)
         await q.edit_message_text("🔌 Отключено.")
         return
 
@@ -149,7 +149,7 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             if not s:
                 await q.edit_message_text("Сессия не найдена.")
                 return
-            disconnect_session(db, s)
+            await disconnect_session_async(db, s)
         await q.edit_message_text("🔌 Отключено администратором.")
         return
 
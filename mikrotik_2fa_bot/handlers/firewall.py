@@ -1,11 +1,10 @@
 from __future__ import annotations
 
-import asyncio
 from telegram import Update
 from telegram.ext import ContextTypes
 
 from mikrotik_2fa_bot.handlers.util import is_admin
-from mikrotik_2fa_bot.services import mikrotik_api
+from mikrotik_2fa_bot.services import mikrotik_api_async
 from mikrotik_2fa_bot.config import settings
 
 
@@ -22,7 +21,7 @@ async def firewall_list_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(f"⏳ Загружаю firewall rules (filter comment contains: '{flt}' )...")
     try:
         # Stream + limit to reduce memory on large configs
-        rules = await asyncio.to_thread(mikrotik_api.list_firewall_filter_rules, flt if flt else None, 30)
+        rules = await mikrotik_api_async.list_firewall_filter_rules(flt if flt else None, 30)
     except Exception as e:
         await update.message.reply_text(f"❌ Ошибка чтения firewall: {e}")
         return
@@ -33,11 +32,6 @@ async def firewall_list_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     lines = []
     for r in rules[:30]:
-        rid = r.get(".id") or r.get("id") or "?"
-        chain = r.get("chain") or "-"
-        action = r.get("action") or "-"
-        disabled = r.get("disabled")
-        comment = (r.get("comment") or "").strip()
-        lines.append(f"- {rid} | {chain} | {action} | disabled={disabled} | {comment}")
+        lines.append(f"- {r.label}")
     await update.message.reply_text("Firewall rules:\n" + "\n".join(lines))
 
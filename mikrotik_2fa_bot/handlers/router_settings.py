@@ -8,6 +8,7 @@ from mikrotik_2fa_bot.handlers.util import is_admin
 from mikrotik_2fa_bot.services.app_settings import set_setting, get_setting
 from mikrotik_2fa_bot.services.app_settings import apply_router_overrides_to_runtime_settings
 from mikrotik_2fa_bot.config import settings
+from mikrotik_2fa_bot.services import mikrotik_api_async
 
 
 CHOOSE_FIELD, ENTER_VALUE = range(2)
@@ -137,6 +138,8 @@ async def router_settings_value(update: Update, context: ContextTypes.DEFAULT_TY
         set_setting(db, key, val, encrypt=encrypt)
         # Apply immediately (no restart required)
         apply_router_overrides_to_runtime_settings(db, settings)
+    # Don't keep pooled connections opened with the old parameters
+    mikrotik_api_async.reset_pool()
     await update.message.reply_text(f"✅ Сохранено: {label}")
     await update.message.reply_text("Настройки роутера: выберите что изменить:", reply_markup=_kb())
     return CHOOSE_FIELD
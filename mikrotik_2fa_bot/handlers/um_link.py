@@ -1,65 +1,159 @@
 from __future__ import annotations
 
-import asyncio
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import ContextTypes, ConversationHandler
 
 from mikrotik_2fa_bot.handlers.util import is_admin
 from mikrotik_2fa_bot.db import db_session
-from mikrotik_2fa_bot.services.users import bind_account, list_users
-from mikrotik_2fa_bot.models import User
-from mikrotik_2fa_bot.services.um_cache import (
-    refresh_um_users_cache,
-    count_um_users_cache,
-    list_um_users_page,
-)
+from mikrotik_2fa_bot.services.users import bind_account, count_users, list_users_page
+from mikrotik_2fa_bot.services.routers import RouterTarget, list_router_targets, router_id_from_key, router_key
+from mikrotik_2fa_bot.services.cache_refresher import UM_USERS, cache_age_seconds, describe_age, refresh_cache, revalidate
+from mikrotik_2fa_bot.services.cache_sync import KeysetPage
+from mikrotik_2fa_bot.services.um_cache import count_um_users_cache, list_um_users_page
 
 
-CHOOSE_TG, CHOOSE_UM = range(2)
+CHOOSE_TG, CHOOSE_UM, CHOOSE_ROUTER, SEARCH_UM, SEARCH_TG = range(5)
 PAGE_SIZE = 12
+_NO_USERS = "Нет зарегистрированных пользователей. Пусть пользователь напишет /start или создайте его через /create_user."
 
 
-def _tg_page_kb(users: list[User], page: int) -> InlineKeyboardMarkup:
-    page = max(0, int(page))
-    start = page * PAGE_SIZE
-    end = min(len(users), start + PAGE_SIZE)
+def _tg_page_kb(page: KeysetPage, searching: bool = False) -> InlineKeyboardMarkup:
     rows: list[list[InlineKeyboardButton]] = []
-    for i in range(start, end):
-        u = users[i]
+    for u in page.rows:
         label = f"{u.telegram_id} | {u.full_name or '-'} | {u.status.value}"
         rows.append([InlineKeyboardButton(label[:60], callback_data=f"tg_pick:{u.telegram_id}")])
+    # Keyset paging by telegram_id of the first/last shown user
     nav: list[InlineKeyboardButton] = []
-    if start > 0:
-        nav.append(InlineKeyboardButton("⬅️ Назад", callback_data=f"tg_page:{page-1}"))
-    if end < len(users):
-        nav.append(InlineKeyboardButton("➡️ Далее", callback_data=f"tg_page:{page+1}"))
+    if page.has_prev and page.rows:
+        nav.append(InlineKeyboardButton("⬅️ Назад", callback_data=f"tg_prev:{page.rows[0].telegram_id}"))
+    if page.has_next and page.rows:
+        nav.append(InlineKeyboardButton("➡️ Далее", callback_data=f"tg_next:{page.rows[-1].telegram_id}"))
     if nav:
         rows.append(nav)
+    rows.append([InlineKeyboardButton("🔎 Поиск", callback_data="tg_search")])
+    if searching:
+        rows.append([InlineKeyboardButton("✖️ Сбросить поиск", callback_data="tg_search_clear")])
     rows.append([InlineKeyboardButton("Отмена", callback_data="um_cancel")])
     return InlineKeyboardMarkup(rows)
 
 
-def _um_page_kb(items, page: int, total: int) -> InlineKeyboardMarkup:
-    page = max(0, int(page))
-    total = max(0, int(total))
-    start = page * PAGE_SIZE
-    end = min(total, start + max(0, len(items)))
+def _tg_picker(context: ContextTypes.DEFAULT_TYPE) -> tuple[str, InlineKeyboardMarkup] | None:
+    """First page of Telegram users (within the current search); None if there are no users at all."""
+    search = context.user_data.get("tg_search")
+    with db_session() as db:
+        total = count_users(db, search)
+        page = list_users_page(db, PAGE_SIZE, search)
+    if not total and not search:
+        return None
+    if search:
+        text = f"Найдено по «{search}»: {total}" if total else f"Ничего не найдено по «{search}»."
+    else:
+        text = f"Выберите Telegram пользователя (всего: {total}):"
+    return text, _tg_page_kb(page, searching=bool(search))
+
+
+def _router_kb(targets: list[RouterTarget]) -> InlineKeyboardMarkup:
+    rows = [
+        [InlineKeyboardButton(f"{t.name} ({t.cfg.host})"[:60], callback_data=f"um_router:{router_key(t.router_id)}")]
+        for t in targets
+    ]
+    rows.append([InlineKeyboardButton("Отмена", callback_data="um_cancel")])
+    return InlineKeyboardMarkup(rows)
+
+
+async def _show_um_users(q, context: ContextTypes.DEFAULT_TYPE, router_id: int | None, force: bool = False):
+    context.user_data["um_link_router"] = router_id
+    if not force:
+        context.user_data.pop("um_link_prefix", None)
+    # Served from the cache at once; only an empty cache or "refresh" waits for the router.
+    age = None if force else revalidate(UM_USERS, router_id)
+    if age is None:
+        await q.edit_message_text("⏳ Загружаю список User Manager пользователей…")
+        try:
+            await refresh_cache(UM_USERS, router_id, force=force)
+        except Exception as e:
+            await q.edit_message_text(f"Не удалось получить список User Manager users: {e}")
+            return ConversationHandler.END
+        age = 0.0
+    picker = _um_picker(context, age)
+    if picker is None:
+        await q.edit_message_text("User Manager users не найдены на роутере.")
+        return ConversationHandler.END
+    await q.edit_message_text(picker[0], reply_markup=picker[1])
+    return CHOOSE_UM
+
+
+def _um_picker(context: ContextTypes.DEFAULT_TYPE, age: float | None) -> tuple[str, InlineKeyboardMarkup] | None:
+    """First page of the picker (within the current search); None if the cache is empty."""
+    router_id = context.user_data.get("um_link_router")
+    prefix = context.user_data.get("um_link_prefix")
+    with db_session() as db:
+        total = count_um_users_cache(db, router_id, prefix)
+        page = list_um_users_page(db, PAGE_SIZE, router_id, prefix)
+    if not total and not prefix:
+        return None
+    if prefix:
+        text = f"Найдено по «{prefix}»: {total}" if total else f"Ничего не найдено по «{prefix}»."
+    else:
+        text = f"Выберите User Manager пользователя для привязки (всего: {total}, обновлено {describe_age(age)} назад):"
+    return text, _um_page_kb(page, searching=bool(prefix))
+
+
+def _um_page_kb(page: KeysetPage, searching: bool = False) -> InlineKeyboardMarkup:
     kb_rows: list[list[InlineKeyboardButton]] = []
-    for r in items:
+    for r in page.rows:
         label = (getattr(r, "username", "") or "").strip() or "-"
         rid = int(getattr(r, "id", 0) or 0)
         kb_rows.append([InlineKeyboardButton(label[:60], callback_data=f"um_pick_id:{rid}")])
+    # Keyset paging: the buttons carry the cache row id of the first/last shown user.
     nav: list[InlineKeyboardButton] = []
-    if start > 0:
-        nav.append(InlineKeyboardButton("⬅️ Назад", callback_data=f"um_page:{page-1}"))
-    if end < total:
-        nav.append(InlineKeyboardButton("➡️ Далее", callback_data=f"um_page:{page+1}"))
+    if page.has_prev and page.rows:
+        nav.append(InlineKeyboardButton("⬅️ Назад", callback_data=f"um_prev:{page.rows[0].id}"))
+    if page.has_next and page.rows:
+        nav.append(InlineKeyboardButton("➡️ Далее", callback_data=f"um_next:{page.rows[-1].id}"))
     if nav:
         kb_rows.append(nav)
+    kb_rows.append(
+        [
+            InlineKeyboardButton("🔎 Поиск", callback_data="um_search"),
+            InlineKeyboardButton("🔄 Обновить", callback_data="um_refresh"),
+        ]
+    )
+    if searching:
+        kb_rows.append([InlineKeyboardButton("✖️ Сбросить поиск", callback_data="um_search_clear")])
     kb_rows.append([InlineKeyboardButton("Отмена", callback_data="um_cancel")])
     return InlineKeyboardMarkup(kb_rows)
 
 
+async def um_link_search_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Typed username prefix (SEARCH_UM state): answers with the matching page."""
+    if not is_admin(update.effective_chat.id, update.effective_user.id, update.effective_user.username):
+        await update.message.reply_text("Недостаточно прав.")
+        return ConversationHandler.END
+    context.user_data["um_link_prefix"] = (update.message.text or "").strip() or None
+    router_id = context.user_data.get("um_link_router")
+    picker = _um_picker(context, cache_age_seconds(UM_USERS, router_id))
+    if picker is None:
+        await update.message.reply_text("User Manager users не найдены на роутере.")
+        return ConversationHandler.END
+    await update.message.reply_text(picker[0], reply_markup=picker[1])
+    return CHOOSE_UM
+
+
+async def um_link_tg_search_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Typed name / telegram_id (SEARCH_TG state): answers with the matching page."""
+    if not is_admin(update.effective_chat.id, update.effective_user.id, update.effective_user.username):
+        await update.message.reply_text("Недостаточно прав.")
+        return ConversationHandler.END
+    context.user_data["tg_search"] = (update.message.text or "").strip() or None
+    picker = _tg_picker(context)
+    if picker is None:
+        await update.message.reply_text(_NO_USERS)
+        return ConversationHandler.END
+    await update.message.reply_text(picker[0], reply_markup=picker[1])
+    return CHOOSE_TG
+
+
 async def um_link_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(update.effective_chat.id, update.effective_user.id, update.effective_user.username):
         msg = update.message or (update.callback_query.message if update.callback_query else None)
@@ -68,14 +162,13 @@ async def um_link_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ConversationHandler.END
     msg = update.message or (update.callback_query.message if update.callback_query else None)
     if msg:
-        # show list of known users
-        with db_session() as db:
-            users = list_users(db, limit=500)
-        if not users:
-            await msg.reply_text("Нет зарегистрированных пользователей. Пусть пользователь напишет /start или создайте его через /create_user.")
+        # show known users, paged straight from the database
+        context.user_data.pop("tg_search", None)
+        picker = _tg_picker(context)
+        if picker is None:
+            await msg.reply_text(_NO_USERS)
             return ConversationHandler.END
-        context.user_data["tg_users"] = users
-        await msg.reply_text("Выберите Telegram пользователя:", reply_markup=_tg_page_kb(users, 0))
+        await msg.reply_text(picker[0], reply_markup=picker[1])
     return CHOOSE_TG
 
 
@@ -92,44 +185,72 @@ async def um_link_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ConversationHandler.END
 
     # Step 1: choose Telegram user
-    tg_users: list[User] = context.user_data.get("tg_users") or []
-    if data.startswith("tg_page:"):
-        page = int(data.split("tg_page:", 1)[1])
-        await q.edit_message_reply_markup(reply_markup=_tg_page_kb(tg_users, page))
+    if data.startswith(("tg_next:", "tg_prev:")):
+        direction, anchor = data.split(":", 1)
+        search = context.user_data.get("tg_search")
+        with db_session() as db:
+            if direction == "tg_next":
+                page = list_users_page(db, PAGE_SIZE, search, after_telegram_id=int(anchor))
+            else:
+                page = list_users_page(db, PAGE_SIZE, search, before_telegram_id=int(anchor))
+        await q.edit_message_reply_markup(reply_markup=_tg_page_kb(page, searching=bool(search)))
+        return CHOOSE_TG
+
+    if data == "tg_search":
+        await q.edit_message_text("🔎 Введите часть имени или telegram_id:")
+        return SEARCH_TG
+
+    if data == "tg_search_clear":
+        context.user_data.pop("tg_search", None)
+        picker = _tg_picker(context)
+        if picker is None:
+            await q.edit_message_text(_NO_USERS)
+            return ConversationHandler.END
+        await q.edit_message_text(picker[0], reply_markup=picker[1])
         return CHOOSE_TG
 
     if data.startswith("tg_pick:"):
         tid = int(data.split("tg_pick:", 1)[1])
         context.user_data["um_link_tid"] = tid
 
-        await q.edit_message_text("⏳ Загружаю список User Manager пользователей…")
-        try:
-            def _job():
-                with db_session() as db:
-                    refresh_um_users_cache(db)
-                    total = count_um_users_cache(db)
-                    first = list_um_users_page(db, 0, PAGE_SIZE)
-                    return total, first
-
-            total, first_rows = await asyncio.to_thread(_job)
-        except Exception as e:
-            await q.edit_message_text(f"Не удалось получить список User Manager users: {e}")
-            return ConversationHandler.END
-        if not total:
+        # Step 2 (several routers only): choose the router the UM user lives on
+        with db_session() as db:
+            targets = list_router_targets(db)
+        if len(targets) > 1:
+            await q.edit_message_text("Выберите роутер:", reply_markup=_router_kb(targets))
+            return CHOOSE_ROUTER
+        return await _show_um_users(q, context, targets[0].router_id if targets else None)
+
+    if data.startswith("um_router:"):
+        return await _show_um_users(q, context, router_id_from_key(data.split("um_router:", 1)[1]))
+
+    if data == "um_refresh":
+        return await _show_um_users(q, context, context.user_data.get("um_link_router"), force=True)
+
+    if data == "um_search":
+        await q.edit_message_text("🔎 Введите начало имени UM пользователя:")
+        return SEARCH_UM
+
+    if data == "um_search_clear":
+        context.user_data.pop("um_link_prefix", None)
+        router_id = context.user_data.get("um_link_router")
+        picker = _um_picker(context, cache_age_seconds(UM_USERS, router_id))
+        if picker is None:
             await q.edit_message_text("User Manager users не найдены на роутере.")
             return ConversationHandler.END
-        await q.edit_message_text(
-            f"Выберите User Manager пользователя для привязки (всего: {total}):",
-            reply_markup=_um_page_kb(first_rows, 0, total),
-        )
+        await q.edit_message_text(picker[0], reply_markup=picker[1])
         return CHOOSE_UM
 
-    if data.startswith("um_page:"):
-        page = int(data.split("um_page:", 1)[1])
+    if data.startswith(("um_next:", "um_prev:")):
+        direction, anchor = data.split(":", 1)
+        router_id = context.user_data.get("um_link_router")
+        prefix = context.user_data.get("um_link_prefix")
         with db_session() as db:
-            total = count_um_users_cache(db)
-            page_rows = list_um_users_page(db, page, PAGE_SIZE)
-        await q.edit_message_reply_markup(reply_markup=_um_page_kb(page_rows, page, total))
+            if direction == "um_next":
+                page = list_um_users_page(db, PAGE_SIZE, router_id, prefix, after_id=int(anchor))
+            else:
+                page = list_um_users_page(db, PAGE_SIZE, router_id, prefix, before_id=int(anchor))
+        await q.edit_message_reply_markup(reply_markup=_um_page_kb(page, searching=bool(prefix)))
         return CHOOSE_UM
 
     if data.startswith("um_pick_id:"):
@@ -147,7 +268,7 @@ async def um_link_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     await q.edit_message_text("UM пользователь не найден (кэш устарел). Запустите /link_um заново.")
                     return ConversationHandler.END
                 uname = row.username
-                bind_account(db, tid, uname)
+                bind_account(db, tid, uname, router_id_from_key(row.router_id))
             await q.edit_message_text(f"✅ Привязано: telegram_id={tid} → UM user={uname}")
         except Exception as e:
             await q.edit_message_text(f"❌ Ошибка привязки: {e}")
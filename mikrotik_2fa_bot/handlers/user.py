@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+import asyncio
+
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import ContextTypes
 
@@ -7,13 +9,16 @@ from mikrotik_2fa_bot.db import db_session
 from mikrotik_2fa_bot.handlers.menu import main_menu
 from mikrotik_2fa_bot.handlers.util import is_admin
 from mikrotik_2fa_bot.models import UserStatus, VpnSession
-from mikrotik_2fa_bot.services import mikrotik_api
+from mikrotik_2fa_bot.services import mikrotik_api_async
+from mikrotik_2fa_bot.services.notifier import Priority, notify
+from mikrotik_2fa_bot.services.ros_common import MikroTikAPIError
+from mikrotik_2fa_bot.services.routers import get_router_config, router_name
 from mikrotik_2fa_bot.services.users import get_user_by_telegram_id, list_user_accounts
 from mikrotik_2fa_bot.services.vpn_sessions import (
-    create_vpn_request,
+    create_vpn_request_async,
     list_user_active_sessions,
     get_active_session_for_user,
-    disconnect_session,
+    disconnect_session_async,
 )
 
 
@@ -34,15 +39,21 @@ async def request_vpn_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text(f"У вас уже есть активная сессия: {existing.status.value} ({existing.id})")
             return
         accounts = list_user_accounts(db, user.id)
-        usernames = [a.mikrotik_username for a in accounts]
+        account_ids = [a.id for a in accounts]
+        labels = [
+            a.mikrotik_username if a.router_id is None else f"{a.mikrotik_username} @ {router_name(db, a.router_id)}"
+            for a in accounts
+        ]
 
-    if not usernames:
+    if not account_ids:
         await update.message.reply_text("Администратор ещё не привязал ваш MikroTik аккаунт.")
         return
-    if len(usernames) == 1:
-        await _create_request_for_username(context.bot, update.effective_chat.id, uid, usernames[0])
+    if len(account_ids) == 1:
+        await _create_request_for_account(context.bot, update.effective_chat.id, uid, account_ids[0])
         return
-    kb = InlineKeyboardMarkup([[InlineKeyboardButton(u, callback_data=f"request:{u}")] for u in usernames[:20]])
+    kb = InlineKeyboardMarkup(
+        [[InlineKeyboardButton(label, callback_data=f"request:{a}")] for a, label in zip(account_ids[:20], labels)]
+    )
     await update.message.reply_text("Выберите MikroTik аккаунт для активации:", reply_markup=kb)
 
 
@@ -82,35 +93,55 @@ async def disable_vpn_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         sessions = list_user_active_sessions(db, user.id)
         accounts = list_user_accounts(db, user.id)
         for s in sessions:
-            disconnect_session(db, s)
+            await disconnect_session_async(db, s)
+        # One multi-id set per router for all accounts instead of a round trip per account
+        by_router: dict[int | None, list[str]] = {}
         for a in accounts:
-            try:
-                mikrotik_api.set_vpn_user_disabled(a.mikrotik_username, disabled=True)
-            except Exception:
-                pass
+            by_router.setdefault(a.router_id, []).append(a.mikrotik_username)
+        cfgs = {rid: get_router_config(db, rid) for rid in by_router}
+        await asyncio.gather(
+            *(
+                mikrotik_api_async.set_vpn_users_disabled(names, disabled=True, cfg=cfgs[rid])
+                for rid, names in by_router.items()
+                if cfgs[rid] is not None
+            ),
+            return_exceptions=True,
+        )
     await update.message.reply_text("Готово. Доступ отключен.", reply_markup=main_menu(is_admin=is_admin(chat_id, uid, username)))
 
 
-async def _create_request_for_username(bot, chat_id: int, telegram_user_id: int, username: str):
+async def _create_request_for_account(bot, chat_id: int, telegram_user_id: int, account_key: str):
+    """account_key: MikrotikAccount.id (buttons sent before accounts became per-router carry the username)."""
     with db_session() as db:
         user = get_user_by_telegram_id(db, telegram_user_id)
         if not user:
-            await bot.send_message(chat_id=chat_id, text="Вы не зарегистрированы.")
+            notify(bot, chat_id, "Вы не зарегистрированы.", Priority.REPLY)
+            return
+        accounts = list_user_accounts(db, user.id)
+        acct = next((a for a in accounts if a.id == account_key), None)
+        if acct is None:
+            by_name = [a for a in accounts if a.mikrotik_username == account_key]
+            acct = by_name[0] if len(by_name) == 1 else None
+        if not acct:
+            notify(bot, chat_id, "Этот MikroTik аккаунт больше не привязан к вам.", Priority.REPLY)
             return
+        username = acct.mikrotik_username
         try:
-            s = create_vpn_request(db, user, username)
-        except mikrotik_api.MikroTikAPIError as e:
-            await bot.send_message(chat_id=chat_id, text=f"Не удалось активировать аккаунт на MikroTik: {e}")
+            s = await create_vpn_request_async(db, user, username, acct.router_id)
+        except MikroTikAPIError as e:
+            notify(bot, chat_id, f"Не удалось активировать аккаунт на MikroTik: {e}", Priority.REPLY)
             return
         except Exception as e:
-            await bot.send_message(chat_id=chat_id, text=f"Ошибка: {e}")
+            notify(bot, chat_id, f"Ошибка: {e}", Priority.REPLY)
             return
-    await bot.send_message(
-        chat_id=chat_id,
-        text=(
+    notify(
+        bot,
+        chat_id,
+        (
             f"✅ Аккаунт активирован: {username}\n"
             f"ID запроса: {s.id}\n\n"
             "Подключайтесь к VPN. Если включена 2FA — придёт подтверждение."
         ),
+        Priority.REPLY,
     )
 
@@ -1,6 +1,5 @@
 from __future__ import annotations
 
-import asyncio
 from dataclasses import dataclass
 
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
@@ -10,13 +9,24 @@ from mikrotik_2fa_bot.config import settings
 from mikrotik_2fa_bot.db import db_session
 from mikrotik_2fa_bot.handlers.util import is_admin
 from mikrotik_2fa_bot.models import User
-from mikrotik_2fa_bot.services.users import list_users, bind_account, set_user_firewall_rule_id, cycle_user_require_confirmation
-from mikrotik_2fa_bot.services.um_cache import refresh_um_users_cache_in_new_session, count_um_users_cache, list_um_users_page
-from mikrotik_2fa_bot.services.fw_cache import refresh_firewall_rules_cache, count_firewall_rules_cache, list_firewall_rules_page
-
-
-US_CHOOSE_USER, US_ACTION, US_CHOOSE_UM, US_CHOOSE_FW = range(4)
+from mikrotik_2fa_bot.services.routers import RouterTarget, list_router_targets, router_id_from_key, router_key
+from mikrotik_2fa_bot.services.users import bind_account, count_users, list_users_page, set_user_firewall_rule_id, cycle_user_require_confirmation
+from mikrotik_2fa_bot.services.cache_refresher import (
+    FIREWALL_RULES,
+    UM_USERS,
+    cache_age_seconds,
+    describe_age,
+    refresh_cache,
+    revalidate,
+)
+from mikrotik_2fa_bot.services.cache_sync import KeysetPage
+from mikrotik_2fa_bot.services.um_cache import count_um_users_cache, list_um_users_page
+from mikrotik_2fa_bot.services.fw_cache import count_firewall_rules_cache, list_firewall_rules_page
+
+
+US_CHOOSE_USER, US_ACTION, US_CHOOSE_UM, US_CHOOSE_FW, US_CHOOSE_ROUTER, US_SEARCH = range(6)
 PAGE_SIZE = 10
+_NO_USERS = "Нет пользователей в базе. Пусть пользователь напишет /start или создайте через /create_user."
 
 
 def _short(s: str, n: int = 54) -> str:
@@ -24,25 +34,40 @@ def _short(s: str, n: int = 54) -> str:
     return s if len(s) <= n else s[: n - 1] + "…"
 
 
-def _users_kb(users: list[User], page: int) -> InlineKeyboardMarkup:
-    page = max(0, int(page))
-    start = page * PAGE_SIZE
-    end = min(len(users), start + PAGE_SIZE)
+def _users_kb(page: KeysetPage, searching: bool = False) -> InlineKeyboardMarkup:
     rows: list[list[InlineKeyboardButton]] = []
-    for u in users[start:end]:
+    for u in page.rows:
         label = f"{u.telegram_id} | {u.full_name or '-'} | {u.status.value}"
         rows.append([InlineKeyboardButton(_short(label), callback_data=f"us_user_pick:{u.telegram_id}")])
     nav: list[InlineKeyboardButton] = []
-    if start > 0:
-        nav.append(InlineKeyboardButton("⬅️", callback_data=f"us_user_page:{page-1}"))
-    if end < len(users):
-        nav.append(InlineKeyboardButton("➡️", callback_data=f"us_user_page:{page+1}"))
+    if page.has_prev and page.rows:
+        nav.append(InlineKeyboardButton("⬅️", callback_data=f"us_user_prev:{page.rows[0].telegram_id}"))
+    if page.has_next and page.rows:
+        nav.append(InlineKeyboardButton("➡️", callback_data=f"us_user_next:{page.rows[-1].telegram_id}"))
     if nav:
         rows.append(nav)
+    rows.append([InlineKeyboardButton("🔎 Поиск", callback_data="us_user_search")])
+    if searching:
+        rows.append([InlineKeyboardButton("✖️ Сбросить поиск", callback_data="us_user_search_clear")])
     rows.append([InlineKeyboardButton("Отмена", callback_data="us_cancel")])
     return InlineKeyboardMarkup(rows)
 
 
+def _users_picker(context: ContextTypes.DEFAULT_TYPE) -> tuple[str, InlineKeyboardMarkup] | None:
+    """First page of users, read from the database (within the current search); None if there are none."""
+    search = context.user_data.get("us_user_search")
+    with db_session() as db:
+        total = count_users(db, search)
+        page = list_users_page(db, PAGE_SIZE, search)
+    if not total and not search:
+        return None
+    if search:
+        text = f"Найдено по «{search}»: {total}" if total else f"Ничего не найдено по «{search}»."
+    else:
+        text = "⚙️ Настройки пользователя: выберите пользователя"
+    return text, _users_kb(page, searching=bool(search))
+
+
 def _action_kb(user: User) -> InlineKeyboardMarkup:
     rc = getattr(user, "require_confirmation", None)
     if rc is None:
@@ -61,28 +86,184 @@ def _action_kb(user: User) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(rows)
 
 
-def _cache_kb(items, total: int, prefix: str, page: int, back_cb: str) -> InlineKeyboardMarkup:
-    page = max(0, int(page))
-    start = page * PAGE_SIZE
-    total = max(0, int(total))
-    end = min(total, start + max(0, len(items)))
+def _cache_kb(page: KeysetPage, prefix: str, back_cb: str, searching: bool = False) -> InlineKeyboardMarkup:
     rows: list[list[InlineKeyboardButton]] = []
-    for r in items:
+    for r in page.rows:
         label = _short(getattr(r, "label", None) or getattr(r, "username", None) or "-")
         rid = int(getattr(r, "id", 0) or 0)
         rows.append([InlineKeyboardButton(label, callback_data=f"{prefix}_pick_id:{rid}")])
+    # Keyset paging: the buttons carry the cache row id of the first/last shown item.
     nav: list[InlineKeyboardButton] = []
-    if start > 0:
-        nav.append(InlineKeyboardButton("⬅️", callback_data=f"{prefix}_page:{page-1}"))
-    if end < total:
-        nav.append(InlineKeyboardButton("➡️", callback_data=f"{prefix}_page:{page+1}"))
+    if page.has_prev and page.rows:
+        nav.append(InlineKeyboardButton("⬅️", callback_data=f"{prefix}_prev:{page.rows[0].id}"))
+    if page.has_next and page.rows:
+        nav.append(InlineKeyboardButton("➡️", callback_data=f"{prefix}_next:{page.rows[-1].id}"))
     if nav:
         rows.append(nav)
+    rows.append(
+        [
+            InlineKeyboardButton("🔎 Поиск", callback_data=f"{prefix}_search"),
+            InlineKeyboardButton("🔄 Обновить", callback_data=f"{prefix}_refresh"),
+        ]
+    )
+    if searching:
+        rows.append([InlineKeyboardButton("✖️ Сбросить поиск", callback_data=f"{prefix}_search_clear")])
     rows.append([InlineKeyboardButton("⬅️ Назад", callback_data=back_cb)])
     rows.append([InlineKeyboardButton("Отмена", callback_data="us_cancel")])
     return InlineKeyboardMarkup(rows)
 
 
+def _router_kb(targets: list[RouterTarget]) -> InlineKeyboardMarkup:
+    rows = [
+        [InlineKeyboardButton(_short(f"{t.name} ({t.cfg.host})"), callback_data=f"us_router:{router_key(t.router_id)}")]
+        for t in targets
+    ]
+    rows.append([InlineKeyboardButton("⬅️ Назад", callback_data="us_back:actions")])
+    rows.append([InlineKeyboardButton("Отмена", callback_data="us_cancel")])
+    return InlineKeyboardMarkup(rows)
+
+
+async def _show_um_users(q, context: ContextTypes.DEFAULT_TYPE, router_id: int | None, force: bool = False):
+    return await _show_picker(q, context, "us_um", router_id, force)
+
+
+async def _show_fw_rules(q, context: ContextTypes.DEFAULT_TYPE, router_id: int | None, force: bool = False):
+    return await _show_picker(q, context, "us_fw", router_id, force)
+
+
+# Per picker (callback prefix): cache kind, state, loading / load error / empty texts
+_PICKERS = {
+    "us_um": (
+        UM_USERS,
+        US_CHOOSE_UM,
+        "⏳ Загружаю список User Manager users…",
+        "❌ Не удалось получить список UM users: {}",
+        "User Manager users не найдены на роутере.",
+    ),
+    "us_fw": (
+        FIREWALL_RULES,
+        US_CHOOSE_FW,
+        "⏳ Загружаю firewall rules…",
+        "❌ Ошибка чтения firewall: {}",
+        "Правила не найдены (попробуйте добавить comment или изменить FIREWALL_COMMENT_PREFIX).",
+    ),
+}
+
+
+async def _show_picker(q, context: ContextTypes.DEFAULT_TYPE, prefix: str, router_id: int | None, force: bool):
+    """
+    Served from the cache at once (stale entries are revalidated in the background);
+    an empty cache or "refresh" waits for the router. A new picker drops the search.
+    """
+    kind, state, loading, failed, empty = _PICKERS[prefix]
+    context.user_data["us_router"] = router_id
+    if not force:
+        context.user_data.pop("us_search", None)
+    age = None if force else revalidate(kind, router_id)
+    if age is None:
+        await q.edit_message_text(loading)
+        try:
+            await refresh_cache(kind, router_id, force=force)
+        except Exception as e:
+            await q.edit_message_text(failed.format(e))
+            return ConversationHandler.END
+        age = 0.0
+    picker = _picker(context, prefix, age)
+    if picker is None:
+        await q.edit_message_text(empty)
+        return ConversationHandler.END
+    await q.edit_message_text(picker[0], reply_markup=picker[1])
+    return state
+
+
+def _picker_page(db, prefix: str, router_id: int | None, search: str | None, **anchor) -> KeysetPage:
+    if prefix == "us_um":
+        return list_um_users_page(db, PAGE_SIZE, router_id, search, **anchor)
+    flt = (settings.FIREWALL_COMMENT_PREFIX or "").strip() or None
+    return list_firewall_rules_page(db, PAGE_SIZE, router_id, flt, search, **anchor)
+
+
+def _picker(context: ContextTypes.DEFAULT_TYPE, prefix: str, age: float | None) -> tuple[str, InlineKeyboardMarkup] | None:
+    """First page of a picker (within the current search); None if there is nothing to pick."""
+    router_id = context.user_data.get("us_router")
+    search = context.user_data.get("us_search")
+    with db_session() as db:
+        if prefix == "us_um":
+            total = count_um_users_cache(db, router_id, search)
+        else:
+            flt = (settings.FIREWALL_COMMENT_PREFIX or "").strip() or None
+            total = count_firewall_rules_cache(db, router_id, flt, search)
+        page = _picker_page(db, prefix, router_id, search)
+    if not total and not search:
+        return None
+    if search:
+        text = f"Найдено по «{search}»: {total}" if total else f"Ничего не найдено по «{search}»."
+    elif prefix == "us_um":
+        text = f"Выберите UM пользователя (всего: {total}, обновлено {describe_age(age)} назад):"
+    else:
+        text = f"Выберите firewall rule для пользователя (всего: {total}, обновлено {describe_age(age)} назад):"
+    return text, _cache_kb(page, prefix, "us_back:actions", searching=bool(search))
+
+
+async def _picker_callback(q, context: ContextTypes.DEFAULT_TYPE, prefix: str, action: str):
+    """Search, paging and refresh buttons shared by both pickers."""
+    kind, state, _loading, _failed, empty = _PICKERS[prefix]
+    router_id = context.user_data.get("us_router")
+    if action == "refresh":
+        return await _show_picker(q, context, prefix, router_id, force=True)
+    if action == "search":
+        context.user_data["us_search_picker"] = prefix
+        what = "имени UM пользователя" if prefix == "us_um" else "comment правила"
+        await q.edit_message_text(f"🔎 Введите начало {what}:")
+        return US_SEARCH
+    if action == "search_clear":
+        context.user_data.pop("us_search", None)
+        picker = _picker(context, prefix, cache_age_seconds(kind, router_id))
+        if picker is None:
+            await q.edit_message_text(empty)
+            return ConversationHandler.END
+        await q.edit_message_text(picker[0], reply_markup=picker[1])
+        return state
+    # next:<row id> / prev:<row id>
+    direction, anchor = action.split(":", 1)
+    search = context.user_data.get("us_search")
+    key = "after_id" if direction == "next" else "before_id"
+    with db_session() as db:
+        page = _picker_page(db, prefix, router_id, search, **{key: int(anchor)})
+    await q.edit_message_reply_markup(reply_markup=_cache_kb(page, prefix, "us_back:actions", searching=bool(search)))
+    return state
+
+
+async def user_settings_search_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Typed search prefix (US_SEARCH state): answers with the matching picker page."""
+    if not is_admin(update.effective_chat.id, update.effective_user.id, update.effective_user.username):
+        await update.message.reply_text("Недостаточно прав.")
+        return ConversationHandler.END
+    prefix = context.user_data.get("us_search_picker")
+    if prefix == "us_user":
+        context.user_data["us_user_search"] = (update.message.text or "").strip() or None
+        picker = _users_picker(context)
+        if picker is None:
+            await update.message.reply_text(_NO_USERS)
+            return ConversationHandler.END
+        await update.message.reply_text(picker[0], reply_markup=picker[1])
+        return US_CHOOSE_USER
+    if prefix not in _PICKERS:
+        await update.message.reply_text("Сессия устарела. Запустите снова.")
+        return ConversationHandler.END
+    kind, state, _loading, _failed, empty = _PICKERS[prefix]
+    context.user_data["us_search"] = (update.message.text or "").strip() or None
+    picker = _picker(context, prefix, cache_age_seconds(kind, context.user_data.get("us_router")))
+    if picker is None:
+        await update.message.reply_text(empty)
+        return ConversationHandler.END
+    await update.message.reply_text(picker[0], reply_markup=picker[1])
+    return state
+
+
+_ROUTER_ACTIONS = {"bind_um": _show_um_users, "set_fw": _show_fw_rules}
+
+
 async def user_settings_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msg = update.message or (update.callback_query.message if update.callback_query else None)
     if not is_admin(update.effective_chat.id, update.effective_user.id, update.effective_user.username):
@@ -90,16 +271,14 @@ async def user_settings_start(update: Update, context: ContextTypes.DEFAULT_TYPE
             await msg.reply_text("Недостаточно прав.")
         return ConversationHandler.END
 
-    with db_session() as db:
-        users = list_users(db, limit=500)
-    if not users:
+    context.user_data.pop("us_user_search", None)
+    picker = _users_picker(context)
+    if picker is None:
         if msg:
-            await msg.reply_text("Нет пользователей в базе. Пусть пользователь напишет /start или создайте через /create_user.")
+            await msg.reply_text(_NO_USERS)
         return ConversationHandler.END
-
-    context.user_data["us_users"] = users
     if msg:
-        await msg.reply_text("⚙️ Настройки пользователя: выберите пользователя", reply_markup=_users_kb(users, 0))
+        await msg.reply_text(picker[0], reply_markup=picker[1])
     return US_CHOOSE_USER
 
 
@@ -118,10 +297,30 @@ async def user_settings_callback(update: Update, context: ContextTypes.DEFAULT_T
         await q.edit_message_text("Отменено.")
         return ConversationHandler.END
 
-    if data.startswith("us_user_page:"):
-        users: list[User] = context.user_data.get("us_users") or []
-        page = int(data.split("us_user_page:", 1)[1])
-        await q.edit_message_reply_markup(reply_markup=_users_kb(users, page))
+    if data.startswith(("us_user_next:", "us_user_prev:")):
+        direction, anchor = data.split(":", 1)
+        search = context.user_data.get("us_user_search")
+        with db_session() as db:
+            if direction == "us_user_next":
+                page = list_users_page(db, PAGE_SIZE, search, after_telegram_id=int(anchor))
+            else:
+                page = list_users_page(db, PAGE_SIZE, search, before_telegram_id=int(anchor))
+        await q.edit_message_reply_markup(reply_markup=_users_kb(page, searching=bool(search)))
+        return US_CHOOSE_USER
+
+    if data == "us_user_search":
+        context.user_data["us_search_picker"] = "us_user"
+        await q.edit_message_text("🔎 Введите часть имени или telegram_id:")
+        return US_SEARCH
+
+    if data in ("us_user_search_clear", "us_back:users"):
+        if data == "us_user_search_clear":
+            context.user_data.pop("us_user_search", None)
+        picker = _users_picker(context)
+        if picker is None:
+            await q.edit_message_text(_NO_USERS)
+            return ConversationHandler.END
+        await q.edit_message_text(picker[0], reply_markup=picker[1])
         return US_CHOOSE_USER
 
     if data.startswith("us_user_pick:"):
@@ -135,11 +334,6 @@ async def user_settings_callback(update: Update, context: ContextTypes.DEFAULT_T
         await q.edit_message_text(f"Пользователь: {u.full_name or '-'} (telegram_id={u.telegram_id})", reply_markup=_action_kb(u))
         return US_ACTION
 
-    if data == "us_back:users":
-        users: list[User] = context.user_data.get("us_users") or []
-        await q.edit_message_text("⚙️ Настройки пользователя: выберите пользователя", reply_markup=_users_kb(users, 0))
-        return US_CHOOSE_USER
-
     if data == "us_back:actions":
         tid = int(context.user_data.get("us_tid") or 0)
         with db_session() as db:
@@ -170,56 +364,32 @@ async def user_settings_callback(update: Update, context: ContextTypes.DEFAULT_T
             await q.edit_message_text(f"Пользователь: {u.full_name or '-'} (telegram_id={u.telegram_id})", reply_markup=_action_kb(u))
             return US_ACTION
 
-        if action == "bind_um":
-            await q.edit_message_text("⏳ Загружаю список User Manager users…")
-            try:
-                await asyncio.to_thread(refresh_um_users_cache_in_new_session)
-            except Exception as e:
-                await q.edit_message_text(f"❌ Не удалось получить список UM users: {e}")
-                return ConversationHandler.END
-            with db_session() as db:
-                total = count_um_users_cache(db)
-                first = list_um_users_page(db, 0, PAGE_SIZE)
-            if not total:
-                await q.edit_message_text("User Manager users не найдены на роутере.")
-                return ConversationHandler.END
-            await q.edit_message_text(
-                f"Выберите UM пользователя (всего: {total}):",
-                reply_markup=_cache_kb(first, total, "us_um", 0, "us_back:actions"),
-            )
-            return US_CHOOSE_UM
-
-        if action == "set_fw":
-            await q.edit_message_text("⏳ Загружаю firewall rules…")
-            flt = (settings.FIREWALL_COMMENT_PREFIX or "").strip() or None
-            try:
-                await asyncio.to_thread(refresh_firewall_rules_cache, flt)
-            except Exception as e:
-                await q.edit_message_text(f"❌ Ошибка чтения firewall: {e}")
-                return ConversationHandler.END
+        if action in _ROUTER_ACTIONS:
+            # UM users and firewall rules are per router: ask which one (several routers only)
             with db_session() as db:
-                total = count_firewall_rules_cache(db)
-                first = list_firewall_rules_page(db, 0, PAGE_SIZE)
-            if not total:
-                await q.edit_message_text("Правила не найдены (попробуйте добавить comment или изменить FIREWALL_COMMENT_PREFIX).")
-                return ConversationHandler.END
-            await q.edit_message_text(
-                f"Выберите firewall rule для пользователя (всего: {total}):",
-                reply_markup=_cache_kb(first, total, "us_fw", 0, "us_back:actions"),
-            )
-            return US_CHOOSE_FW
+                targets = list_router_targets(db)
+            if len(targets) > 1:
+                context.user_data["us_router_action"] = action
+                await q.edit_message_text("Выберите роутер:", reply_markup=_router_kb(targets))
+                return US_CHOOSE_ROUTER
+            return await _ROUTER_ACTIONS[action](q, context, targets[0].router_id if targets else None)
 
         await q.edit_message_text("Неизвестное действие.")
         return ConversationHandler.END
 
+    if data.startswith("us_router:"):
+        show = _ROUTER_ACTIONS.get(context.user_data.get("us_router_action") or "")
+        if not show:
+            await q.edit_message_text("Сессия устарела. Запустите снова.")
+            return ConversationHandler.END
+        return await show(q, context, router_id_from_key(data.split("us_router:", 1)[1]))
+
+    # Picker navigation shared by the UM and firewall pickers (paging, search)
+    for prefix in _PICKERS:
+        if data.startswith(f"{prefix}_") and not data.startswith(f"{prefix}_pick_id:"):
+            return await _picker_callback(q, context, prefix, data[len(prefix) + 1 :])
+
     # UM selection
-    if data.startswith("us_um_page:"):
-        page = int(data.split("us_um_page:", 1)[1])
-        with db_session() as db:
-            total = count_um_users_cache(db)
-            page_rows = list_um_users_page(db, page, PAGE_SIZE)
-        await q.edit_message_reply_markup(reply_markup=_cache_kb(page_rows, total, "us_um", page, "us_back:actions"))
-        return US_CHOOSE_UM
     if data.startswith("us_um_pick_id:"):
         pick_id = int(data.split("us_um_pick_id:", 1)[1])
         tid = int(context.user_data.get("us_tid") or 0)
@@ -228,25 +398,19 @@ async def user_settings_callback(update: Update, context: ContextTypes.DEFAULT_T
 
             row = db.query(UmUserCache).filter(UmUserCache.id == pick_id).first()
             uname = (row.username if row else "").strip()
+            router_id = router_id_from_key(row.router_id) if row else None
         if not uname:
             await q.edit_message_text("UM пользователь не найден (кэш устарел). Повторите попытку.")
             return ConversationHandler.END
         try:
             with db_session() as db:
-                bind_account(db, tid, uname)
+                bind_account(db, tid, uname, router_id)
             await q.edit_message_text(f"✅ Привязано: telegram_id={tid} → UM user={uname}")
         except Exception as e:
             await q.edit_message_text(f"❌ Ошибка привязки: {e}")
         return ConversationHandler.END
 
     # Firewall selection
-    if data.startswith("us_fw_page:"):
-        page = int(data.split("us_fw_page:", 1)[1])
-        with db_session() as db:
-            total = count_firewall_rules_cache(db)
-            page_rows = list_firewall_rules_page(db, page, PAGE_SIZE)
-        await q.edit_message_reply_markup(reply_markup=_cache_kb(page_rows, total, "us_fw", page, "us_back:actions"))
-        return US_CHOOSE_FW
     if data.startswith("us_fw_pick_id:"):
         pick_id = int(data.split("us_fw_pick_id:", 1)[1])
         tid = int(context.user_data.get("us_tid") or 0)
@@ -256,12 +420,13 @@ async def user_settings_callback(update: Update, context: ContextTypes.DEFAULT_T
             row = db.query(FirewallRuleCache).filter(FirewallRuleCache.id == pick_id).first()
             rid = (row.rule_id if row else "").strip()
             label = (row.label if row else "").strip()
+            router_id = router_id_from_key(row.router_id) if row else None
         if not rid:
             await q.edit_message_text("Правило не найдено (кэш устарел). Повторите попытку.")
             return ConversationHandler.END
         try:
             with db_session() as db:
-                set_user_firewall_rule_id(db, tid, rid)
+                set_user_firewall_rule_id(db, tid, rid, router_id)
             await q.edit_message_text(f"✅ Назначено firewall rule: telegram_id={tid} → rule_id={rid}\n{_short(label, 120)}")
         except Exception as e:
             await q.edit_message_text(f"❌ Ошибка сохранения: {e}")
@@ -13,6 +13,7 @@ from sqlalchemy import (
     Text,
     Index,
     Integer,
+    func,
 )
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
@@ -38,6 +39,25 @@ class SessionStatus(str, enum.Enum):
     EXPIRED = "expired"
 
 
+class Router(Base):
+    """
+    Additional RouterOS site. Accounts/sessions with router_id=NULL live on the
+    default router (MIKROTIK_* settings / router_settings overrides).
+    """
+    __tablename__ = "routers"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    name: Mapped[str] = mapped_column(String(64), unique=True, index=True)
+    host: Mapped[str] = mapped_column(String(255))
+    port: Mapped[int] = mapped_column(Integer, default=8728)
+    use_ssl: Mapped[bool] = mapped_column(Boolean, default=False)
+    username: Mapped[str] = mapped_column(String(255), default="")
+    # Fernet token (same key as encrypted app_settings)
+    password_encrypted: Mapped[str] = mapped_column(Text, default="")
+    timeout_seconds: Mapped[int] = mapped_column(Integer, default=5)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=_utcnow)
+
+
 class User(Base):
     __tablename__ = "users"
 
@@ -59,6 +79,8 @@ class User(Base):
 
     # Preferred firewall rule id to enable for this user (RouterOS .id)
     firewall_rule_id: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    # Router the preferred firewall rule lives on (NULL: default router)
+    firewall_router_id: Mapped[int | None] = mapped_column(Integer, ForeignKey("routers.id"), nullable=True)
 
     accounts: Mapped[list["MikrotikAccount"]] = relationship(back_populates="user", cascade="all, delete-orphan")
     sessions: Mapped[list["VpnSession"]] = relationship(back_populates="user", cascade="all, delete-orphan")
@@ -70,13 +92,23 @@ class MikrotikAccount(Base):
     id: Mapped[str] = mapped_column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     user_id: Mapped[str] = mapped_column(String(36), ForeignKey("users.id"), index=True)
     mikrotik_username: Mapped[str] = mapped_column(String(255), index=True)
+    # Router the UM user lives on (NULL: default router)
+    router_id: Mapped[int | None] = mapped_column(Integer, ForeignKey("routers.id"), nullable=True, index=True)
     is_active: Mapped[bool] = mapped_column(Boolean, default=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=_utcnow)
 
     user: Mapped[User] = relationship(back_populates="accounts")
 
 
-Index("uq_user_mikrotik_username", MikrotikAccount.user_id, MikrotikAccount.mikrotik_username, unique=True)
+# One account per (user, UM username, router); NULL router_id (default router) counts as 0,
+# so the same username can be bound on several routers but not twice on one.
+Index(
+    "uq_user_mikrotik_account",
+    MikrotikAccount.user_id,
+    MikrotikAccount.mikrotik_username,
+    func.coalesce(MikrotikAccount.router_id, 0),
+    unique=True,
+)
 
 
 class VpnSession(Base):
@@ -85,6 +117,8 @@ class VpnSession(Base):
     id: Mapped[str] = mapped_column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     user_id: Mapped[str] = mapped_column(String(36), ForeignKey("users.id"), index=True)
     mikrotik_username: Mapped[str] = mapped_column(String(255), index=True)
+    # Copied from the account at request time (NULL: default router)
+    router_id: Mapped[int | None] = mapped_column(Integer, ForeignKey("routers.id"), nullable=True, index=True)
 
     status: Mapped[SessionStatus] = mapped_column(Enum(SessionStatus), default=SessionStatus.REQUESTED, index=True)
 
@@ -104,6 +138,9 @@ class VpnSession(Base):
     last_seen_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
 
     firewall_rule_id: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    # FIREWALL_ACCESS_MODE=address_list: client's framed IP (from the router) and the entry granting access
+    client_address: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    address_list_entry_id: Mapped[str | None] = mapped_column(String(64), nullable=True)
 
     user: Mapped[User] = relationship(back_populates="sessions")
 
@@ -124,23 +161,58 @@ class UmUserCache(Base):
     """
     Cache of User Manager usernames for /link_um paging.
     Avoids keeping huge lists in bot memory.
+    router_id is 0 for the default router (NULLs would defeat the unique index).
     """
     __tablename__ = "um_user_cache"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    username: Mapped[str] = mapped_column(String(255), unique=True, index=True)
+    router_id: Mapped[int] = mapped_column(Integer, default=0)
+    username: Mapped[str] = mapped_column(String(255), index=True)
+    # Lowercased username: case-insensitive prefix search in the pickers
+    username_lc: Mapped[str] = mapped_column(String(255), default="")
     fetched_at: Mapped[datetime] = mapped_column(DateTime, default=_utcnow, index=True)
 
 
+Index("uq_um_user_cache_router_username", UmUserCache.router_id, UmUserCache.username, unique=True)
+Index("ix_um_user_cache_router_username_lc", UmUserCache.router_id, UmUserCache.username_lc)
+
+
 class FirewallRuleCache(Base):
     """
-    Cache of firewall rules for paging selection in admin UI.
-    Stores a short label + rule_id (.id) for selection.
+    Cache of all firewall filter rules of a router: paging selection in the admin UI
+    (short label + rule_id) and the comment -> rule_id index.
+    router_id is 0 for the default router, as in UmUserCache.
     """
     __tablename__ = "firewall_rule_cache"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    rule_id: Mapped[str] = mapped_column(String(255), unique=True, index=True)
+    router_id: Mapped[int] = mapped_column(Integer, default=0)
+    rule_id: Mapped[str] = mapped_column(String(255), index=True)
     label: Mapped[str] = mapped_column(String(512), default="")
+    # Lowercased comment: the comment -> .id index (see fw_cache.enable_firewall_rule_by_comment_async)
+    comment_lc: Mapped[str] = mapped_column(String(512), default="")
+    position: Mapped[int] = mapped_column(Integer, default=0)  # order in /ip/firewall/filter
     fetched_at: Mapped[datetime] = mapped_column(DateTime, default=_utcnow, index=True)
 
+
+Index("uq_firewall_rule_cache_router_rule", FirewallRuleCache.router_id, FirewallRuleCache.rule_id, unique=True)
+Index("ix_firewall_rule_cache_router_comment", FirewallRuleCache.router_id, FirewallRuleCache.comment_lc)
+
+
+class CacheFingerprint(Base):
+    """
+    Router-side fingerprint (.id list hash) of a picker cache's source as of its last full refresh:
+    a refresh whose fingerprint still matches serves the cached rows without re-downloading.
+    """
+    __tablename__ = "cache_fingerprints"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    table_name: Mapped[str] = mapped_column(String(64))
+    router_id: Mapped[int] = mapped_column(Integer, default=0)
+    fingerprint: Mapped[str] = mapped_column(String(128), default="")
+    refreshed_at: Mapped[datetime] = mapped_column(DateTime, default=_utcnow)  # last full refresh
+    checked_at: Mapped[datetime] = mapped_column(DateTime, default=_utcnow)  # last refresh, skipped or not
+
+
+Index("uq_cache_fingerprints_table_router", CacheFingerprint.table_name, CacheFingerprint.router_id, unique=True)
+
@@ -0,0 +1,793 @@
+"""
+Local RouterOS API simulator (development / benchmarking tool).
+
+Speaks the RouterOS API sentence protocol over TCP (optionally TLS, like api-ssl)
+and serves an in-memory model of the tables the bot touches:
+  - user-manager/user, user-manager/session (or tool/user-manager/... for v6)
+  - ppp/active
+  - ip/firewall/filter, ip/firewall/address-list
+  - system/script, ip/service, system/identity, system/resource
+
+Supported commands: /login, print (query words, .proplist, count-only), set (multi-id),
+add, remove, listen, /cancel, /execute (bot revoke script only), .tag-ged pipelining.
+Faults: per-command latency, connection drops and !trap injection.
+
+Usage:
+    python -m mikrotik_2fa_bot.routeros_sim --port 18728 --users 100000 --sessions 50000
+"""
+
+from __future__ import annotations
+
+import argparse
+import datetime
+import random
+import re
+import socket
+import socketserver
+import ssl
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+
+# ---- wire format -------------------------------------------------------------------------------
+
+def _encode_length(n: int) -> bytes:
+    if n < 0x80:
+        return bytes([n])
+    if n < 0x4000:
+        return (n | 0x8000).to_bytes(2, "big")
+    if n < 0x200000:
+        return (n | 0xC00000).to_bytes(3, "big")
+    if n < 0x10000000:
+        return (n | 0xE0000000).to_bytes(4, "big")
+    return b"\xf0" + n.to_bytes(4, "big")
+
+
+def encode_sentence(words: Iterable[str]) -> bytes:
+    out = bytearray()
+    for w in words:
+        raw = w.encode("utf-8")
+        out += _encode_length(len(raw))
+        out += raw
+    out += b"\x00"
+    return bytes(out)
+
+
+class _SockReader:
+    def __init__(self, sock):
+        self.sock = sock
+        self.buf = bytearray()
+
+    def _read(self, n: int) -> bytes:
+        while len(self.buf) < n:
+            chunk = self.sock.recv(65536)
+            if not chunk:
+                raise ConnectionError("closed")
+            self.buf += chunk
+        out = bytes(self.buf[:n])
+        del self.buf[:n]
+        return out
+
+    def _read_length(self) -> int:
+        b = self._read(1)[0]
+        if b < 0x80:
+            return b
+        if b < 0xC0:
+            return ((b & ~0x80) << 8) | self._read(1)[0]
+        if b < 0xE0:
+            return ((b & ~0xC0) << 16) | int.from_bytes(self._read(2), "big")
+        if b < 0xF0:
+            return ((b & ~0xE0) << 24) | int.from_bytes(self._read(3), "big")
+        return int.from_bytes(self._read(4), "big")
+
+    def read_sentence(self) -> List[str]:
+        words: List[str] = []
+        while True:
+            n = self._read_length()
+            if n == 0:
+                return words
+            words.append(self._read(n).decode("utf-8", errors="replace"))
+
+
+# ---- in-memory router model ----------------------------------------------------------------------
+
+_BOOL_TRUE = {"true", "yes"}
+_BOOL_FALSE = {"false", "no"}
+
+
+def _norm_value(v: str) -> str:
+    s = str(v)
+    low = s.lower()
+    if low in _BOOL_TRUE:
+        return "true"
+    if low in _BOOL_FALSE:
+        return "false"
+    return s
+
+
+class SimTrap(Exception):
+    def __init__(self, message: str, category: int | None = None):
+        super().__init__(message)
+        self.message = message
+        self.category = category
+
+
+class RouterModel:
+    """
+    Thread-safe in-memory tables keyed by RouterOS menu path (without leading slash).
+    Rows are dicts of API attribute words; ".id" is assigned by the model.
+    """
+
+    def __init__(self, um_prefix: str = "user-manager", identity: str = "sim-router", version: str = "7.15.3 (stable)"):
+        self.um_prefix = um_prefix
+        self.lock = threading.RLock()
+        self.tables: Dict[str, Dict[str, Dict[str, str]]] = {}
+        self._next_id: Dict[str, int] = {}
+        self._listeners: Dict[str, List[Callable[[Dict[str, str]], None]]] = {}
+        self.singletons: Dict[str, Dict[str, str]] = {
+            "system/identity": {"name": identity},
+            "system/resource": {"version": version, "board-name": "SIM", "uptime": "1d"},
+        }
+        for p in (
+            f"{um_prefix}/user",
+            f"{um_prefix}/session",
+            "ppp/active",
+            "ip/firewall/filter",
+            "ip/firewall/address-list",
+            "system/script",
+            "ip/service",
+        ):
+            self.tables[p] = {}
+            self._next_id[p] = 1
+        for name, port, disabled in (("api", "8728", "false"), ("api-ssl", "8729", "false"), ("ssh", "22", "false")):
+            self.add("ip/service", {"name": name, "port": port, "disabled": disabled})
+
+    # -- generic table ops
+    def has_table(self, path: str) -> bool:
+        return path in self.tables or path in self.singletons
+
+    def _new_id(self, path: str) -> str:
+        n = self._next_id[path]
+        self._next_id[path] = n + 1
+        return f"*{n:X}"
+
+    def add(self, path: str, attrs: Dict[str, str]) -> str:
+        with self.lock:
+            rid = self._new_id(path)
+            row = {".id": rid}
+            row.update({k: str(v) for k, v in attrs.items()})
+            self.tables[path][rid] = row
+            self._notify(path, dict(row))
+            return rid
+
+    def set(self, path: str, ids: List[str], attrs: Dict[str, str]) -> None:
+        with self.lock:
+            table = self.tables[path]
+            for rid in ids:
+                if rid not in table:
+                    raise SimTrap("no such item")
+            for rid in ids:
+                table[rid].update({k: str(v) for k, v in attrs.items()})
+                self._notify(path, dict(table[rid]))
+
+    def remove(self, path: str, ids: List[str]) -> None:
+        with self.lock:
+            table = self.tables[path]
+            for rid in ids:
+                if rid not in table:
+                    raise SimTrap("no such item")
+            for rid in ids:
+                table.pop(rid)
+                self._notify(path, {".id": rid, ".dead": "true"})
+
+    def rows(self, path: str) -> List[Dict[str, str]]:
+        with self.lock:
+            if path in self.singletons:
+                return [dict(self.singletons[path])]
+            return [dict(r) for r in self.tables[path].values()]
+
+    def subscribe(self, path: str, cb: Callable[[Dict[str, str]], None]) -> Callable[[], None]:
+        with self.lock:
+            self._listeners.setdefault(path, []).append(cb)
+
+        def _unsubscribe() -> None:
+            with self.lock:
+                try:
+                    self._listeners.get(path, []).remove(cb)
+                except ValueError:
+                    pass
+
+        return _unsubscribe
+
+    def _notify(self, path: str, row: Dict[str, str]) -> None:
+        for cb in list(self._listeners.get(path, [])):
+            try:
+                cb(row)
+            except Exception:
+                pass
+
+    # -- domain helpers
+    @property
+    def um_user_path(self) -> str:
+        return f"{self.um_prefix}/user"
+
+    @property
+    def um_user_name_key(self) -> str:
+        """v7 UM users have "name", v6 (/tool user-manager) "username"."""
+        return "username" if self.um_prefix.startswith("tool/") else "name"
+
+    @property
+    def um_session_path(self) -> str:
+        return f"{self.um_prefix}/session"
+
+    def find(self, path: str, **attrs: str) -> List[Dict[str, str]]:
+        want = {k: _norm_value(v) for k, v in attrs.items()}
+        with self.lock:
+            return [
+                dict(r)
+                for r in self.tables[path].values()
+                if all(_norm_value(r.get(k, "")) == v for k, v in want.items())
+            ]
+
+    def connect(self, username: str, address: str | None = None) -> str:
+        """Simulate a VPN client connecting: active UM session + ppp/active record."""
+        with self.lock:
+            n = len(self.tables[self.um_session_path]) + 1
+            addr = address or f"10.{(n >> 16) & 255}.{(n >> 8) & 255}.{n & 255}"
+            acct = f"{n:08x}"
+            self.add("ppp/active", {"name": username, "service": "l2tp", "address": addr, "session-id": f"0x{n:X}"})
+            return self.add(
+                self.um_session_path,
+                {
+                    "user": username,
+                    "acct-session-id": acct,
+                    "user-address": addr,
+                    "calling-station-id": "203.0.113.10",
+                    "active": "true",
+                    "started": datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
+                },
+            )
+
+    def disconnect(self, username: str) -> None:
+        """Simulate the client going away (session becomes inactive, ppp record removed)."""
+        with self.lock:
+            for r in self.find("ppp/active", name=username):
+                self.remove("ppp/active", [r[".id"]])
+            for r in self.find(self.um_session_path, user=username, active="true"):
+                self.set(self.um_session_path, [r[".id"]], {"active": "false"})
+
+    def seed(self, users: int = 0, sessions: int = 0, active: int = 0, fw_rules: int = 0, fw_prefix: str = "2FA") -> None:
+        """
+        Bulk-populate the model. `sessions` inactive historical UM sessions are spread across users,
+        `active` of the users get an active session; `fw_rules` disabled filter rules with
+        comments "<fw_prefix> <username>".
+        """
+        with self.lock:
+            utable = self.tables[self.um_user_path]
+            for i in range(users):
+                rid = self._new_id(self.um_user_path)
+                utable[rid] = {
+                    ".id": rid,
+                    self.um_user_name_key: f"user{i:06d}",
+                    "password": "x",
+                    "group": "default",
+                    "disabled": "true",
+                    "shared-users": "1",
+                    "attributes": "",
+                }
+            stable = self.tables[self.um_session_path]
+            for i in range(sessions):
+                rid = self._new_id(self.um_session_path)
+                stable[rid] = {
+                    ".id": rid,
+                    "user": f"user{(i % max(1, users)):06d}",
+                    "acct-session-id": f"h{i:08x}",
+                    "user-address": "10.99.0.1",
+                    "calling-station-id": "198.51.100.7",
+                    "active": "false",
+                    "started": "2024-01-01 00:00:00",
+                    "ended": "2024-01-01 01:00:00",
+                    "download": "123456",
+                    "upload": "65432",
+                    "status": "stop",
+                    "terminate-cause": "user-request",
+                }
+            for i in range(min(active, users)):
+                self.connect(f"user{i:06d}")
+            ftable = self.tables["ip/firewall/filter"]
+            for i in range(fw_rules):
+                rid = self._new_id("ip/firewall/filter")
+                ftable[rid] = {
+                    ".id": rid,
+                    "chain": "forward",
+                    "action": "accept",
+                    "src-address": f"10.{(i >> 8) & 255}.{i & 255}.0/24",
+                    "disabled": "true",
+                    "comment": f"{fw_prefix} user{i:06d}",
+                    "bytes": "0",
+                    "packets": "0",
+                }
+
+
+# ---- query evaluation ------------------------------------------------------------------------------
+
+def _eval_query(words: List[str], row: Dict[str, str]) -> bool:
+    """
+    Evaluate RouterOS API query words (?name, ?-name, ?name=x, ?<name=x, ?>name=x, ?#ops) for a row.
+    """
+    stack: List[bool] = []
+    for w in words:
+        body = w[1:]
+        if body.startswith("#"):
+            for op in body[1:]:
+                if op == "!":
+                    stack.append(not stack.pop() if stack else False)
+                elif op == "&":
+                    b, a = (stack.pop() if stack else True), (stack.pop() if stack else True)
+                    stack.append(a and b)
+                elif op == "|":
+                    b, a = (stack.pop() if stack else False), (stack.pop() if stack else False)
+                    stack.append(a or b)
+                elif op == ".":
+                    stack.append(stack[-1] if stack else True)
+                elif op.isdigit():
+                    stack.append(stack[-1 - int(op)] if stack else True)
+            continue
+        if body.startswith("-"):
+            stack.append(body[1:] not in row)
+            continue
+        op = "="
+        if body[:1] in {"<", ">", "="}:
+            op, body = body[0], body[1:]
+        if "=" not in body:
+            stack.append(body in row)
+            continue
+        key, value = body.split("=", 1)
+        have = row.get(key)
+        if have is None:
+            stack.append(False)
+        elif op == "=":
+            stack.append(_norm_value(have) == _norm_value(value))
+        elif op == "<":
+            stack.append(_cmp(have, value) < 0)
+        else:
+            stack.append(_cmp(have, value) > 0)
+    return all(stack)
+
+
+def _cmp(a: str, b: str) -> int:
+    try:
+        x, y = int(a), int(b)
+    except ValueError:
+        x, y = a, b  # type: ignore[assignment]
+    return (x > y) - (x < y)
+
+
+# ---- server ------------------------------------------------------------------------------------------
+
+@dataclass
+class FaultConfig:
+    """Latency (seconds) per command verb ("print", "set", ...; "*" = default), drop/error probability."""
+
+    latency: Dict[str, float] = field(default_factory=dict)
+    drop_rate: float = 0.0
+    error_rate: float = 0.0
+    seed: int | None = None
+
+
+@dataclass
+class SimStats:
+    connections: int = 0
+    logins: int = 0
+    commands: int = 0
+    round_trips: int = 0  # bursts of client sentences (pipelined commands count once)
+    by_verb: Dict[str, int] = field(default_factory=dict)
+    rows_sent: int = 0
+    bytes_in: int = 0
+    bytes_out: int = 0
+    drops: int = 0
+    errors_injected: int = 0
+
+    def as_dict(self) -> dict:
+        return {
+            "connections": self.connections,
+            "logins": self.logins,
+            "commands": self.commands,
+            "round_trips": self.round_trips,
+            "by_verb": dict(self.by_verb),
+            "rows_sent": self.rows_sent,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "drops": self.drops,
+            "errors_injected": self.errors_injected,
+        }
+
+
+class _DropConnection(Exception):
+    pass
+
+
+class _Session:
+    """One API connection."""
+
+    def __init__(self, sim: "RouterOSSimulator", sock: socket.socket):
+        self.sim = sim
+        self.sock = sock
+        self.reader = _SockReader(sock)
+        self.wlock = threading.Lock()
+        self.logged_in = False
+        self.listeners: Dict[str, Tuple[Callable[[], None], threading.Event]] = {}
+        self.closed = False
+
+    def send(self, *words: str) -> None:
+        data = encode_sentence(words)
+        with self.wlock:
+            if self.closed:
+                return
+            self.sock.sendall(data)
+        with self.sim.stats_lock:
+            self.sim.stats.bytes_out += len(data)
+
+    def serve(self) -> None:
+        try:
+            while True:
+                burst = not self.reader.buf  # nothing buffered: the client sent a new request
+                words = self.reader.read_sentence()
+                if not words:
+                    continue
+                with self.sim.stats_lock:
+                    self.sim.stats.bytes_in += sum(len(w) + 1 for w in words) + 1
+                    self.sim.stats.round_trips += int(burst)
+                cmd, args = words[0], words[1:]
+                tag = None
+                for a in args:
+                    if a.startswith(".tag="):
+                        tag = a[5:]
+                if tag is not None and self.logged_in and cmd not in {"/cancel", "/login"}:
+                    threading.Thread(target=self._run_safe, args=(cmd, args, tag), daemon=True).start()
+                else:
+                    self._run_safe(cmd, args, tag)
+        except (ConnectionError, OSError, _DropConnection):
+            pass
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        with self.wlock:
+            if self.closed:
+                return
+            self.closed = True
+        for unsub, _ in list(self.listeners.values()):
+            unsub()
+        try:
+            self.sock.close()
+        except Exception:
+            pass
+
+    def _tagged(self, tag: str | None, *words: str) -> Tuple[str, ...]:
+        return words + ((f".tag={tag}",) if tag is not None else ())
+
+    def _run_safe(self, cmd: str, args: List[str], tag: str | None) -> None:
+        try:
+            self._run(cmd, args, tag)
+        except _DropConnection:
+            with self.sim.stats_lock:
+                self.sim.stats.drops += 1
+            self.close()
+        except SimTrap as e:
+            extra = (f"=category={e.category}",) if e.category is not None else ()
+            self.send(*self._tagged(tag, "!trap", f"=message={e.message}", *extra))
+            self.send(*self._tagged(tag, "!done"))
+        except OSError:
+            self.close()
+
+    def _run(self, cmd: str, args: List[str], tag: str | None) -> None:
+        sim = self.sim
+        attrs: Dict[str, str] = {}
+        queries: List[str] = []
+        for a in args:
+            if a.startswith("="):
+                k, _, v = a[1:].partition("=")
+                attrs[k] = v
+            elif a.startswith("?"):
+                queries.append(a)
+        path, _, verb = cmd.strip("/").rpartition("/")
+
+        with sim.stats_lock:
+            sim.stats.commands += 1
+            sim.stats.by_verb[verb] = sim.stats.by_verb.get(verb, 0) + 1
+
+        if cmd == "/login":
+            if attrs.get("name") == sim.username and attrs.get("password") == sim.password:
+                self.logged_in = True
+                with sim.stats_lock:
+                    sim.stats.logins += 1
+                self.send(*self._tagged(tag, "!done"))
+                return
+            raise SimTrap("invalid user name or password (6)")
+        if not self.logged_in:
+            self.send("!fatal", "not logged in")
+            raise _DropConnection()
+
+        if cmd == "/cancel":
+            target = attrs.get("tag")
+            for t, (unsub, ev) in list(self.listeners.items()):
+                if target is None or t == target:
+                    unsub()
+                    ev.set()
+                    self.listeners.pop(t, None)
+                    self.send(*self._tagged(t, "!trap", "=category=2", "=message=interrupted"))
+                    self.send(*self._tagged(t, "!done"))
+            self.send(*self._tagged(tag, "!done"))
+            return
+
+        sim.inject_faults(verb)
+
+        if cmd == "/execute":
+            self._execute(attrs, tag)
+            return
+
+        model = sim.model
+        if not model.has_table(path):
+            raise SimTrap("no such command prefix")
+
+        if verb in {"print", "getall"}:
+            rows = [r for r in model.rows(path) if _eval_query(queries, r)]
+            if "count-only" in attrs:
+                self.send(*self._tagged(tag, "!done", f"=ret={len(rows)}"))
+                return
+            props = [p for p in (attrs.get(".proplist") or "").split(",") if p]
+            for r in rows:
+                items = r.items() if not props else ((p, r[p]) for p in props if p in r)
+                self.send(*self._tagged(tag, "!re", *(f"={k}={v}" for k, v in items)))
+            with sim.stats_lock:
+                sim.stats.rows_sent += len(rows)
+            self.send(*self._tagged(tag, "!done"))
+            return
+        if verb == "set":
+            ids = [i for i in (attrs.pop(".id", None) or attrs.pop("numbers", "")).split(",") if i]
+            if not ids:
+                raise SimTrap("no such item")
+            model.set(path, ids, attrs)
+            self.send(*self._tagged(tag, "!done"))
+            return
+        if verb == "add":
+            if path == "ip/firewall/address-list" and model.find(path, list=attrs.get("list", ""), address=attrs.get("address", "")):
+                raise SimTrap("failure: already have such entry")
+            rid = model.add(path, attrs)
+            self.send(*self._tagged(tag, "!done", f"=ret={rid}"))
+            return
+        if verb == "remove":
+            ids = [i for i in (attrs.pop(".id", None) or attrs.pop("numbers", "")).split(",") if i]
+            model.remove(path, ids)
+            self.send(*self._tagged(tag, "!done"))
+            return
+        if verb == "listen":
+            if tag is None:
+                raise SimTrap("listen requires .tag")
+            stop = threading.Event()
+
+            def _push(row: Dict[str, str], _tag=tag) -> None:
+                if stop.is_set() or not _eval_query(queries, row) and ".dead" not in row:
+                    return
+                try:
+                    self.send(*self._tagged(_tag, "!re", *(f"={k}={v}" for k, v in row.items())))
+                except OSError:
+                    pass
+
+            self.listeners[tag] = (model.subscribe(path, _push), stop)
+            return
+        raise SimTrap("no such command")
+
+    _ARG_RE = re.compile(r'(\w+)="([^"]*)"')
+
+    def _execute(self, attrs: Dict[str, str], tag: str | None) -> None:
+        """
+        Only the bot's revoke script call is emulated:
+        `[:parse [/system script get "<name>" source]]` invoked with user=/rule=/entry= arguments,
+        printing "ok" or "failed: <steps>; done: <steps>" like the real script.
+        """
+        script = attrs.get("script") or ""
+        model = self.sim.model
+        m = re.search(r'/system script get "?([\w-]+)"? source', script)
+        stored = model.find("system/script", name=m.group(1)) if m else []
+        if not stored:
+            raise SimTrap("failure: script not found")
+        # The UM user is looked up by the property the stored script uses (v6 has no `name`).
+        prop = re.search(r"find where ([\w-]+)=\$user", stored[0].get("source") or "")  # first: the UM user step
+        user_key = prop.group(1) if prop else model.um_user_name_key
+        args = dict(self._ARG_RE.findall(script.split("]]", 1)[-1]))
+        done: List[str] = []
+        failed: List[str] = []
+        with model.lock:
+            user = args.get("user") or ""
+            if user:
+                found = model.find(model.um_user_path, **{user_key: user})
+                for r in found:
+                    model.set(model.um_user_path, [r[".id"]], {"disabled": "true"})
+                (done if found else failed).append("user")  # the script :error's on no match
+            rule = args.get("rule") or ""
+            if rule:
+                if rule in model.tables["ip/firewall/filter"]:
+                    model.set("ip/firewall/filter", [rule], {"disabled": "true"})
+                    done.append("rule")
+                else:
+                    failed.append("rule")  # "no such item"
+            entry = args.get("entry") or ""
+            if entry and entry in model.tables["ip/firewall/address-list"]:
+                model.remove("ip/firewall/address-list", [entry])
+                done.append("entry")
+            if user:
+                for r in model.find(model.um_session_path, user=user, active="true"):
+                    model.remove(model.um_session_path, [r[".id"]])
+                for r in model.find("ppp/active", name=user):
+                    model.remove("ppp/active", [r[".id"]])
+                done += ["kick", "kick-ppp"]
+        out = f"failed: {' '.join(failed)}; done: {' '.join(done)}" if failed else "ok"
+        self.send(*self._tagged(tag, "!done", f"=ret={out}"))
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self) -> None:  # noqa: D401
+        sim: RouterOSSimulator = self.server.sim  # type: ignore[attr-defined]
+        sock = self.request
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if sim.ssl_context is not None:
+            try:
+                sock = sim.ssl_context.wrap_socket(sock, server_side=True)
+            except (ssl.SSLError, OSError):
+                return
+        with sim.stats_lock:
+            sim.stats.connections += 1
+        _Session(sim, sock).serve()
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def _self_signed_context() -> ssl.SSLContext:
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "routeros-sim")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=365))
+        .sign(key, hashes.SHA256())
+    )
+    with tempfile.NamedTemporaryFile("wb", suffix=".pem", delete=False) as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()))
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+        pem = f.name
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    ctx.load_cert_chain(pem)
+    return ctx
+
+
+class RouterOSSimulator:
+    """
+    Threaded RouterOS API server around a RouterModel.
+
+        sim = RouterOSSimulator(model, port=0).start()
+        ... point MIKROTIK_HOST/PORT at sim.host/sim.port ...
+        sim.stop()
+    """
+
+    def __init__(
+        self,
+        model: RouterModel | None = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        username: str = "admin",
+        password: str = "admin",
+        use_ssl: bool = False,
+        faults: FaultConfig | None = None,
+    ):
+        self.model = model or RouterModel()
+        self.username = username
+        self.password = password
+        self.faults = faults or FaultConfig()
+        self.ssl_context = _self_signed_context() if use_ssl else None
+        self.stats = SimStats()
+        self.stats_lock = threading.Lock()
+        self._rng = random.Random(self.faults.seed)
+        self._server = _Server((host, int(port)), _Handler)
+        self._server.sim = self  # type: ignore[attr-defined]
+        self._thread: threading.Thread | None = None
+
+    @property
+    def host(self) -> str:
+        return str(self._server.server_address[0])
+
+    @property
+    def port(self) -> int:
+        return int(self._server.server_address[1])
+
+    def start(self) -> "RouterOSSimulator":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="routeros-sim", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset_stats(self) -> SimStats:
+        with self.stats_lock:
+            old, self.stats = self.stats, SimStats()
+        return old
+
+    def inject_faults(self, verb: str) -> None:
+        f = self.faults
+        delay = f.latency.get(verb, f.latency.get("*", 0.0))
+        if delay > 0:
+            time.sleep(delay)
+        if f.drop_rate > 0 and self._rng.random() < f.drop_rate:
+            raise _DropConnection()
+        if f.error_rate > 0 and self._rng.random() < f.error_rate:
+            with self.stats_lock:
+                self.stats.errors_injected += 1
+            raise SimTrap("simulated failure (injected)")
+
+
+def _parse_latency(items: List[str]) -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    for item in items:
+        verb, _, ms = item.partition("=")
+        if not ms:
+            verb, ms = "*", verb
+        out[verb or "*"] = float(ms) / 1000.0
+    return out
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    p = argparse.ArgumentParser(description="RouterOS API simulator")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=18728)
+    p.add_argument("--ssl", action="store_true", help="serve api-ssl (self-signed certificate)")
+    p.add_argument("--username", default="admin")
+    p.add_argument("--password", default="admin")
+    p.add_argument("--v6", action="store_true", help="use tool/user-manager paths (RouterOS v6)")
+    p.add_argument("--users", type=int, default=1000)
+    p.add_argument("--sessions", type=int, default=0, help="inactive historical UM sessions")
+    p.add_argument("--active", type=int, default=0, help="users with an active session")
+    p.add_argument("--fw-rules", type=int, default=0)
+    p.add_argument("--latency", action="append", default=[], metavar="[VERB=]MS", help="e.g. 5 or print=20")
+    p.add_argument("--drop-rate", type=float, default=0.0)
+    p.add_argument("--error-rate", type=float, default=0.0)
+    args = p.parse_args(argv)
+
+    model = RouterModel(um_prefix="tool/user-manager" if args.v6 else "user-manager",
+                        version="6.49.10 (long-term)" if args.v6 else "7.15.3 (stable)")
+    t0 = time.monotonic()
+    model.seed(users=args.users, sessions=args.sessions, active=args.active, fw_rules=args.fw_rules)
+    faults = FaultConfig(latency=_parse_latency(args.latency), drop_rate=args.drop_rate, error_rate=args.error_rate)
+    sim = RouterOSSimulator(model, host=args.host, port=args.port, username=args.username,
+                            password=args.password, use_ssl=args.ssl, faults=faults)
+    print(f"seeded in {time.monotonic() - t0:.2f}s; listening on {sim.host}:{sim.port} (ssl={args.ssl})")
+    sim.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sim.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,2 +1 @@
-from mikrotik_2fa_bot.services import mikrotik_api  # noqa: F401
-
+from mikrotik_2fa_bot.services import mikrotik_api_async  # noqa: F401
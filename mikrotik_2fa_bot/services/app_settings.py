@@ -31,6 +31,19 @@ def _fernet() -> Fernet:
     return Fernet(_ensure_key())
 
 
+def encrypt_secret(value: str) -> str:
+    return _fernet().encrypt(("" if value is None else str(value)).encode("utf-8")).decode("utf-8")
+
+
+def decrypt_secret(token: str) -> Optional[str]:
+    if not token:
+        return None
+    try:
+        return _fernet().decrypt(token.encode("utf-8")).decode("utf-8")
+    except Exception:
+        return None
+
+
 def set_setting(db: Session, key: str, value: str, encrypt: bool = False) -> None:
     k = (key or "").strip()
     if not k:
@@ -38,8 +51,7 @@ def set_setting(db: Session, key: str, value: str, encrypt: bool = False) -> Non
     v = "" if value is None else str(value)
     is_enc = bool(encrypt)
     if is_enc:
-        token = _fernet().encrypt(v.encode("utf-8"))
-        v = token.decode("utf-8")
+        v = encrypt_secret(v)
     row = db.query(AppSetting).filter(AppSetting.key == k).first()
     if not row:
         row = AppSetting(key=k, value=v, is_encrypted=is_enc)
@@ -59,11 +71,7 @@ def get_setting(db: Session, key: str) -> Optional[str]:
         return None
     if not row.is_encrypted:
         return row.value
-    try:
-        raw = _fernet().decrypt(row.value.encode("utf-8"))
-        return raw.decode("utf-8")
-    except Exception:
-        return None
+    return decrypt_secret(row.value)
 
 
 def get_setting_bool(db: Session, key: str) -> Optional[bool]:
@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, Optional, Set, Tuple
+
+from mikrotik_2fa_bot.config import settings
+from mikrotik_2fa_bot.db import db_session
+from mikrotik_2fa_bot.services.cache_sync import SyncStats, last_checked
+from mikrotik_2fa_bot.services.fw_cache import refresh_firewall_rules_cache_async
+from mikrotik_2fa_bot.services.ros_common import RouterUnavailableError
+from mikrotik_2fa_bot.services.routers import list_router_targets, router_key
+from mikrotik_2fa_bot.services.um_cache import refresh_um_users_cache_async
+
+
+logger = logging.getLogger(__name__)
+
+# Cache kinds are the cache table names (as stored in cache_fingerprints).
+UM_USERS = "um_user_cache"
+FIREWALL_RULES = "firewall_rule_cache"
+
+# One refresh per (cache, router) at a time: pickers and the interval job share it.
+_inflight: Dict[Tuple[str, int], asyncio.Task] = {}
+# Refreshes in flight that were started with force (they skip the fingerprint check)
+_forced: Set[asyncio.Task] = set()
+
+
+async def _run_refresh(kind: str, router_id: Optional[int], force: bool) -> SyncStats:
+    if kind == UM_USERS:
+        with db_session() as db:
+            return await refresh_um_users_cache_async(db, router_id, force=force)
+    return await refresh_firewall_rules_cache_async(router_id, force=force)
+
+
+def _start(kind: str, router_id: Optional[int], force: bool = False) -> asyncio.Task:
+    key = (kind, router_key(router_id))
+    task = _inflight.get(key)
+    if task is None or task.done():
+        task = _inflight[key] = asyncio.create_task(_run_refresh(kind, router_id, force))
+        if force:
+            _forced.add(task)
+
+        def _forget(t: asyncio.Task, _key=key) -> None:
+            _forced.discard(t)
+            if _inflight.get(_key) is t:
+                del _inflight[_key]
+
+        task.add_done_callback(_forget)
+    return task
+
+
+async def refresh_cache(kind: str, router_id: Optional[int], force: bool = False) -> SyncStats:
+    """
+    Refresh now and wait (joins a refresh already in flight). With `force` an unforced
+    refresh in flight is waited for first, then a forced one is started or joined.
+    """
+    if force:
+        running = _inflight.get((kind, router_key(router_id)))
+        if running is not None and not running.done() and running not in _forced:
+            await asyncio.gather(running, return_exceptions=True)
+    return await asyncio.shield(_start(kind, router_id, force=force))
+
+
+def cache_age_seconds(kind: str, router_id: Optional[int]) -> Optional[float]:
+    """Seconds since the cache was last compared with the router (None: never loaded)."""
+    with db_session() as db:
+        checked = last_checked(db, kind, router_key(router_id))
+    return None if checked is None else max(0.0, (datetime.utcnow() - checked).total_seconds())
+
+
+def revalidate(kind: str, router_id: Optional[int]) -> Optional[float]:
+    """
+    Stale-while-revalidate for pickers: returns the cache age right away and, if it is
+    older than CACHE_TTL_SECONDS, refreshes in the background. None: nothing cached yet
+    (the caller has to wait for refresh_cache()).
+    """
+    age = cache_age_seconds(kind, router_id)
+    if age is not None and age >= float(settings.CACHE_TTL_SECONDS):
+        _start(kind, router_id).add_done_callback(_log_failure)
+    return age
+
+
+def _log_failure(task: asyncio.Task) -> None:
+    if task.cancelled():
+        return
+    e = task.exception()
+    if isinstance(e, RouterUnavailableError):
+        logger.debug("Cache refresh skipped: %s", e)
+    elif e is not None:
+        logger.warning("Cache refresh failed: %s", e)
+
+
+async def refresh_all() -> None:
+    """Interval job (also run at startup): refresh every picker cache of every router."""
+    with db_session() as db:
+        router_ids = [t.router_id for t in list_router_targets(db)]
+
+    async def _one(kind: str, router_id: Optional[int]) -> None:
+        try:
+            await refresh_cache(kind, router_id)
+        except RouterUnavailableError as e:
+            logger.debug("Cache refresh [%s, router %s] skipped: %s", kind, router_key(router_id), e)
+        except Exception as e:  # noqa: BLE001
+            logger.warning("Cache refresh [%s, router %s] failed: %s", kind, router_key(router_id), e)
+
+    await asyncio.gather(*(_one(kind, rid) for rid in router_ids for kind in (UM_USERS, FIREWALL_RULES)))
+
+
+def describe_age(seconds: Optional[float]) -> str:
+    """Short Russian age for picker headers: "12 с", "5 мин", "2 ч"."""
+    if seconds is None:
+        return "—"
+    s = int(seconds)
+    if s < 60:
+        return f"{s} с"
+    if s < 3600:
+        return f"{s // 60} мин"
+    return f"{s // 3600} ч"
@@ -0,0 +1,222 @@
+from __future__ import annotations
+
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List, Sequence
+
+from sqlalchemy import func, or_, tuple_, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from mikrotik_2fa_bot.config import settings
+from mikrotik_2fa_bot.models import CacheFingerprint
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True, slots=True)
+class KeysetPage:
+    rows: List[Any]
+    has_prev: bool
+    has_next: bool
+
+
+def prefix_range(query, column, prefix: str | None):
+    """`column LIKE 'prefix%'` as a range scan the (router_id, column) index can serve."""
+    if not prefix:
+        return query
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return query.filter(column >= prefix, column < upper)
+
+
+def keyset_page(query, column, size: int, after: Any = None, before: Any = None) -> KeysetPage:
+    """
+    One page ordered by a unique `column`, continuing after (or before) a key value: the cost
+    does not grow with the page number, unlike OFFSET.
+    """
+    size = max(1, int(size))
+    if before is not None:
+        rows = query.filter(column < before).order_by(column.desc()).limit(size + 1).all()
+        has_prev = len(rows) > size
+        rows = rows[:size][::-1]
+        has_next = query.filter(column >= before).first() is not None
+    else:
+        q = query if after is None else query.filter(column > after)
+        rows = q.order_by(column.asc()).limit(size + 1).all()
+        has_next = len(rows) > size
+        rows = rows[:size]
+        has_prev = after is not None and query.filter(column <= after).first() is not None
+    return KeysetPage(rows=rows, has_prev=has_prev, has_next=has_next)
+
+
+@dataclass(frozen=True, slots=True)
+class SyncStats:
+    seen: int
+    inserted: int
+    updated: int  # existing rows whose columns changed
+    deleted: int
+    seconds: float
+    skipped: bool = False  # fingerprint unchanged: cached rows served as they are
+
+
+class CacheSync:
+    """
+    One refresh of a router's slice of a picker cache table (UmUserCache, FirewallRuleCache).
+
+    Rows are fed one at a time while the router is streamed and written in chunks with
+    `INSERT ... ON CONFLICT DO UPDATE`, one transaction per chunk: a handful of commits per
+    refresh instead of one per row, without holding the SQLite write lock across router reads.
+    Existing rows are only rewritten if a column changed; the others just get fetched_at.
+    finish() sweeps rows that were not seen (fetched_at older than this refresh) in one DELETE
+    and stores the source `fingerprint` (if set); is_current() lets the caller skip the download when
+    the router still reports the same one.
+    """
+
+    def __init__(
+        self,
+        db: Session,
+        model: Any,
+        router_key: int,
+        key_columns: Sequence[str],
+        update_columns: Sequence[str],
+        chunk_size: int = 500,
+    ):
+        self.db = db
+        self.model = model
+        self.router_key = router_key
+        self.fingerprint: str | None = None  # set by the caller once read from the router
+        self.now = datetime.utcnow()
+        self._keys = list(key_columns)
+        self._index = ["router_id", *key_columns]
+        self._columns = list(update_columns)
+        self._chunk_size = max(1, int(chunk_size))
+        self._pending: List[Dict[str, Any]] = []
+        self._seen = 0
+        self._written = 0  # rows inserted or changed
+        self._started = time.perf_counter()
+        self._before = self._count()
+
+    def _count(self) -> int:
+        q = self.db.query(func.count(self.model.id)).filter(self.model.router_id == self.router_key)
+        return int(q.scalar() or 0)
+
+    def _stored_fingerprint(self) -> CacheFingerprint | None:
+        return (
+            self.db.query(CacheFingerprint)
+            .filter(CacheFingerprint.table_name == self.model.__tablename__, CacheFingerprint.router_id == self.router_key)
+            .first()
+        )
+
+    def is_current(self) -> bool:
+        """Cache was fully refreshed with the same fingerprint, less than CACHE_MAX_AGE_SECONDS ago."""
+        row = self._stored_fingerprint()
+        if row is None or not self.fingerprint or row.fingerprint != self.fingerprint:
+            return False
+        return (self.now - row.refreshed_at).total_seconds() < float(settings.CACHE_MAX_AGE_SECONDS)
+
+    def skipped(self) -> SyncStats:
+        row = self._stored_fingerprint()
+        if row is not None:
+            row.checked_at = self.now
+            self.db.commit()
+        stats = SyncStats(
+            seen=self._before,
+            inserted=0,
+            updated=0,
+            deleted=0,
+            seconds=round(time.perf_counter() - self._started, 3),
+            skipped=True,
+        )
+        logger.debug("%s unchanged (router %s): refresh skipped", self.model.__tablename__, self.router_key)
+        return stats
+
+    def add(self, **values: Any) -> None:
+        self._pending.append({"router_id": self.router_key, "fetched_at": self.now, **values})
+        self._seen += 1
+        if len(self._pending) >= self._chunk_size:
+            self._flush()
+
+    def _flush(self) -> None:
+        if not self._pending:
+            return
+        # Core statement (not the ORM bulk path): its rowcount tells how many rows were written.
+        table = self.model.__table__
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=self._index,
+            set_={c: stmt.excluded[c] for c in [*self._columns, "fetched_at"]},
+            where=or_(*(table.c[c].is_distinct_from(stmt.excluded[c]) for c in self._columns)),
+        )
+        self._written += self.db.execute(stmt, self._pending).rowcount
+        # Unchanged rows were left alone: mark them as seen, or finish() would sweep them.
+        self.db.execute(
+            update(self.model)
+            .where(self.model.router_id == self.router_key, self.model.fetched_at < self.now, self._key_in(self._pending))
+            .values(fetched_at=self.now)
+        )
+        self.db.commit()
+        self._pending = []
+
+    def _key_in(self, rows: List[Dict[str, Any]]):
+        cols = [getattr(self.model, c) for c in self._keys]
+        if len(cols) == 1:
+            return cols[0].in_([r[self._keys[0]] for r in rows])
+        return tuple_(*cols).in_([tuple(r[c] for c in self._keys) for r in rows])
+
+    def finish(self) -> SyncStats:
+        self._flush()
+        inserted = max(0, self._count() - self._before)
+        deleted = (
+            self.db.query(self.model)
+            .filter(self.model.router_id == self.router_key, self.model.fetched_at < self.now)
+            .delete(synchronize_session=False)
+        )
+        row = self._stored_fingerprint()
+        if self.fingerprint is None:
+            if row is not None:
+                self.db.delete(row)
+        elif row is None:
+            self.db.add(
+                CacheFingerprint(
+                    table_name=self.model.__tablename__,
+                    router_id=self.router_key,
+                    fingerprint=self.fingerprint,
+                    refreshed_at=self.now,
+                    checked_at=self.now,
+                )
+            )
+        else:
+            row.fingerprint = self.fingerprint
+            row.refreshed_at = row.checked_at = self.now
+        self.db.commit()
+        stats = SyncStats(
+            seen=self._seen,
+            inserted=inserted,
+            updated=max(0, self._written - inserted),
+            deleted=int(deleted or 0),
+            seconds=round(time.perf_counter() - self._started, 3),
+        )
+        logger.info(
+            "%s refreshed (router %s): %s seen, %s new, %s updated, %s removed in %.3fs",
+            self.model.__tablename__,
+            self.router_key,
+            stats.seen,
+            stats.inserted,
+            stats.updated,
+            stats.deleted,
+            stats.seconds,
+        )
+        return stats
+
+
+def last_checked(db: Session, table_name: str, router_key: int) -> datetime | None:
+    """When the router was last compared with this cache (None: never refreshed)."""
+    row = (
+        db.query(CacheFingerprint.checked_at)
+        .filter(CacheFingerprint.table_name == table_name, CacheFingerprint.router_id == router_key)
+        .first()
+    )
+    return row[0] if row else None
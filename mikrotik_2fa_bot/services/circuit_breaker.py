@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+import enum
+import logging
+import random
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Dict, Optional, Tuple
+
+from mikrotik_2fa_bot.services.ros_common import RouterConfig
+
+
+logger = logging.getLogger(__name__)
+
+
+class BreakerState(str, enum.Enum):
+    CLOSED = "closed"  # calls go through
+    OPEN = "open"  # router considered down: calls fail fast until retry_at
+    HALF_OPEN = "half_open"  # one caller probes the router, the others still fail fast
+
+
+@dataclass(frozen=True, slots=True)
+class BreakerSnapshot:
+    name: str
+    state: BreakerState
+    failures: int
+    unreachable_since: Optional[datetime]  # UTC
+    last_error: Optional[str]
+    retry_in_seconds: float
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker for one router (shared by every caller talking to it).
+
+    `failure_threshold` consecutive transport failures open the circuit. While open,
+    acquire() rejects calls immediately; once the (jittered, exponentially growing)
+    backoff has elapsed the next caller becomes the half-open probe. A successful
+    probe closes the circuit, a failed one re-opens it with a longer backoff.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 3,
+        base_backoff_seconds: float = 5.0,
+        max_backoff_seconds: float = 300.0,
+        probe_lease_seconds: float = 30.0,
+        rng: Callable[[], float] = random.random,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self._threshold = max(1, int(failure_threshold))
+        self._base = max(0.1, float(base_backoff_seconds))
+        self._max = max(self._base, float(max_backoff_seconds))
+        self._probe_lease = float(probe_lease_seconds)
+        self._rng = rng
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = BreakerState.CLOSED
+        self._failures = 0
+        self._opens = 0  # consecutive opens without a success: drives the backoff
+        self._retry_at = 0.0
+        self._probe_started: Optional[float] = None
+        self._since: Optional[datetime] = None
+        self._last_error: Optional[str] = None
+
+    def acquire(self) -> Optional[bool]:
+        """
+        None: reject the call (circuit open).
+        False: proceed.
+        True: proceed, and probe the router first (half-open trial).
+        """
+        with self._lock:
+            if self._state == BreakerState.CLOSED:
+                return False
+            now = self._clock()
+            if self._state == BreakerState.HALF_OPEN:
+                # A probe is in flight; take over only if it never reported back (cancelled).
+                if self._probe_started is not None and now - self._probe_started < self._probe_lease:
+                    return None
+            elif now < self._retry_at:
+                return None
+            self._state = BreakerState.HALF_OPEN
+            self._probe_started = now
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            recovered = self._state != BreakerState.CLOSED
+            self._state = BreakerState.CLOSED
+            self._failures = 0
+            self._opens = 0
+            self._probe_started = None
+            since, self._since = self._since, None
+        if recovered:
+            logger.info("RouterOS %s reachable again (unreachable since %s UTC)", self.name, f"{since:%H:%M:%S}" if since else "?")
+
+    def record_failure(self, error: BaseException | str) -> None:
+        text = str(error)
+        if isinstance(error, BaseException) and not text:
+            text = error.__class__.__name__
+        with self._lock:
+            self._last_error = text
+            self._failures += 1
+            if self._since is None:
+                self._since = datetime.utcnow()
+            if self._state == BreakerState.CLOSED and self._failures < self._threshold:
+                return
+            delay = min(self._max, self._base * (2 ** self._opens))
+            delay = delay / 2 + self._rng() * delay / 2  # "equal jitter": never retry in lockstep
+            self._opens += 1
+            self._state = BreakerState.OPEN
+            self._retry_at = self._clock() + delay
+            self._probe_started = None
+        logger.warning("RouterOS %s unreachable: %s (next probe in %.0fs)", self.name, text, delay)
+
+    def force_probe(self) -> None:
+        """Let the next call probe right away (admin diagnostics)."""
+        with self._lock:
+            if self._state == BreakerState.OPEN:
+                self._retry_at = 0.0
+            elif self._state == BreakerState.HALF_OPEN:
+                self._probe_started = None
+
+    def snapshot(self) -> BreakerSnapshot:
+        with self._lock:
+            return BreakerSnapshot(
+                name=self.name,
+                state=self._state,
+                failures=self._failures,
+                unreachable_since=self._since if self._state != BreakerState.CLOSED else None,
+                last_error=self._last_error,
+                retry_in_seconds=max(0.0, self._retry_at - self._clock()) if self._state == BreakerState.OPEN else 0.0,
+            )
+
+    def unavailable_message(self) -> str:
+        s = self.snapshot()
+        since = f"{s.unreachable_since:%Y-%m-%d %H:%M:%S} UTC" if s.unreachable_since else "recently"
+        return f"router {s.name} unreachable since {since} (last error: {s.last_error}); next check in {s.retry_in_seconds:.0f}s"
+
+
+_breakers: Dict[Tuple[str, int], CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(cfg: RouterConfig) -> CircuitBreaker:
+    """One breaker per router address (credentials don't change reachability)."""
+    key = (cfg.host, int(cfg.port))
+    b = _breakers.get(key)
+    if b is None:
+        with _breakers_lock:
+            b = _breakers.get(key)
+            if b is None:
+                from mikrotik_2fa_bot.config import settings
+
+                b = _breakers[key] = CircuitBreaker(
+                    f"{cfg.host}:{cfg.port}",
+                    failure_threshold=int(settings.MIKROTIK_BREAKER_FAILURES),
+                    base_backoff_seconds=float(settings.MIKROTIK_BREAKER_BACKOFF_SECONDS),
+                    max_backoff_seconds=float(settings.MIKROTIK_BREAKER_MAX_BACKOFF_SECONDS),
+                )
+    return b
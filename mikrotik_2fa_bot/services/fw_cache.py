@@ -1,77 +1,174 @@
 from __future__ import annotations
 
-from datetime import datetime
+import time
+from typing import Dict
 
-from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
+from mikrotik_2fa_bot.config import settings
 from mikrotik_2fa_bot.models import FirewallRuleCache
-from mikrotik_2fa_bot.services import mikrotik_api
+from mikrotik_2fa_bot.services import mikrotik_api_async
+from mikrotik_2fa_bot.services.cache_sync import CacheSync, KeysetPage, SyncStats, keyset_page, prefix_range
+from mikrotik_2fa_bot.services.ros_common import RouterConfig
+from mikrotik_2fa_bot.services.ros_records import FirewallRule
+from mikrotik_2fa_bot.services.routers import require_router_config, router_key
 
 
-def _label_from_rule(r: dict) -> tuple[str, str] | None:
-    rid = str(r.get(".id") or r.get("id") or "").strip()
+def _label_from_rule(r: FirewallRule) -> tuple[str, str] | None:
+    rid = (r.id or "").strip()
     if not rid:
         return None
-    chain = str(r.get("chain") or "-")
-    action = str(r.get("action") or "-")
-    disabled = str(r.get("disabled") or "false")
-    comment = str((r.get("comment") or "")).strip()
-    label = f"{rid} | {chain} | {action} | disabled={disabled} | {comment}"
-    return rid, label[:512]
+    return rid, r.label[:512]
 
 
-def refresh_firewall_rules_cache(comment_substring: str | None = None) -> int:
+async def refresh_firewall_rules_cache_async(router_id: int | None = None, force: bool = False) -> SyncStats:
     """
-    Refresh firewall rules cache (in the provided filter) without holding full rules list in memory.
-    Returns number of rules seen (after filter).
+    Refresh the firewall rules cache of a router without holding the full rules list in memory.
+    The cache always holds all rules: it is also the comment index.
 
     Strategy:
-      - stream rules from router, upsert each with fetched_at=now
+      - read the .id fingerprint; unchanged since the last refresh (and not force): done
+      - stream rules from router, bulk-upsert them in chunks with fetched_at=now
       - delete rows not seen in this refresh (fetched_at < now)
     """
-    now = datetime.utcnow()
-    seen = 0
+    from mikrotik_2fa_bot.db import db_session
 
+    cfg = _router_config(router_id)
+    with db_session() as db:
+        sync = _rules_sync(db, router_id)
+        sync.fingerprint = await mikrotik_api_async.firewall_filter_fingerprint(cfg=cfg)
+        if not force and sync.is_current():
+            _index_built_at[router_key(router_id)] = time.monotonic()
+            return sync.skipped()
+        position = 0
+        async for r in mikrotik_api_async.iter_firewall_filter_rules(cfg=cfg):
+            _add_rule(sync, position, r)
+            position += 1
+        return _finish(sync, router_id)
+
+
+def _router_config(router_id: int | None):
     from mikrotik_2fa_bot.db import db_session
 
     with db_session() as db:
-        for r in mikrotik_api.iter_firewall_filter_rules(comment_substring):
-            item = _label_from_rule(r)
-            if not item:
-                continue
-            rid, label = item
-            seen += 1
-            row = FirewallRuleCache(rule_id=rid, label=label, fetched_at=now)
-            db.add(row)
-            try:
-                db.commit()
-            except IntegrityError:
-                db.rollback()
-                existing = db.query(FirewallRuleCache).filter(FirewallRuleCache.rule_id == rid).first()
-                if existing:
-                    existing.label = label
-                    existing.fetched_at = now
-                    db.commit()
-
-        db.query(FirewallRuleCache).filter(FirewallRuleCache.fetched_at < now).delete(synchronize_session=False)
-        db.commit()
-
-    return seen
-
-
-def count_firewall_rules_cache(db: Session) -> int:
-    return int(db.query(FirewallRuleCache).count())
-
-
-def list_firewall_rules_page(db: Session, page: int, page_size: int) -> list[FirewallRuleCache]:
-    page = max(0, int(page))
-    size = max(1, int(page_size))
-    return (
-        db.query(FirewallRuleCache)
-        .order_by(FirewallRuleCache.rule_id.asc())
-        .offset(page * size)
-        .limit(size)
-        .all()
+        return require_router_config(db, router_id)
+
+
+def _rules_sync(db: Session, router_id: int | None) -> CacheSync:
+    return CacheSync(
+        db,
+        FirewallRuleCache,
+        router_key(router_id),
+        key_columns=("rule_id",),
+        update_columns=("label", "comment_lc", "position"),
+    )
+
+
+def _add_rule(sync: CacheSync, position: int, r: FirewallRule) -> None:
+    item = _label_from_rule(r)
+    if item:
+        rid, label = item
+        sync.add(rule_id=rid, label=label, comment_lc=r.comment.lower()[:512], position=position)
+
+
+def _finish(sync: CacheSync, router_id: int | None) -> SyncStats:
+    stats = sync.finish()
+    _index_built_at[router_key(router_id)] = time.monotonic()
+    return stats
+
+
+def _comment_filter(query, comment_substring: str | None):
+    needle = (comment_substring or "").strip().lower()
+    if needle:
+        query = query.filter(FirewallRuleCache.comment_lc.contains(needle, autoescape=True))
+    return query
+
+
+def _rules_query(db: Session, router_id: int | None, comment_substring: str | None, search: str | None):
+    q = db.query(FirewallRuleCache).filter(FirewallRuleCache.router_id == router_key(router_id))
+    q = _comment_filter(q, comment_substring)
+    return prefix_range(q, FirewallRuleCache.comment_lc, (search or "").strip().lower() or None)
+
+
+def count_firewall_rules_cache(
+    db: Session, router_id: int | None = None, comment_substring: str | None = None, search: str | None = None
+) -> int:
+    return int(_rules_query(db, router_id, comment_substring, search).count())
+
+
+def list_firewall_rules_page(
+    db: Session,
+    page_size: int,
+    router_id: int | None = None,
+    comment_substring: str | None = None,
+    search: str | None = None,
+    after_id: int | None = None,
+    before_id: int | None = None,
+) -> KeysetPage:
+    """
+    Picker page by rule_id, like um_cache.list_um_users_page; `search` is a
+    case-insensitive comment prefix.
+    """
+    anchor = db.get(FirewallRuleCache, after_id or before_id) if (after_id or before_id) else None
+    key = anchor.rule_id if anchor else None
+    return keyset_page(
+        _rules_query(db, router_id, comment_substring, search),
+        FirewallRuleCache.rule_id,
+        page_size,
+        after=key if after_id else None,
+        before=key if before_id else None,
     )
 
+
+# --- comment -> .id index
+
+# When each router's cache was last rebuilt or found unchanged (time.monotonic()); decides whether a miss rescans.
+_index_built_at: Dict[int, float] = {}
+
+
+def find_indexed_firewall_rule(db: Session, comment_substring: str, router_id: int | None = None) -> FirewallRuleCache | None:
+    """First cached rule (in router order) whose comment contains the substring, case-insensitive."""
+    q = db.query(FirewallRuleCache).filter(FirewallRuleCache.router_id == router_key(router_id))
+    return _comment_filter(q, comment_substring).order_by(FirewallRuleCache.position.asc()).first()
+
+
+def _index_is_fresh(router_id: int | None) -> bool:
+    built = _index_built_at.get(router_key(router_id))
+    return built is not None and time.monotonic() - built < float(settings.FIREWALL_INDEX_MAX_AGE_SECONDS)
+
+
+def _lookup_rule_id(comment_substring: str, router_id: int | None) -> str | None:
+    from mikrotik_2fa_bot.db import db_session
+
+    with db_session() as db:
+        row = find_indexed_firewall_rule(db, comment_substring, router_id)
+        return row.rule_id if row else None
+
+
+async def enable_firewall_rule_by_comment_async(
+    comment_substring: str, router_id: int | None = None, cfg: RouterConfig | None = None
+) -> str | None:
+    """
+    Enable the first firewall rule whose comment contains the substring; returns its .id.
+
+    The .id comes from the local index, so this is normally a read-back by .id plus a `set`
+    instead of a scan of /ip/firewall/filter. A stale .id (rule removed or .id reused) or a miss
+    in an index older than FIREWALL_INDEX_MAX_AGE_SECONDS rebuilds the index from the router once.
+    """
+    if not (comment_substring or "").strip():
+        return None
+    cfg = cfg or _router_config(router_id)
+    rid = _lookup_rule_id(comment_substring, router_id)
+    if rid and await mikrotik_api_async.enable_firewall_rule_checked(rid, comment_substring, cfg=cfg):
+        return rid
+    if not rid and _index_is_fresh(router_id):
+        return None
+    from mikrotik_2fa_bot.services.cache_refresher import FIREWALL_RULES, refresh_cache
+
+    # Forced: an in-place comment edit keeps the .id fingerprint. Concurrent misses share one refresh.
+    await refresh_cache(FIREWALL_RULES, router_id, force=True)
+    rid = _lookup_rule_id(comment_substring, router_id)
+    if not rid:
+        return None
+    await mikrotik_api_async.set_firewall_rule_enabled(rid, enabled=True, cfg=cfg)
+    return rid
@@ -0,0 +1,896 @@
+from __future__ import annotations
+
+import asyncio
+from contextlib import aclosing, asynccontextmanager
+from dataclasses import dataclass, field
+import hashlib
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Sequence, Set
+
+from librouteros.exceptions import MultiTrapError, TrapError
+
+from mikrotik_2fa_bot.config import settings
+from mikrotik_2fa_bot.services.circuit_breaker import CircuitBreaker, get_breaker
+from mikrotik_2fa_bot.services.ros_async import AsyncRosConnection, get_async_pool
+from mikrotik_2fa_bot.services.ros_common import (
+    ActiveSession,
+    MikroTikAPIError,
+    RouterCapabilities,
+    RouterConfig,
+    RouterTestReport,
+    RouterUnavailableError,
+    current_router_config,
+    is_transport_error,
+    session_to_active,
+)
+from mikrotik_2fa_bot.services.ros_records import FirewallRule, UmSession, UmUser, _normalize_bool
+
+
+# RouterOS client of the bot. All router I/O runs on the event loop over one multiplexed
+# connection per router (ros_async), so handlers await router calls without blocking
+# the loop or using executor threads.
+
+
+@dataclass(slots=True)
+class CommandReply:
+    rows: List[Dict[str, Any]] = field(default_factory=list)
+    error: Optional[str] = None
+    category: Optional[int] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def _bool_str(value: bool) -> str:
+    # RouterOS API often expects boolean as "true"/"false" strings
+    return "true" if bool(value) else "false"
+
+
+def _is_trap(exc: BaseException) -> bool:
+    return isinstance(exc, (TrapError, MultiTrapError))
+
+
+def _trap_text(exc: BaseException | None) -> str:
+    parts: List[str] = []
+    while exc is not None:
+        parts.append(str(exc).lower())
+        exc = exc.__cause__
+    return " | ".join(parts)
+
+
+def _is_no_such_item(exc: BaseException | None) -> bool:
+    """RouterOS trap for a stale/unknown .id."""
+    return "no such item" in _trap_text(exc)
+
+
+def _is_no_such_command(exc: BaseException | None) -> bool:
+    """RouterOS trap for an unknown menu/command ("no such command prefix", "no such command")."""
+    return "no such command" in _trap_text(exc)
+
+
+class _CapabilitiesCache:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._items: Dict[RouterConfig, RouterCapabilities] = {}
+
+    def get(self, cfg: RouterConfig) -> Optional[RouterCapabilities]:
+        with self._lock:
+            return self._items.get(cfg)
+
+    def put(self, cfg: RouterConfig, caps: RouterCapabilities) -> None:
+        with self._lock:
+            self._items[cfg] = caps
+
+    def drop(self, cfg: RouterConfig) -> None:
+        with self._lock:
+            self._items.pop(cfg, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+
+_capabilities = _CapabilitiesCache()
+
+
+def reset_pool() -> None:
+    """
+    Drop pooled connections and cached router capabilities
+    (e.g. after router settings were changed).
+    """
+    get_async_pool().clear()
+    _capabilities.clear()
+
+
+def _record_breaker_result(breaker: CircuitBreaker, exc: BaseException) -> None:
+    """Only transport failures count against the router; a !trap means it answered."""
+    if is_transport_error(exc) or is_transport_error(exc.__cause__):
+        breaker.record_failure(exc)
+    else:
+        breaker.record_success()
+
+
+@asynccontextmanager
+async def ros_conn(cfg: RouterConfig | None = None):
+    """
+    Yield the shared AsyncRosConnection for the router and map failures to
+    MikroTikAPIError. Commands time out on their own (AsyncRosConnection.timeout);
+    a caller cancelled by an outer deadline while the router sent nothing also
+    counts as a failure.
+    """
+    cfg = cfg or current_router_config()
+    if not cfg.host or not cfg.username or not cfg.password:
+        raise MikroTikAPIError("RouterOS API credentials are not configured (MIKROTIK_HOST/USERNAME/PASSWORD)")
+
+    breaker = get_breaker(cfg)
+    probe = breaker.acquire()
+    if probe is None:
+        raise RouterUnavailableError(breaker.unavailable_message())
+
+    pool = get_async_pool()
+    try:
+        conn = await pool.acquire(cfg)
+    except Exception as e:  # noqa: BLE001
+        _record_breaker_result(breaker, e)
+        raise MikroTikAPIError(str(e) or e.__class__.__name__) from e
+    if probe:
+        try:
+            await conn.run("/system/identity/print")
+        except Exception as e:  # noqa: BLE001
+            _record_breaker_result(breaker, e)
+            if is_transport_error(e):
+                pool.discard(conn)
+            raise MikroTikAPIError(str(e) or e.__class__.__name__) from e
+
+    entered = time.monotonic()
+    try:
+        yield conn
+    except asyncio.CancelledError:
+        waited = time.monotonic() - entered
+        if conn.last_rx < entered and waited >= 1.0:
+            breaker.record_failure(f"no reply for {waited:.0f}s (cancelled)")
+        raise
+    except Exception as e:  # noqa: BLE001
+        # Timeouts count against the router, but only abandon our command (it gets
+        # /cancel-ed); other commands multiplexed on the connection are unaffected.
+        _record_breaker_result(breaker, e)
+        if not isinstance(e, TimeoutError) and (is_transport_error(e) or is_transport_error(e.__cause__)):
+            pool.discard(conn)
+        if _is_no_such_command(e):
+            _capabilities.drop(cfg)
+        if isinstance(e, MikroTikAPIError):
+            raise
+        raise MikroTikAPIError(str(e) or e.__class__.__name__) from e
+    else:
+        breaker.record_success()
+
+
+async def _call(conn: AsyncRosConnection, cmd: str, *words: str) -> CommandReply:
+    """Run a command; a !trap is returned as CommandReply.error, transport errors raise."""
+    try:
+        return CommandReply(rows=await conn.run(cmd, *words))
+    except Exception as e:  # noqa: BLE001
+        if not _is_trap(e):
+            raise
+        return CommandReply(error=str(e), category=getattr(e, "category", None))
+
+
+async def _read(conn: AsyncRosConnection, path: str, *words: str) -> CommandReply:
+    return await _call(conn, f"/{path}/print", *words)
+
+
+_UM_PREFIXES = ("user-manager", "tool/user-manager")
+
+
+def _parse_major_version(version: str | None) -> Optional[int]:
+    try:
+        return int(str(version or "").strip().split(".", 1)[0])
+    except Exception:
+        return None
+
+
+# Capability probe reads: (key, menu path, print words)
+_PROBE_READS = (
+    ("identity", "system/identity", ()),
+    ("resource", "system/resource", ("=.proplist=version",)),
+    *((f"um:{prefix}", f"{prefix}/user", ("=count-only=",)) for prefix in _UM_PREFIXES),
+    ("service", "ip/service", ("=.proplist=name,disabled",)),
+    ("firewall", "ip/firewall/filter", ("=count-only=",)),
+)
+
+
+def _capabilities_from_replies(r: Dict[str, CommandReply]) -> RouterCapabilities:
+    """Interpret the _PROBE_READS replies."""
+    notes: List[str] = []
+    if not r["identity"].ok:
+        raise MikroTikAPIError(f"Failed to query /system/identity: {r['identity'].error}")
+    rows = r["identity"].rows
+    identity = str(rows[0].get("name") or "OK") if rows else None
+
+    version: str | None = None
+    if r["resource"].ok:
+        for row in r["resource"].rows:
+            version = str(row.get("version") or "") or version
+    else:
+        notes.append("Не удалось прочитать /system/resource (версия RouterOS неизвестна)")
+    major = _parse_major_version(version)
+
+    # v6 keeps User Manager under /tool; prefer the likely location if both answer.
+    prefixes = tuple(reversed(_UM_PREFIXES)) if major is not None and major < 7 else _UM_PREFIXES
+    um_prefix: str | None = None
+    um_error: str | None = None
+    for prefix in prefixes:
+        reply = r[f"um:{prefix}"]
+        if reply.ok:
+            um_prefix = prefix
+            um_error = None
+            break
+        um_error = reply.error
+
+    api_enabled: bool | None = None
+    api_ssl_enabled: bool | None = None
+    if r["service"].ok:
+        for row in r["service"].rows:
+            name = str(row.get("name") or "")
+            disabled = _normalize_bool(row.get("disabled"))
+            enabled = (disabled is False) if disabled is not None else None
+            if name == "api":
+                api_enabled = enabled
+            elif name == "api-ssl":
+                api_ssl_enabled = enabled
+    else:
+        # Not fatal (read permissions differ by RouterOS user policy)
+        notes.append("Не удалось прочитать /ip/service (недостаточно прав?)")
+
+    return RouterCapabilities(
+        identity=identity,
+        version=version,
+        major_version=major,
+        um_prefix=um_prefix,
+        um_error=um_error,
+        api_enabled=api_enabled,
+        api_ssl_enabled=api_ssl_enabled,
+        firewall_read_ok=r["firewall"].ok,
+        notes=tuple(notes),
+        probed_at=time.time(),
+    )
+
+
+async def _get_capabilities(conn: AsyncRosConnection, refresh: bool = False) -> RouterCapabilities:
+    caps = None if refresh else _capabilities.get(conn.cfg)
+    if caps is None:
+        # One-shot probe: identity, RouterOS version, User Manager menu location,
+        # api/api-ssl service state and firewall read permission, all in flight at once.
+        replies = await asyncio.gather(*(_read(conn, path, *words) for _key, path, words in _PROBE_READS))
+        caps = _capabilities_from_replies({key: r for (key, _p, _w), r in zip(_PROBE_READS, replies)})
+        _capabilities.put(conn.cfg, caps)
+    return caps
+
+
+async def get_router_capabilities(refresh: bool = False, cfg: RouterConfig | None = None) -> RouterCapabilities:
+    async with ros_conn(cfg) as conn:
+        return await _get_capabilities(conn, refresh=refresh)
+
+
+# --- User Manager users
+
+
+async def iter_user_manager_usernames(cfg: RouterConfig | None = None) -> AsyncIterator[str]:
+    """Stream User Manager usernames (also warms the shared .id index)."""
+    async with ros_conn(cfg) as conn:
+        path = (await _get_capabilities(conn)).um_path("user")
+        try:
+            async with aclosing(conn.stream(f"/{path}/print", f"=.proplist={UmUser.PROPLIST}")) as rows:
+                async for row in rows:
+                    u = UmUser.from_row(row)
+                    if not u:
+                        continue
+                    if u.id:
+                        _um_user_ids.put(conn.cfg, u.name, u.id)
+                    yield u.name
+        except Exception as e:  # noqa: BLE001
+            if not _is_trap(e):
+                raise
+            raise MikroTikAPIError(f"User Manager users are not available via RouterOS API: {e}") from e
+
+
+def _ids_fingerprint(ids: Iterable[str]) -> str:
+    """"<count>:<sha1 of the .id sequence>": changes when rows are added, removed or renumbered."""
+    h = hashlib.sha1()
+    n = 0
+    for rid in ids:
+        h.update(rid.encode())
+        h.update(b",")
+        n += 1
+    return f"{n}:{h.hexdigest()}"
+
+
+async def _read_ids_fingerprint(conn: AsyncRosConnection, path: str, what: str) -> str:
+    ids: List[str] = []
+    try:
+        async with aclosing(conn.stream(f"/{path}/print", "=.proplist=.id")) as rows:
+            async for row in rows:
+                ids.append(str(row.get(".id") or ""))
+    except Exception as e:  # noqa: BLE001
+        if not _is_trap(e):
+            raise
+        raise MikroTikAPIError(f"Failed to read {what}: {e}") from e
+    return _ids_fingerprint(ids)
+
+
+async def user_manager_users_fingerprint(cfg: RouterConfig | None = None) -> str:
+    async with ros_conn(cfg) as conn:
+        path = (await _get_capabilities(conn)).um_path("user")
+        return await _read_ids_fingerprint(conn, path, "User Manager users")
+
+
+async def firewall_filter_fingerprint(cfg: RouterConfig | None = None) -> str:
+    async with ros_conn(cfg) as conn:
+        return await _read_ids_fingerprint(conn, "ip/firewall/filter", "firewall rules")
+
+
+async def list_user_manager_users(cfg: RouterConfig | None = None) -> List[UmUser]:
+    async with ros_conn(cfg) as conn:
+        path = (await _get_capabilities(conn)).um_path("user")
+        r = await _read(conn, path, f"=.proplist={UmUser.PROPLIST}")
+        if not r.ok:
+            raise MikroTikAPIError(f"User Manager users are not available via RouterOS API: {r.error}")
+        return [u for u in map(UmUser.from_row, r.rows) if u]
+
+
+class _UmUserIdIndex:
+    """
+    In-process username -> UM user .id map (per router), so mutations skip the user table scan.
+    Filled by targeted lookups and opportunistically by full username streams.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._ids: Dict[tuple, Dict[str, str]] = {}
+
+    @staticmethod
+    def _key(cfg: RouterConfig) -> tuple:
+        return (cfg.host, int(cfg.port))
+
+    def get(self, cfg: RouterConfig, username: str) -> Optional[str]:
+        with self._lock:
+            return self._ids.get(self._key(cfg), {}).get(username)
+
+    def put(self, cfg: RouterConfig, username: str, rid: str) -> None:
+        with self._lock:
+            self._ids.setdefault(self._key(cfg), {})[username] = rid
+
+    def drop(self, cfg: RouterConfig, username: str) -> None:
+        with self._lock:
+            self._ids.get(self._key(cfg), {}).pop(username, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._ids.clear()
+
+
+_um_user_ids = _UmUserIdIndex()
+
+
+def _um_row_names(row: Dict[str, Any]) -> List[str]:
+    """name/username of a UM user row as text: librouteros parses a name like "1001" to an int."""
+    return [str(row[key]) for key in ("name", "username") if row.get(key) is not None]
+
+
+# Usernames per server-side query (keeps sentences small; one round trip per chunk)
+_SESSION_QUERY_CHUNK = 32
+
+
+def _chunks(values: Sequence[str], size: int) -> Iterator[Sequence[str]]:
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def _or_query(key: str, values: List[str]) -> List[str]:
+    """RouterOS API query words matching key == any of values (?key=a ?key=b ?#|)."""
+    words = [f"?{key}={v}" for v in values]
+    if len(values) > 1:
+        words.append("?#" + "|" * (len(values) - 1))
+    return words
+
+
+async def _resolve_um_user_ids(conn: AsyncRosConnection, usernames: List[str], use_index: bool = True) -> Dict[str, str]:
+    out: Dict[str, str] = {}
+    missing: List[str] = []
+    for u in usernames:
+        rid = _um_user_ids.get(conn.cfg, u) if use_index else None
+        if rid:
+            out[u] = rid
+        else:
+            missing.append(u)
+    if not missing:
+        return out
+
+    path = (await _get_capabilities(conn)).um_path("user")
+    chunks = list(_chunks(missing, _SESSION_QUERY_CHUNK))
+    replies = await asyncio.gather(*(
+        _read(conn, path, f"=.proplist={UmUser.PROPLIST}", *_or_query("name", c), *_or_query("username", c), "?#|")
+        for c in chunks
+    ))
+    scan: Optional[CommandReply] = None
+    for chunk, reply in zip(chunks, replies):
+        if not reply.ok:
+            # Query words rejected: match against a full table read (once).
+            if scan is None:
+                scan = await _read(conn, path, f"=.proplist={UmUser.PROPLIST}")
+                if not scan.ok:
+                    raise MikroTikAPIError(f"User Manager users are not available via RouterOS API: {scan.error}")
+            reply = scan
+        want = set(chunk)
+        for row in reply.rows:
+            rid = row.get(".id") or row.get("id")
+            if not rid:
+                continue
+            for u in _um_row_names(row):
+                if u in want and u not in out:
+                    out[u] = str(rid)
+                    _um_user_ids.put(conn.cfg, u, str(rid))
+    return out
+
+
+async def set_vpn_users_disabled(usernames: Iterable[str], disabled: bool, cfg: RouterConfig | None = None) -> List[str]:
+    """
+    Bulk enable/disable of EXISTING UM users with one multi-id `set` (.id=*1,*2,...).
+    Returns the usernames that were not found in User Manager (the rest were updated).
+
+    With a warm .id index this is a single round trip; index misses add one lookup.
+    A stale .id fails the whole set ("no such item"): ids are re-resolved and the set retried once.
+    """
+    names = list(dict.fromkeys(str(u).strip() for u in (usernames or []) if str(u or "").strip()))
+    if not names:
+        return []
+    async with ros_conn(cfg) as conn:
+        path = (await _get_capabilities(conn)).um_path("user")
+        for attempt in range(2):
+            ids = await _resolve_um_user_ids(conn, names, use_index=(attempt == 0))
+            missing = [u for u in names if u not in ids]
+            if not ids:
+                return missing
+            try:
+                await conn.run(
+                    f"/{path}/set",
+                    f"=.id={','.join(dict.fromkeys(ids.values()))}",
+                    f"=disabled={_bool_str(disabled)}",
+                )
+                return missing
+            except Exception as e:  # noqa: BLE001
+                if attempt == 0 and _is_no_such_item(e):
+                    for u in ids:
+                        _um_user_ids.drop(conn.cfg, u)
+                    continue
+                raise
+    return names
+
+
+async def set_vpn_user_disabled(username: str, disabled: bool, cfg: RouterConfig | None = None) -> None:
+    """Enable/disable an EXISTING User Manager user (STRICT MODE: no PPP fallback)."""
+    if await set_vpn_users_disabled([username], disabled, cfg=cfg):
+        raise MikroTikAPIError(f"User Manager user '{username}' not found")
+
+
+# --- sessions
+
+
+async def _read_active_session_rows(conn: AsyncRosConnection, usernames: Optional[Set[str]]) -> List[UmSession]:
+    path = (await _get_capabilities(conn)).um_path("session")
+    proplist = f"=.proplist={UmSession.PROPLIST}"
+    if usernames is None:
+        queries = [("?active=yes",)]
+    else:
+        queries = [("?active=yes", *_or_query("user", c), "?#&") for c in _chunks(sorted(usernames), _SESSION_QUERY_CHUNK)]
+    replies = await asyncio.gather(*(_read(conn, path, proplist, *q) for q in queries))
+    if all(r.ok for r in replies):
+        return [UmSession.from_row(row) for r in replies for row in r.rows]
+    # Query words rejected: read the whole table, filter client-side.
+    r = await _read(conn, path, proplist)
+    if not r.ok:
+        raise MikroTikAPIError(f"User Manager sessions are not available via RouterOS API: {r.error}")
+    return [UmSession.from_row(row) for row in r.rows]
+
+
+async def list_active_sessions(source: str = "auto", cfg: RouterConfig | None = None) -> List[ActiveSession]:
+    async with ros_conn(cfg) as conn:
+        out: List[ActiveSession] = []
+        for s in await _read_active_session_rows(conn, None):
+            a = session_to_active(s)
+            if a:
+                out.append(a)
+        return out
+
+
+async def list_active_sessions_map_for_users(
+    usernames: Set[str], source: str = "auto", cfg: RouterConfig | None = None
+) -> Dict[str, ActiveSession]:
+    need: Set[str] = {str(u) for u in (usernames or set()) if str(u)}
+    if not need:
+        return {}
+    async with ros_conn(cfg) as conn:
+        out: Dict[str, ActiveSession] = {}
+        for s in await _read_active_session_rows(conn, need):
+            a = session_to_active(s)
+            if a and a.username in need and a.username not in out:
+                out[a.username] = a
+        return out
+
+
+async def _remove_ids(conn: AsyncRosConnection, path: str, ids: List[str]) -> None:
+    if not ids:
+        return
+    try:
+        await conn.run(f"/{path}/remove", f"=.id={','.join(ids)}")
+        return
+    except Exception as e:  # noqa: BLE001
+        if not _is_trap(e):
+            raise
+        if len(ids) == 1:
+            return
+    # One .id vanished meanwhile: retry individually
+    await asyncio.gather(*(conn.run(f"/{path}/remove", f"=.id={rid}") for rid in ids), return_exceptions=True)
+
+
+async def disconnect_active_connections_many(usernames: Iterable[str], cfg: RouterConfig | None = None) -> None:
+    """Best-effort disconnect (PPP active + active UM sessions) for many users."""
+    names = sorted({str(u).strip() for u in (usernames or []) if str(u or "").strip()})
+    if not names:
+        return
+    need = set(names)
+    async with ros_conn(cfg) as conn:
+        caps = await _get_capabilities(conn)
+        chunks = list(_chunks(names, _SESSION_QUERY_CHUNK))
+        ppp_reads = [_read(conn, "ppp/active", "=.proplist=.id,name", *_or_query("name", c)) for c in chunks]
+        um_read = _read_active_session_rows(conn, need) if caps.um_prefix else None
+        results = await asyncio.gather(*ppp_reads, *([um_read] if um_read else []), return_exceptions=True)
+        for r in results:
+            if isinstance(r, BaseException) and not isinstance(r, MikroTikAPIError):
+                raise r
+
+        ppp_ids: List[str] = []
+        for r in results[:len(ppp_reads)]:
+            for s in r.rows:
+                u = s.get("name") or s.get("user") or s.get("username")
+                rid = s.get(".id") or s.get("id")
+                if str(u) in need and rid:
+                    ppp_ids.append(str(rid))
+        um_ids: List[str] = []
+        if um_read and not isinstance(results[-1], BaseException):
+            um_ids = [s.id for s in results[-1] if s.user in need and s.active is True and s.id]
+
+        removes = [_remove_ids(conn, "ppp/active", ppp_ids)]
+        if um_ids:
+            removes.append(_remove_ids(conn, caps.um_path("session"), um_ids))
+        await asyncio.gather(*removes)
+
+
+async def disconnect_active_connections(username: str, cfg: RouterConfig | None = None) -> None:
+    if not username:
+        return
+    await disconnect_active_connections_many([username], cfg=cfg)
+
+
+# --- firewall
+
+
+async def iter_firewall_filter_rules(
+    comment_substring: str | None = None, cfg: RouterConfig | None = None
+) -> AsyncIterator[FirewallRule]:
+    needle = (comment_substring or "").strip().lower()
+    async with ros_conn(cfg) as conn:
+        try:
+            async with aclosing(conn.stream("/ip/firewall/filter/print", f"=.proplist={FirewallRule.PROPLIST}")) as rows:
+                async for row in rows:
+                    r = FirewallRule.from_row(row)
+                    if needle and needle not in r.comment.lower():
+                        continue
+                    yield r
+        except Exception as e:  # noqa: BLE001
+            if not _is_trap(e):
+                raise
+            raise MikroTikAPIError(f"Failed to read firewall rules: {e}") from e
+
+
+async def list_firewall_filter_rules(
+    comment_substring: str | None = None, limit: int | None = None, cfg: RouterConfig | None = None
+) -> List[FirewallRule]:
+    """
+    List /ip/firewall/filter rules, optionally only those whose comment contains
+    comment_substring (case-insensitive). Once `limit` rules matched, the rest of the
+    print is /cancel-ed on the router.
+    """
+    lim = None if limit is None else max(0, int(limit))
+    out: List[FirewallRule] = []
+    async with aclosing(iter_firewall_filter_rules(comment_substring, cfg=cfg)) as rules:
+        async for r in rules:
+            out.append(r)
+            if lim is not None and lim > 0 and len(out) >= lim:
+                break
+    return out
+
+
+async def find_firewall_rule_by_comment_substring(
+    comment_substring: str, cfg: RouterConfig | None = None
+) -> Optional[FirewallRule]:
+    if not (comment_substring or "").strip():
+        return None
+    rules = await list_firewall_filter_rules(comment_substring, limit=1, cfg=cfg)
+    return rules[0] if rules else None
+
+
+async def set_firewall_rule_enabled(rule_id: str, enabled: bool, cfg: RouterConfig | None = None) -> None:
+    rid = (rule_id or "").strip()
+    if not rid:
+        return
+    async with ros_conn(cfg) as conn:
+        try:
+            await conn.run("/ip/firewall/filter/set", f"=.id={rid}", f"=disabled={_bool_str(not enabled)}")
+        except Exception as e:  # noqa: BLE001
+            if not _is_trap(e):
+                raise
+            raise MikroTikAPIError(f"Failed to update firewall rule {rid}: {e}") from e
+
+
+_INDEXED_RULE_PROPLIST = "comment,disabled"
+
+
+def _indexed_rule_state(read: CommandReply, needle: str) -> Optional[bool]:
+    """
+    State of a rule whose .id came from the comment index, read back by .id: None if the
+    .id is stale (gone, or reused by a rule without the indexed comment), else whether
+    the rule is disabled.
+    """
+    row = next(iter(read.rows), None) if read.ok else None
+    if row is None or needle not in str(row.get("comment") or "").lower():
+        return None
+    return _normalize_bool(row.get("disabled")) is not False
+
+
+async def enable_firewall_rule_checked(rule_id: str, comment_substring: str, cfg: RouterConfig | None = None) -> bool:
+    """
+    Enable a rule whose .id came from the comment index. The rule is read back first and
+    only enabled if it still carries the indexed comment: returns False if the .id is
+    stale (gone, or reused by a rule with another comment; that rule is never touched).
+    """
+    rid = (rule_id or "").strip()
+    needle = (comment_substring or "").strip().lower()
+    if not rid:
+        return False
+    async with ros_conn(cfg) as conn:
+        read = await _read(conn, "ip/firewall/filter", f"=.proplist={_INDEXED_RULE_PROPLIST}", f"?.id={rid}")
+        disabled = _indexed_rule_state(read, needle)
+        if disabled is None:
+            return False
+        if not disabled:
+            return True
+        return (await _call(conn, "/ip/firewall/filter/set", f"=.id={rid}", "=disabled=false")).ok
+
+
+# --- address-list access (FIREWALL_ACCESS_MODE=address_list)
+
+
+_ADDRESS_LIST_PATH = "ip/firewall/address-list"
+
+
+def _address_list_attrs(timeout_seconds: int, comment: str) -> Dict[str, str]:
+    # RouterOS removes the (dynamic) entry by itself once the timeout runs out.
+    return {"timeout": f"{max(1, int(timeout_seconds))}s", "comment": comment}
+
+
+def _added_id(reply: CommandReply) -> Optional[str]:
+    """.id returned by an `add` (`!done =ret=*N`)."""
+    if not reply.ok:
+        return None
+    return next((str(r["ret"]) for r in reply.rows if r.get("ret")), None)
+
+
+async def add_address_list_entry(
+    list_name: str, address: str, timeout_seconds: int, comment: str = "", cfg: RouterConfig | None = None
+) -> str:
+    """
+    Put an address on a firewall address-list with a router-enforced timeout; returns the entry .id.
+    If the address is already on the list (reconnect, repeated confirm) that entry's timeout and
+    comment are updated instead.
+    """
+    attrs = _address_list_attrs(timeout_seconds, comment)
+    words = tuple(f"={k}={v}" for k, v in attrs.items())
+    async with ros_conn(cfg) as conn:
+        added = await _call(conn, f"/{_ADDRESS_LIST_PATH}/add", f"=list={list_name}", f"=address={address}", *words)
+        rid = _added_id(added)
+        if rid:
+            return rid
+        found = await _read(conn, _ADDRESS_LIST_PATH, "=.proplist=.id", f"?list={list_name}", f"?address={address}")
+        rid = next((str(r[".id"]) for r in found.rows if r.get(".id")), None)
+        if not rid:
+            raise MikroTikAPIError(f"Failed to add {address} to address-list {list_name}: {added.error or found.error}")
+        updated = await _call(conn, f"/{_ADDRESS_LIST_PATH}/set", f"=.id={rid}", *words)
+        if not updated.ok:
+            raise MikroTikAPIError(f"Failed to update address-list entry {rid}: {updated.error}")
+        return rid
+
+
+async def remove_address_list_entry(entry_id: str, cfg: RouterConfig | None = None) -> None:
+    """Remove an address-list entry; one that already timed out on the router is not an error."""
+    rid = (entry_id or "").strip()
+    if not rid:
+        return
+    async with ros_conn(cfg) as conn:
+        reply = await _call(conn, f"/{_ADDRESS_LIST_PATH}/remove", f"=.id={rid}")
+        if not reply.ok and "no such item" not in reply.error.lower():
+            raise MikroTikAPIError(f"Failed to remove address-list entry {rid}: {reply.error}")
+
+
+# --- revoke script (REVOKE_MODE=script)
+
+
+_REVOKE_SCRIPT_HEADER = "# Managed by mikrotik-2fa-bot (REVOKE_MODE=script): changes are overwritten."
+
+
+def _revoke_script_source(caps: RouterCapabilities) -> str:
+    """
+    Source of the bot-managed revoke script. It is called as a function with
+    user=, rule= and entry= arguments: disable the UM user and the firewall rule, drop the
+    address-list entry and kick the user's sessions. Every step runs in its own
+    `:do {} on-error={}`, so one failing step does not skip the rest; the script prints
+    "ok", or which steps failed and which were done. A missing address-list entry (timed
+    out already) and a vanished session are not failures; no UM user with that name is
+    (the caller falls back to the separate steps).
+    """
+    lines = [_REVOKE_SCRIPT_HEADER, ':local done ""', ':local failed ""']
+    um = "/" + caps.um_prefix.replace("/", " ") if caps.um_prefix else None
+    if um:
+        # v7 UM users have `name`, v6 (/tool user-manager) `username`.
+        prop = "username" if caps.um_prefix.startswith("tool/") else "name"
+        lines.append(
+            f":if ([:len $user] > 0) do={{ :do {{ :local ids [{um} user find where {prop}=$user];"
+            ' :if ([:len $ids] = 0) do={ :error "no such user" };'
+            f' {um} user set $ids disabled=yes; :set done "$done user" }} on-error={{ :set failed "$failed user" }} }}'
+        )
+    lines.append(
+        ":if ([:len $rule] > 0) do={ :do { /ip firewall filter set $rule disabled=yes;"
+        ' :set done "$done rule" } on-error={ :set failed "$failed rule" } }'
+    )
+    lines.append(
+        ':if ([:len $entry] > 0) do={ :do { /ip firewall address-list remove $entry; :set done "$done entry" } on-error={} }'
+    )
+    lines.append(":if ([:len $user] > 0) do={")
+    if um:
+        lines.append(f'  :do {{ {um} session remove [find where user=$user active]; :set done "$done kick" }} on-error={{}}')
+    lines.append('  :do { /ppp active remove [find where name=$user]; :set done "$done kick-ppp" } on-error={}')
+    lines.append("}")
+    lines.append(':if ([:len $failed] = 0) do={ :put "ok" } else={ :put "failed:$failed; done:$done" }')
+    return "\n".join(lines)
+
+
+def _ros_quote(value: str | None) -> str:
+    s = str(value or "")
+    return '"' + s.replace("\\", "\\\\").replace('"', '\\"').replace("$", "\\$") + '"'
+
+
+def _revoke_call(name: str, username: str, rule_id: str | None, entry_id: str | None = None) -> str:
+    """/execute script that runs the stored revoke script with arguments."""
+    return (
+        f":local revoke [:parse [/system script get {_ros_quote(name)} source]]; "
+        f"$revoke user={_ros_quote(username)} rule={_ros_quote(rule_id)} entry={_ros_quote(entry_id)}"
+    )
+
+
+def _revoke_script_install(rows: List[Dict[str, Any]], name: str, source: str) -> Optional[tuple[str, tuple[str, ...]]]:
+    """Command that installs/updates the script given its current `print` rows (None: up to date)."""
+    if not rows:
+        return "/system/script/add", (f"=name={name}", f"=source={source}")
+    if str(rows[0].get("source") or "") != source:
+        return "/system/script/set", (f"=.id={rows[0].get('.id')}", f"=source={source}")
+    return None
+
+
+def _revoke_error(reply: CommandReply) -> Optional[str]:
+    """None if every step of the script succeeded, otherwise what went wrong (failed and done steps)."""
+    if not reply.ok:
+        return reply.error
+    out = next((str(r.get("ret") or "") for r in reply.rows if "ret" in r), "").strip()
+    return None if out == "ok" else (out or "no output")
+
+
+# Script source known to be installed, per router config: revoke is one /execute after the first call.
+_revoke_scripts: Dict[RouterConfig, str] = {}
+_revoke_scripts_lock = threading.Lock()
+
+
+async def _ensure_revoke_script(conn: AsyncRosConnection, caps: RouterCapabilities, force: bool = False) -> str:
+    name = settings.REVOKE_SCRIPT_NAME
+    source = _revoke_script_source(caps)
+    with _revoke_scripts_lock:
+        if not force and _revoke_scripts.get(conn.cfg) == source:
+            return name
+    reply = await _read(conn, "system/script", "=.proplist=.id,source", f"?name={name}")
+    if reply.ok:
+        install = _revoke_script_install(reply.rows, name, source)
+        if install:
+            reply = await _call(conn, install[0], *install[1])
+    if not reply.ok:
+        raise MikroTikAPIError(f"Failed to install revoke script {name}: {reply.error}")
+    with _revoke_scripts_lock:
+        _revoke_scripts[conn.cfg] = source
+    return name
+
+
+async def revoke_access(
+    username: str,
+    firewall_rule_id: str | None = None,
+    cfg: RouterConfig | None = None,
+    address_list_entry_id: str | None = None,
+) -> None:
+    """
+    Revoke a user's access in one round trip (REVOKE_MODE=script): a single /execute of the
+    bot-managed script disables the UM user and the firewall rule (or drops the address-list
+    entry) and kicks the sessions on the router itself. The script is (re)installed on first
+    use and if it was removed or edited.
+    """
+    async with ros_conn(cfg) as conn:
+        caps = await _get_capabilities(conn)
+        for attempt in range(2):
+            name = await _ensure_revoke_script(conn, caps, force=(attempt > 0))
+            script = _revoke_call(name, username, firewall_rule_id, address_list_entry_id)
+            err = _revoke_error(await _call(conn, "/execute", f"=script={script}", "=as-string="))
+            if err is None:
+                return
+        raise MikroTikAPIError(f"Revoke script {name} failed for {username}: {err}")
+
+
+# --- diagnostics
+
+
+async def test_connection_report(cfg: RouterConfig | None = None) -> RouterTestReport:
+    """
+    Detailed connectivity test via RouterOS API (/test_router); refreshes the cached
+    capability probe the other functions dispatch on.
+    """
+    cfg = cfg or current_router_config()
+    host = cfg.host
+    port = int(cfg.port)
+    use_ssl = bool(cfg.use_ssl)
+    timeout_s = int(cfg.timeout_seconds)
+    notes: List[str] = []
+
+    # TCP probe (fast fail with actionable error)
+    try:
+        _r, w = await asyncio.wait_for(asyncio.open_connection(host, port), timeout=float(timeout_s))
+        w.close()
+    except Exception as e:  # noqa: BLE001
+        raise MikroTikAPIError(
+            f"TCP connect failed to {host}:{port}: {e or e.__class__.__name__}. "
+            "Проверьте что на MikroTik включен API сервис (/ip service enable api), "
+            "порт (8728 или 8729 для api-ssl), и что firewall разрешает доступ с IP сервера."
+        ) from e
+
+    t0 = time.monotonic()
+    async with ros_conn(cfg) as conn:
+        t_api = time.monotonic() - t0
+        notes.append(f"RouterOS API session OK ({t_api:.2f}s)")
+        caps = await _get_capabilities(conn, refresh=True)
+
+    notes.extend(caps.notes)
+    if not caps.um_prefix:
+        notes.append(f"User Manager недоступен через API: {caps.um_error}")
+
+    return RouterTestReport(
+        host=host,
+        port=port,
+        use_ssl=use_ssl,
+        timeout_seconds=timeout_s,
+        tcp_ok=True,
+        api_ok=True,
+        identity=caps.identity,
+        router_version=caps.version,
+        user_manager_path=caps.um_prefix,
+        user_manager_ok=caps.um_prefix is not None,
+        firewall_ok=caps.firewall_read_ok,
+        ip_service_api_enabled=caps.api_enabled,
+        ip_service_api_ssl_enabled=caps.api_ssl_enabled,
+        notes=notes,
+    )
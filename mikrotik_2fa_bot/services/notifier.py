@@ -0,0 +1,302 @@
+from __future__ import annotations
+
+import asyncio
+import itertools
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass
+from datetime import timedelta
+from enum import IntEnum
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from telegram.error import BadRequest, Forbidden, RetryAfter
+
+from mikrotik_2fa_bot.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    PROMPT = 0  # 2FA confirmation requests: the user is waiting to get access
+    REPLY = 1  # answers to something the user just did
+    NOTICE = 2  # informational (session expired, disconnected, ...)
+
+
+@dataclass(frozen=True, slots=True)
+class NotifierStats:
+    queued: int  # waiting in the queue right now
+    sent: int
+    failed: int  # dropped after an error (bot blocked, bad request, retries used up)
+    retries: int
+    flood_waits: int  # RetryAfter received from Telegram
+    avg_latency_ms: float  # enqueue -> sent, over the last 200 messages
+    max_latency_ms: float
+
+
+class TokenBucket:
+    """`rate` tokens per second, up to `capacity`. rate <= 0: unlimited."""
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = float(rate)
+        self.capacity = max(1.0, float(capacity))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def reserve(self) -> float:
+        """Take a token; returns how long to wait before it may be used (tokens can go negative)."""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1.0
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def idle(self) -> bool:
+        return self.rate <= 0 or self.tokens + (time.monotonic() - self.updated) * self.rate >= self.capacity
+
+
+@dataclass(slots=True)
+class _Message:
+    chat_id: int
+    text: str
+    kwargs: Dict[str, Any]
+    queued_at: float
+    attempts: int = 0
+    paced: bool = False  # per-chat token already reserved for this attempt
+    on_dropped: Optional[Callable[[], None]] = None
+
+
+def _retry_after_seconds(e: RetryAfter) -> float:
+    ra = e.retry_after
+    return ra.total_seconds() if isinstance(ra, timedelta) else float(ra)
+
+
+class Notifier:
+    """
+    Outbound Telegram messages: callers enqueue and return at once, a fixed number of
+    workers send them. Sends are paced by a global and a per-chat token bucket (Telegram's
+    ~30 msg/s and ~1 msg/s per chat), lower Priority values go first, and a RetryAfter
+    pauses all workers for the time Telegram asks for before the message is retried
+    (a flood wait does not use up one of the message's max_attempts).
+    A message that has to wait for its chat is put back in the queue when its turn comes
+    instead of holding a worker, so a burst to one chat does not stall the others.
+
+    `on_dropped` (per message) is called when the message could not be delivered but
+    might be later: retries used up, or the notifier stopped with it still queued. It is
+    not called when Telegram refused the chat (bot blocked, bad request).
+    """
+
+    def __init__(
+        self,
+        bot,
+        concurrency: int = 8,
+        rate_per_second: float = 30.0,
+        chat_rate_per_second: float = 1.0,
+        max_attempts: int = 3,
+    ):
+        self.bot = bot
+        self.concurrency = max(1, int(concurrency))
+        self.max_attempts = max(1, int(max_attempts))
+        self._chat_rate = float(chat_rate_per_second)
+        # No burst allowance: a full second's worth on top of the steady rate would double it.
+        self._global = TokenBucket(rate_per_second)
+        self._chats: Dict[int, TokenBucket] = {}
+        self._queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._seq = itertools.count()
+        self._paused_until = 0.0
+        self._deferred: Dict[int, Tuple[asyncio.TimerHandle, tuple]] = {}  # seq -> (timer, item)
+        self._workers: List[asyncio.Task] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._sent = 0
+        self._failed = 0
+        self._retries = 0
+        self._flood_waits = 0
+        self._latencies: Deque[float] = deque(maxlen=200)
+
+    def start(self) -> None:
+        if self._workers and self._loop is asyncio.get_running_loop():
+            return
+        self._loop = asyncio.get_running_loop()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self, drain_timeout: float = 5.0) -> None:
+        """Give queued messages up to `drain_timeout` seconds, then stop the workers."""
+        if self._workers and drain_timeout > 0:
+            try:
+                await asyncio.wait_for(self.drain(), timeout=drain_timeout)
+            except asyncio.TimeoutError:
+                logger.warning("Notifier stopped with %s message(s) unsent", self._queue.qsize() + len(self._deferred))
+        workers, self._workers = self._workers, []
+        for w in workers:
+            w.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        left = [item for _, item in self._deferred.values()]
+        for timer, _ in self._deferred.values():
+            timer.cancel()
+        self._deferred.clear()
+        while not self._queue.empty():
+            left.append(self._queue.get_nowait())
+            self._queue.task_done()
+        for _, _, msg in left:
+            self._dropped(msg)
+
+    async def drain(self) -> None:
+        """Wait until everything queued so far was sent (or dropped)."""
+        while True:
+            await self._queue.join()
+            if not self._deferred:
+                return
+            await asyncio.sleep(0.05)
+
+    def submit(
+        self,
+        chat_id: int,
+        text: str,
+        priority: Priority = Priority.NOTICE,
+        on_dropped: Optional[Callable[[], None]] = None,
+        **kwargs: Any,
+    ) -> None:
+        self.start()
+        msg = _Message(chat_id=int(chat_id), text=text, kwargs=kwargs, queued_at=time.monotonic(), on_dropped=on_dropped)
+        self._queue.put_nowait((int(priority), next(self._seq), msg))
+
+    def stats(self) -> NotifierStats:
+        lat = list(self._latencies)
+        return NotifierStats(
+            queued=self._queue.qsize() + len(self._deferred),
+            sent=self._sent,
+            failed=self._failed,
+            retries=self._retries,
+            flood_waits=self._flood_waits,
+            avg_latency_ms=round(1000.0 * sum(lat) / len(lat), 1) if lat else 0.0,
+            max_latency_ms=round(1000.0 * max(lat), 1) if lat else 0.0,
+        )
+
+    # --- internals
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 1000:
+                # Forget chats whose bucket is full again: they would start from a full one anyway.
+                self._chats = {cid: b for cid, b in self._chats.items() if not b.idle()}
+            bucket = self._chats[chat_id] = TokenBucket(self._chat_rate)
+        return bucket
+
+    async def _worker(self) -> None:
+        while True:
+            priority, seq, msg = await self._queue.get()
+            try:
+                await self._deliver(priority, seq, msg)
+            except Exception as e:  # noqa: BLE001
+                self._failed += 1
+                logger.error("Telegram send to %s failed: %s", msg.chat_id, e)
+            finally:
+                self._queue.task_done()
+
+    async def _deliver(self, priority: int, seq: int, msg: _Message) -> None:
+        if not msg.paced:
+            msg.paced = True
+            wait = self._chat_bucket(msg.chat_id).reserve()
+            if wait > 0:
+                item = (priority, seq, msg)
+                self._deferred[seq] = (self._loop.call_later(wait, self._undefer, item), item)
+                return
+        pause = self._paused_until - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+        delay = self._global.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        msg.attempts += 1
+        msg.paced = False
+        try:
+            await self.bot.send_message(chat_id=msg.chat_id, text=msg.text, **msg.kwargs)
+        except RetryAfter as e:
+            wait = _retry_after_seconds(e)
+            self._flood_waits += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + wait)
+            logger.warning("Telegram flood limit: pausing sends for %.0fs", wait)
+            # Not the message's fault: it goes back in line without using up an attempt.
+            msg.attempts -= 1
+            self._queue.put_nowait((priority, seq, msg))
+            return
+        except (Forbidden, BadRequest) as e:
+            # Bot blocked by the user / chat gone: retrying will not help.
+            self._failed += 1
+            logger.info("Telegram send to %s dropped: %s", msg.chat_id, e)
+            return
+        except Exception as e:  # noqa: BLE001
+            # Network errors, timeouts: retry (with the same priority and place in line).
+            logger.warning("Telegram send to %s failed (attempt %s): %s", msg.chat_id, msg.attempts, e)
+            self._requeue(priority, seq, msg)
+            return
+        self._sent += 1
+        self._latencies.append(time.monotonic() - msg.queued_at)
+
+    def _undefer(self, item) -> None:
+        self._deferred.pop(item[1], None)
+        self._queue.put_nowait(item)
+
+    def _requeue(self, priority: int, seq: int, msg: _Message) -> None:
+        if msg.attempts >= self.max_attempts:
+            self._failed += 1
+            logger.error("Telegram send to %s dropped after %s attempts", msg.chat_id, msg.attempts)
+            self._dropped(msg)
+            return
+        self._retries += 1
+        self._queue.put_nowait((priority, seq, msg))
+
+    @staticmethod
+    def _dropped(msg: _Message) -> None:
+        if msg.on_dropped is None:
+            return
+        try:
+            msg.on_dropped()
+        except Exception as e:  # noqa: BLE001
+            logger.error("Dropped-message callback for %s failed: %s", msg.chat_id, e)
+
+
+_notifier: Optional[Notifier] = None
+
+
+def get_notifier(bot) -> Notifier:
+    """The process-wide notifier for `bot` (created on first use)."""
+    global _notifier
+    if _notifier is None or _notifier.bot is not bot:
+        _notifier = Notifier(
+            bot,
+            concurrency=int(settings.NOTIFY_CONCURRENCY),
+            rate_per_second=float(settings.NOTIFY_RATE_PER_SECOND),
+            chat_rate_per_second=float(settings.NOTIFY_CHAT_RATE_PER_SECOND),
+        )
+    return _notifier
+
+
+def notify(
+    bot,
+    chat_id: int,
+    text: str,
+    priority: Priority = Priority.NOTICE,
+    on_dropped: Optional[Callable[[], None]] = None,
+    **kwargs: Any,
+) -> None:
+    """
+    Queue a message (send_message kwargs such as reply_markup pass through); never blocks.
+    See Notifier for when on_dropped is called.
+    """
+    get_notifier(bot).submit(chat_id, text, priority, on_dropped, **kwargs)
+
+
+def notifier_stats() -> Optional[NotifierStats]:
+    return _notifier.stats() if _notifier is not None else None
+
+
+async def stop_notifier(drain_timeout: float = 5.0) -> None:
+    global _notifier
+    n, _notifier = _notifier, None
+    if n is not None:
+        await n.stop(drain_timeout)
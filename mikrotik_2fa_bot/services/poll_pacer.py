@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass
+from typing import Iterable, Optional, Tuple
+
+from mikrotik_2fa_bot.config import settings
+from mikrotik_2fa_bot.models import SessionStatus
+
+
+# Sessions that wait for something to happen on the router or from the user (2FA prompt, confirmation).
+PENDING_STATUSES = {SessionStatus.REQUESTED, SessionStatus.CONNECTED, SessionStatus.CONFIRM_REQUESTED}
+# Polls are spaced at least this many router round trips apart.
+_RTT_MULTIPLIER = 10.0
+# Weight of the newest router read in the RTT average.
+_RTT_ALPHA = 0.3
+# While a session is pending, RTT widening stops at this many POLL_INTERVAL_SECONDS.
+_PENDING_MAX_INTERVALS = 3.0
+
+
+@dataclass(frozen=True, slots=True)
+class PacerStats:
+    interval: float  # seconds until the poll after the last one
+    reason: str  # "pending" | "active" | "idle" | "fixed", "+rtt" if widened by router RTT
+    pending: int
+    active: int
+    rtt_ms: Optional[float]  # average router read time, None before the first read
+
+
+class PollPacer:
+    """
+    Chooses the poll interval for the `poll_mikrotik` job from the last poll's session mix
+    and the measured router round trip. The job itself ticks every POLL_INTERVAL_SECONDS and
+    tick() skips the cycles that are not due yet, so a skipped tick costs nothing.
+
+    - REQUESTED / CONNECTED / CONFIRM_REQUESTED sessions: POLL_INTERVAL_SECONDS (fast 2FA prompts);
+    - only ACTIVE sessions: a third of the disconnect grace period, within the bounds;
+    - nothing to poll: POLL_INTERVAL_MAX_SECONDS (wake() polls at the next tick, e.g. after a VPN request);
+    - never more often than every _RTT_MULTIPLIER router round trips (still capped at the maximum,
+      and at _PENDING_MAX_INTERVALS poll intervals while a session is pending).
+    POLL_INTERVAL_MAX_SECONDS <= POLL_INTERVAL_SECONDS: fixed interval, as before.
+    Pending sessions seen between polls (session watcher events) are fed in with note_pending().
+    """
+
+    def __init__(self) -> None:
+        self._pending = 0
+        self._active = 0
+        self._rtt: Optional[float] = None
+        self._next_at = 0.0
+        self._interval = 0.0
+        self._reason = "fixed"
+
+    @staticmethod
+    def bounds() -> Tuple[float, float]:
+        lo = max(1.0, float(settings.POLL_INTERVAL_SECONDS))
+        return lo, max(lo, float(settings.POLL_INTERVAL_MAX_SECONDS))
+
+    def observe(self, statuses: Iterable[SessionStatus]) -> None:
+        """Session mix of the poll that is starting."""
+        pending = active = 0
+        for status in statuses:
+            if status in PENDING_STATUSES:
+                pending += 1
+            else:
+                active += 1
+        self._pending, self._active = pending, active
+
+    def note_pending(self, pending: int) -> None:
+        """
+        Pending sessions seen between polls: the next poll comes within the pending interval
+        instead of waiting out an active/idle one. The next poll recounts the session mix.
+        """
+        if pending <= 0:
+            return
+        self._pending = max(self._pending, int(pending))
+        self._interval, self._reason = self.interval()
+        self._next_at = min(self._next_at, time.monotonic() + self._interval)
+
+    def record_rtt(self, seconds: float) -> None:
+        seconds = max(0.0, float(seconds))
+        self._rtt = seconds if self._rtt is None else self._rtt + _RTT_ALPHA * (seconds - self._rtt)
+
+    def interval(self) -> Tuple[float, str]:
+        lo, hi = self.bounds()
+        if hi <= lo:
+            return lo, "fixed"
+        if self._pending:
+            seconds, reason = lo, "pending"
+        elif self._active:
+            # Aim for about three polls within the grace period: a dropped session is noticed in time.
+            from mikrotik_2fa_bot.services.vpn_sessions import disconnect_grace_seconds
+
+            seconds, reason = min(hi, max(lo, disconnect_grace_seconds() / 3.0)), "active"
+        else:
+            seconds, reason = hi, "idle"
+        if self._rtt is not None and self._rtt * _RTT_MULTIPLIER > seconds:
+            cap = min(hi, lo * _PENDING_MAX_INTERVALS) if self._pending else hi
+            seconds, reason = min(cap, self._rtt * _RTT_MULTIPLIER), reason + "+rtt"
+        return seconds, reason
+
+    @property
+    def current_interval(self) -> float:
+        """Interval planned after the last poll (0 before the first one)."""
+        return self._interval
+
+    def due(self) -> bool:
+        # Half a tick of slack: the job's ticks jitter around the planned time.
+        lo, _ = self.bounds()
+        return time.monotonic() >= self._next_at - lo / 2
+
+    def schedule_next(self, started: float) -> None:
+        """Plan the next poll after one that started at `started` (time.monotonic())."""
+        self._interval, self._reason = self.interval()
+        self._next_at = started + self._interval
+
+    def wake(self) -> None:
+        self._next_at = 0.0
+
+    def stats(self) -> PacerStats:
+        return PacerStats(
+            interval=round(self._interval, 1),
+            reason=self._reason,
+            pending=self._pending,
+            active=self._active,
+            rtt_ms=None if self._rtt is None else round(1000.0 * self._rtt, 1),
+        )
+
+
+_pacer = PollPacer()
+
+
+def get_pacer() -> PollPacer:
+    return _pacer
+
+
+def wake() -> None:
+    """Poll at the next job tick instead of waiting out the current interval."""
+    _pacer.wake()
+
+
+def pacer_stats() -> Optional[PacerStats]:
+    """Current poll interval and why (None before the first poll)."""
+    return _pacer.stats() if _pacer.current_interval else None
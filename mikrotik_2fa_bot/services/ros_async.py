@@ -0,0 +1,315 @@
+from __future__ import annotations
+
+import asyncio
+import binascii
+import hashlib
+import itertools
+import ssl
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from librouteros.exceptions import ConnectionClosed, FatalError, MultiTrapError, ProtocolError, TrapError
+from librouteros.protocol import compose_word, parse_word
+
+from mikrotik_2fa_bot.services.ros_common import RouterConfig
+
+
+def encode_length(n: int) -> bytes:
+    if n < 0x80:
+        return bytes((n,))
+    if n < 0x4000:
+        return (n | 0x8000).to_bytes(2, "big")
+    if n < 0x200000:
+        return (n | 0xC00000).to_bytes(3, "big")
+    if n < 0x10000000:
+        return (n | 0xE0000000).to_bytes(4, "big")
+    return b"\xf0" + n.to_bytes(4, "big")
+
+
+def encode_sentence(*words: str) -> bytes:
+    out = bytearray()
+    for w in words:
+        b = w.encode("utf-8", "strict")
+        out += encode_length(len(b))
+        out += b
+    out += b"\x00"
+    return bytes(out)
+
+
+async def _read_length(reader: asyncio.StreamReader) -> int:
+    first = (await reader.readexactly(1))[0]
+    if first < 0x80:
+        return first
+    if first < 0xC0:
+        rest = await reader.readexactly(1)
+        return int.from_bytes(bytes((first,)) + rest, "big") & ~0x8000
+    if first < 0xE0:
+        rest = await reader.readexactly(2)
+        return int.from_bytes(bytes((first,)) + rest, "big") & ~0xC00000
+    if first < 0xF0:
+        rest = await reader.readexactly(3)
+        return int.from_bytes(bytes((first,)) + rest, "big") & ~0xE0000000
+    if first == 0xF0:
+        return int.from_bytes(await reader.readexactly(4), "big")
+    raise ProtocolError(f"Unknown control byte {first:#x}")
+
+
+async def read_sentence(reader: asyncio.StreamReader) -> Tuple[str, ...]:
+    words: List[str] = []
+    while True:
+        n = await _read_length(reader)
+        if n == 0:
+            return tuple(words)
+        words.append((await reader.readexactly(n)).decode("utf-8", "strict"))
+
+
+def _split_reply(words: Tuple[str, ...]) -> Tuple[Optional[str], Dict[str, Any]]:
+    tag: Optional[str] = None
+    attrs: Dict[str, Any] = {}
+    for w in words[1:]:
+        if w.startswith(".tag="):
+            tag = w[5:]
+        elif w.startswith("="):
+            k, v = parse_word(w)
+            attrs[k] = v
+    return tag, attrs
+
+
+_CLOSED = "!closed"
+_DISCARD = object()  # registered for a cancelled tag until its !done arrives
+_CFG_TIMEOUT: Any = object()  # stream()/run() default: the router config's timeout
+
+
+class AsyncRosConnection:
+    """
+    RouterOS API connection on asyncio streams.
+
+    Commands are `.tag`-ged and multiplexed: any number of coroutines can run commands
+    over one connection at the same time; a background reader routes replies by tag.
+    Leaving a stream() early (break, exception, task cancellation) sends `/cancel` for
+    its tag, so the router stops producing rows nobody reads.
+
+    Every command waits at most `timeout` seconds (cfg.timeout_seconds by default) for each
+    reply, then raises TimeoutError. If nothing
+    at all arrived on the connection meanwhile, the connection is considered dead and closed.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, cfg: RouterConfig):
+        self.cfg = cfg
+        self.timeout = max(1.0, float(cfg.timeout_seconds))
+        self.last_rx = time.monotonic()  # last sentence received from the router
+        self._reader = reader
+        self._writer = writer
+        self._tags: Dict[str, Any] = {}
+        self._tag_seq = itertools.count(1)
+        self._closed_exc: Optional[BaseException] = None
+        self._reader_task: Optional[asyncio.Task] = None
+
+    @classmethod
+    async def open(cls, cfg: RouterConfig) -> "AsyncRosConnection":
+        ctx = None
+        if cfg.use_ssl:
+            # Most RouterOS API-SSL installs use self-signed certs; disable verification.
+            ctx = ssl.create_default_context()
+            ctx.check_hostname = False
+            ctx.verify_mode = ssl.CERT_NONE
+        timeout = max(1.0, float(cfg.timeout_seconds))
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(cfg.host, int(cfg.port), ssl=ctx),
+            timeout=timeout,
+        )
+        conn = cls(reader, writer, cfg)
+        conn._reader_task = asyncio.create_task(conn._read_loop())
+        try:
+            await asyncio.wait_for(conn._login(), timeout=timeout)
+        except BaseException:
+            conn.close()
+            raise
+        return conn
+
+    @property
+    def closed(self) -> bool:
+        return self._closed_exc is not None
+
+    def close(self) -> None:
+        if self._closed_exc is None:
+            self._fail(ConnectionClosed("Connection closed"))
+        try:
+            self._writer.close()
+        except Exception:
+            pass
+        if self._reader_task is not None and not self._reader_task.done():
+            self._reader_task.cancel()
+
+    async def _login(self) -> None:
+        rows = await self.run("/login", compose_word("name", self.cfg.username), compose_word("password", self.cfg.password))
+        ret = next((r.get("ret") for r in rows if r.get("ret")), None)
+        if ret:
+            # Pre-6.43 challenge/response login
+            md5 = hashlib.md5()
+            md5.update(b"\x00")
+            md5.update(self.cfg.password.encode())
+            md5.update(binascii.unhexlify(str(ret)))
+            await self.run("/login", compose_word("name", self.cfg.username), "=response=00" + md5.hexdigest())
+
+    def _fail(self, exc: BaseException) -> None:
+        if self._closed_exc is not None:
+            return
+        self._closed_exc = exc
+        for q in self._tags.values():
+            if q is not _DISCARD:
+                q.put_nowait((_CLOSED, exc))
+        self._tags.clear()
+
+    async def _read_loop(self) -> None:
+        try:
+            while True:
+                words = await read_sentence(self._reader)
+                self.last_rx = time.monotonic()
+                if not words:
+                    continue
+                reply_word = words[0]
+                tag, attrs = _split_reply(words)
+                if reply_word == "!fatal":
+                    raise FatalError(str(words[1] if len(words) > 1 else "fatal"))
+                q = self._tags.get(tag) if tag is not None else None
+                if q is None:
+                    continue
+                if q is _DISCARD:
+                    if reply_word == "!done":
+                        del self._tags[tag]
+                    continue
+                q.put_nowait((reply_word, attrs))
+                if reply_word == "!done":
+                    del self._tags[tag]
+        except asyncio.CancelledError:
+            self._fail(ConnectionClosed("Connection closed"))
+            raise
+        except asyncio.IncompleteReadError:
+            self._fail(ConnectionClosed("Connection closed by router"))
+        except Exception as e:  # noqa: BLE001
+            self._fail(e)
+        try:
+            self._writer.close()
+        except Exception:
+            pass
+
+    async def _next_reply(self, q: asyncio.Queue, cmd: str, timeout: Optional[float]) -> Tuple[str, Any]:
+        if timeout is None:
+            return await q.get()
+        waiting_since = time.monotonic()
+        try:
+            return await asyncio.wait_for(q.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            if self.last_rx < waiting_since:
+                # Not a byte from the router meanwhile: the connection is gone, not just slow.
+                self._fail(ConnectionClosed(f"RouterOS did not answer within {timeout:.0f}s"))
+                self.close()
+            raise TimeoutError(f"RouterOS did not answer {cmd} within {timeout:.0f}s") from None
+
+    async def stream(self, cmd: str, *words: str, timeout: Optional[float] = _CFG_TIMEOUT) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Run one command and yield reply rows as they arrive.
+        !trap replies raise TrapError/MultiTrapError after the command completed
+        (like librouteros); a dead connection raises ConnectionClosed/FatalError.
+        `timeout`: seconds to wait for each reply (None: no limit, for `listen`).
+        """
+        if self._closed_exc is not None:
+            raise ConnectionClosed(str(self._closed_exc))
+        if timeout is _CFG_TIMEOUT:
+            timeout = self.timeout
+        tag = str(next(self._tag_seq))
+        q: asyncio.Queue = asyncio.Queue()
+        self._tags[tag] = q
+        done = False
+        try:
+            self._writer.write(encode_sentence(cmd, *words, f".tag={tag}"))
+            await asyncio.wait_for(self._writer.drain(), timeout=timeout)
+            traps: List[TrapError] = []
+            while True:
+                reply_word, attrs = await self._next_reply(q, cmd, timeout)
+                if reply_word == "!re":
+                    yield attrs
+                elif reply_word == "!trap":
+                    traps.append(TrapError(message=str(attrs.get("message") or "trap"), category=attrs.get("category")))
+                elif reply_word == "!done":
+                    done = True
+                    if len(traps) > 1:
+                        raise MultiTrapError(*traps)
+                    if traps:
+                        raise traps[0]
+                    if attrs:
+                        yield attrs
+                    return
+                elif reply_word == _CLOSED:
+                    done = True
+                    raise attrs
+        finally:
+            if not done and self._closed_exc is None and self._tags.get(tag) is q:
+                self._tags[tag] = _DISCARD
+                try:
+                    self._writer.write(encode_sentence("/cancel", f"=tag={tag}"))
+                except Exception:
+                    pass
+
+    async def run(self, cmd: str, *words: str, timeout: Optional[float] = _CFG_TIMEOUT) -> List[Dict[str, Any]]:
+        return [row async for row in self.stream(cmd, *words, timeout=timeout)]
+
+
+class AsyncRosPool:
+    """
+    One multiplexed AsyncRosConnection per router config (and event loop).
+    A dead connection is replaced by a fresh login on the next acquire().
+    """
+
+    def __init__(self) -> None:
+        self._conns: Dict[RouterConfig, AsyncRosConnection] = {}
+        self._locks: Dict[RouterConfig, asyncio.Lock] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.opened = 0
+
+    def _check_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Connections and locks are bound to the loop that created them.
+            self._conns.clear()
+            self._locks.clear()
+            self._loop = loop
+
+    async def acquire(self, cfg: RouterConfig) -> AsyncRosConnection:
+        self._check_loop()
+        conn = self._conns.get(cfg)
+        if conn is not None and not conn.closed:
+            return conn
+        lock = self._locks.setdefault(cfg, asyncio.Lock())
+        async with lock:
+            conn = self._conns.get(cfg)
+            if conn is None or conn.closed:
+                conn = await AsyncRosConnection.open(cfg)
+                self._conns[cfg] = conn
+                self.opened += 1
+            return conn
+
+    def discard(self, conn: AsyncRosConnection) -> None:
+        if self._conns.get(conn.cfg) is conn:
+            del self._conns[conn.cfg]
+        conn.close()
+
+    def clear(self) -> None:
+        conns = list(self._conns.values())
+        self._conns.clear()
+        for c in conns:
+            c.close()
+
+    def size(self) -> int:
+        return sum(1 for c in self._conns.values() if not c.closed)
+
+
+_pool: Optional[AsyncRosPool] = None
+
+
+def get_async_pool() -> AsyncRosPool:
+    global _pool
+    if _pool is None:
+        _pool = AsyncRosPool()
+    return _pool
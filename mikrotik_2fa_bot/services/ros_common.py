@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from librouteros.exceptions import ConnectionClosed, FatalError, MultiTrapError, ProtocolError, TrapError
+
+from mikrotik_2fa_bot.config import settings
+from mikrotik_2fa_bot.services.ros_records import UmSession
+
+
+# Router-facing types shared by the RouterOS client (mikrotik_api_async), the connection
+# layer (ros_async), the circuit breaker and the services that consume router data.
+
+
+class MikroTikAPIError(RuntimeError):
+    pass
+
+
+class RouterUnavailableError(MikroTikAPIError):
+    """Raised without touching the network while the router's circuit breaker is open."""
+
+
+@dataclass(frozen=True, slots=True)
+class RouterConfig:
+    """
+    Everything needed to open a RouterOS API connection.
+    Hashable: used as the pool key, so changing any field (e.g. via /router_settings)
+    naturally stops reusing connections opened with the old parameters.
+    """
+    host: str
+    port: int
+    use_ssl: bool
+    username: str
+    password: str
+    timeout_seconds: int
+
+    def __repr__(self) -> str:  # never leak the password into logs
+        return f"RouterConfig({self.host}:{self.port}, ssl={self.use_ssl}, user={self.username})"
+
+
+def current_router_config() -> RouterConfig:
+    return RouterConfig(
+        host=settings.MIKROTIK_HOST,
+        port=int(settings.MIKROTIK_PORT),
+        use_ssl=bool(settings.MIKROTIK_USE_SSL),
+        username=settings.MIKROTIK_USERNAME,
+        password=settings.MIKROTIK_PASSWORD,
+        timeout_seconds=int(settings.MIKROTIK_TIMEOUT_SECONDS),
+    )
+
+
+def is_transport_error(exc: BaseException) -> bool:
+    """
+    True if the connection can no longer be trusted (socket/protocol state unknown).
+    A !trap reply is a normal command error: the full response was consumed and
+    the connection stays usable.
+    """
+    if isinstance(exc, (TrapError, MultiTrapError)):
+        return False
+    return isinstance(exc, (OSError, ConnectionClosed, FatalError, ProtocolError, EOFError))
+
+
+@dataclass(frozen=True, slots=True)
+class ActiveSession:
+    username: str
+    session_id: Optional[str]
+    source: str  # "user_manager" | "ppp_active"
+    address: Optional[str] = None  # framed IP of the client, if the router reports it
+
+
+def session_to_active(s: UmSession) -> Optional[ActiveSession]:
+    if s.active is not True or not s.user:
+        return None
+    return ActiveSession(username=s.user, session_id=s.acct_session_id or s.id, source="user_manager", address=s.address)
+
+
+def session_row_to_active(row: Dict[str, Any]) -> Optional[ActiveSession]:
+    """Same for a raw row (listen events carry whole records)."""
+    return session_to_active(UmSession.from_row(row))
+
+
+@dataclass(frozen=True, slots=True)
+class RouterTestReport:
+    host: str
+    port: int
+    use_ssl: bool
+    timeout_seconds: int
+    tcp_ok: bool
+    api_ok: bool
+    identity: str | None
+    router_version: str | None
+    user_manager_path: str | None
+    user_manager_ok: bool | None
+    firewall_ok: bool | None
+    ip_service_api_enabled: bool | None
+    ip_service_api_ssl_enabled: bool | None
+    notes: List[str]
+
+
+@dataclass(frozen=True, slots=True)
+class RouterCapabilities:
+    """
+    What a router supports, probed once per router config (see get_router_capabilities).
+    um_prefix is "user-manager" (RouterOS v7) or "tool/user-manager" (v6), None if UM is unavailable.
+    """
+    identity: str | None
+    version: str | None
+    major_version: int | None
+    um_prefix: str | None
+    um_error: str | None
+    api_enabled: bool | None
+    api_ssl_enabled: bool | None
+    firewall_read_ok: bool
+    notes: tuple[str, ...]
+    probed_at: float
+
+    def um_path(self, table: str) -> str:
+        if not self.um_prefix:
+            raise MikroTikAPIError(f"User Manager is not available via RouterOS API: {self.um_error or 'unknown'}")
+        return f"{self.um_prefix}/{table}"
@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Any, ClassVar, Dict, Optional
+
+
+# Compact records for RouterOS reads. Each type lists the only properties the bot needs
+# (`PROPLIST`, sent as `.proplist`), so the router skips everything else on the wire and
+# rows are kept as slotted objects instead of per-row dicts.
+
+
+def _normalize_bool(value: Any) -> Optional[bool]:
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return bool(value)
+    s = str(value).strip().lower()
+    if s in {"true", "yes", "enabled", "enable", "1"}:
+        return True
+    if s in {"false", "no", "disabled", "disable", "0"}:
+        return False
+    return None
+
+
+def _text(value: Any) -> Optional[str]:
+    return str(value) if value not in (None, "") else None
+
+
+def _first(row: Dict[str, Any], *keys: str) -> Any:
+    """Value of the first key present: librouteros parses numeric words to int, so 0 is a value too."""
+    return next((row[k] for k in keys if row.get(k) is not None), None)
+
+
+@dataclass(frozen=True, slots=True)
+class UmUser:
+    PROPLIST: ClassVar[str] = ".id,name,username"
+
+    id: Optional[str]
+    name: str
+
+    @classmethod
+    def from_row(cls, row: Dict[str, Any]) -> Optional["UmUser"]:
+        # RouterOS v7 calls it "name", v6 User Manager "username"
+        name = _text(_first(row, "name", "username"))
+        if name is None:
+            return None
+        return cls(id=_text(_first(row, ".id", "id")), name=name)
+
+
+@dataclass(frozen=True, slots=True)
+class UmSession:
+    PROPLIST: ClassVar[str] = ".id,user,active,acct-session-id,user-address"
+
+    id: Optional[str]
+    user: Optional[str]
+    active: Optional[bool]
+    acct_session_id: Optional[str]
+    address: Optional[str]  # framed (client tunnel) IP
+
+    @classmethod
+    def from_row(cls, row: Dict[str, Any]) -> "UmSession":
+        return cls(
+            id=_text(_first(row, ".id", "id")),
+            user=_text(_first(row, "user", "username", "name")),
+            active=_normalize_bool(row.get("active")),
+            acct_session_id=_text(_first(row, "acct-session-id", "acct_session_id")),
+            address=_text(_first(row, "user-address", "address")),
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class FirewallRule:
+    PROPLIST: ClassVar[str] = ".id,chain,action,disabled,comment"
+
+    id: Optional[str]
+    chain: str
+    action: str
+    disabled: Optional[bool]
+    comment: str
+
+    @classmethod
+    def from_row(cls, row: Dict[str, Any]) -> "FirewallRule":
+        return cls(
+            id=_text(_first(row, ".id", "id")),
+            chain=str(row.get("chain") or "-"),
+            action=str(row.get("action") or "-"),
+            disabled=_normalize_bool(row.get("disabled")),
+            comment=str(row.get("comment") or "").strip(),
+        )
+
+    @property
+    def label(self) -> str:
+        """One-line description used in firewall lists and the rule picker."""
+        disabled = "-" if self.disabled is None else str(self.disabled).lower()
+        return f"{self.id or '?'} | {self.chain} | {self.action} | disabled={disabled} | {self.comment}"
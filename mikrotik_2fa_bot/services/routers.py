@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import List, Optional
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from mikrotik_2fa_bot.models import MikrotikAccount, Router, VpnSession
+from mikrotik_2fa_bot.services.app_settings import decrypt_secret, encrypt_secret
+from mikrotik_2fa_bot.services.ros_common import RouterConfig, current_router_config
+
+
+# The router configured via MIKROTIK_* / router_settings. It has no row in `routers`:
+# router_id=NULL on accounts/sessions, 0 in caches and callback data.
+DEFAULT_ROUTER_NAME = "default"
+
+
+@dataclass(frozen=True, slots=True)
+class RouterTarget:
+    router_id: Optional[int]  # None: default router
+    name: str
+    cfg: RouterConfig
+
+
+def router_key(router_id: Optional[int]) -> int:
+    """router_id as stored in caches / callback data (0 = default router)."""
+    return int(router_id or 0)
+
+
+def router_id_from_key(key: int | str) -> Optional[int]:
+    return int(key) or None
+
+
+def router_config(router: Router) -> RouterConfig:
+    return RouterConfig(
+        host=router.host,
+        port=int(router.port),
+        use_ssl=bool(router.use_ssl),
+        username=router.username,
+        password=decrypt_secret(router.password_encrypted) or "",
+        timeout_seconds=int(router.timeout_seconds),
+    )
+
+
+def list_routers(db: Session) -> list[Router]:
+    return db.query(Router).order_by(Router.name.asc()).all()
+
+
+def get_router(db: Session, router_id: int) -> Router | None:
+    return db.query(Router).filter(Router.id == int(router_id)).first()
+
+
+def get_router_by_name(db: Session, name: str) -> Router | None:
+    return db.query(Router).filter(Router.name == (name or "").strip()).first()
+
+
+def resolve_router_name(db: Session, name: str | None) -> Optional[int]:
+    """Router name from a command argument -> router_id (None for the default router)."""
+    n = (name or "").strip()
+    if not n or n == DEFAULT_ROUTER_NAME:
+        return None
+    r = get_router_by_name(db, n)
+    if not r:
+        raise ValueError("router_not_found")
+    return r.id
+
+
+def get_router_config(db: Session, router_id: Optional[int]) -> RouterConfig | None:
+    """RouterConfig for an account/session router_id; None if that router was removed."""
+    if router_id is None:
+        return current_router_config()
+    r = get_router(db, router_id)
+    return router_config(r) if r else None
+
+
+def require_router_config(db: Session, router_id: Optional[int]) -> RouterConfig:
+    cfg = get_router_config(db, router_id)
+    if cfg is None:
+        raise ValueError("router_not_found")
+    return cfg
+
+
+def router_name(db: Session, router_id: Optional[int]) -> str:
+    if router_id is None:
+        return DEFAULT_ROUTER_NAME
+    r = get_router(db, router_id)
+    return r.name if r else f"#{router_id}"
+
+
+def list_router_targets(db: Session) -> List[RouterTarget]:
+    """All routers: the default one (if configured) first, then the `routers` table."""
+    out: List[RouterTarget] = []
+    default_cfg = current_router_config()
+    if default_cfg.host:
+        out.append(RouterTarget(router_id=None, name=DEFAULT_ROUTER_NAME, cfg=default_cfg))
+    for r in list_routers(db):
+        out.append(RouterTarget(router_id=r.id, name=r.name, cfg=router_config(r)))
+    return out
+
+
+def create_router(
+    db: Session,
+    name: str,
+    host: str,
+    port: int,
+    username: str,
+    password: str,
+    use_ssl: bool = False,
+    timeout_seconds: int = 5,
+) -> Router:
+    n = (name or "").strip()
+    if not n or n == DEFAULT_ROUTER_NAME or n.isdigit():
+        raise ValueError("invalid_router_name")
+    if not (host or "").strip() or not (username or "").strip():
+        raise ValueError("invalid_router_params")
+    router = Router(
+        name=n,
+        host=host.strip(),
+        port=int(port),
+        use_ssl=bool(use_ssl),
+        username=username.strip(),
+        password_encrypted=encrypt_secret(password or ""),
+        timeout_seconds=int(timeout_seconds),
+    )
+    db.add(router)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise ValueError("router_exists")
+    db.refresh(router)
+    return router
+
+
+def delete_router(db: Session, name: str) -> None:
+    router = get_router_by_name(db, name)
+    if not router:
+        raise ValueError("router_not_found")
+    from mikrotik_2fa_bot.services.vpn_sessions import ACTIVE_STATUSES
+
+    in_use = (
+        db.query(MikrotikAccount)
+        .filter(MikrotikAccount.router_id == router.id, MikrotikAccount.is_active == True)  # noqa: E712
+        .first()
+        or db.query(VpnSession)
+        .filter(VpnSession.router_id == router.id, VpnSession.status.in_(list(ACTIVE_STATUSES)))
+        .first()
+    )
+    if in_use:
+        raise ValueError("router_in_use")
+    db.delete(router)
+    db.commit()
@@ -1,26 +1,71 @@
 from __future__ import annotations
 
 import asyncio
+import functools
 import logging
+import time
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Dict, Optional
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy.orm import selectinload
 
 from mikrotik_2fa_bot.config import settings
-from mikrotik_2fa_bot.db import db_session
+from mikrotik_2fa_bot.db import count_db_activity, db_session
 from mikrotik_2fa_bot.models import SessionStatus, VpnSession
-from mikrotik_2fa_bot.services import mikrotik_api
+from mikrotik_2fa_bot.services import mikrotik_api_async
+from mikrotik_2fa_bot.services.fw_cache import enable_firewall_rule_by_comment_async
+from mikrotik_2fa_bot.services.notifier import Priority, notify
+from mikrotik_2fa_bot.services.poll_pacer import PENDING_STATUSES, get_pacer
+from mikrotik_2fa_bot.services.ros_common import ActiveSession, RouterConfig, RouterUnavailableError
+from mikrotik_2fa_bot.services.routers import DEFAULT_ROUTER_NAME, get_router_config, list_routers, router_name
+from mikrotik_2fa_bot.services.session_watcher import SessionWatcher
 from mikrotik_2fa_bot.services.vpn_sessions import (
+    ACTIVE_STATUSES,
+    SessionWrites,
+    disconnect_grace_seconds,
+    last_seen,
     list_sessions_to_poll,
+    list_sessions_to_poll_for_usernames,
     mark_connected,
     mark_confirm_requested,
     confirm_session,
-    disconnect_session,
-    expire_session,
+    revert_confirm_request,
+    revoke_session_access_async,
+    set_session_fields,
 )
 
 
 logger = logging.getLogger(__name__)
 
+# Serialize the planning step of a router's state transitions (interval ticks vs. watcher
+# events) so a connection is never prompted twice. Router calls run outside of them.
+_state_locks: Dict[Optional[int], asyncio.Lock] = {}
+# Router calls of one cycle in flight at once
+_ROUTER_CALL_CONCURRENCY = 16
+# router_id (None: default router) -> watcher
+_watchers: Dict[Optional[int], SessionWatcher] = {}
+
+
+@dataclass(frozen=True, slots=True)
+class PollCycleStats:
+    sessions: int  # sessions checked
+    changed: int  # sessions written
+    updates: int  # bulk UPDATE statements
+    conflicts: int  # changes dropped: status moved by a handler meanwhile
+    statements: int  # all SQL statements of the cycle (incl. reads)
+    commits: int
+    seconds: float
+
+
+# router_id (None: default router) -> its most recent state-transition cycle
+_last_cycles: Dict[Optional[int], PollCycleStats] = {}
+
+
+def last_poll_stats(router_id: Optional[int]) -> Optional[PollCycleStats]:
+    """DB cost of the router's most recent state-transition cycle (None before the first one)."""
+    return _last_cycles.get(router_id)
+
 
 def _is_expired(expires_at) -> bool:
     if not expires_at:
@@ -28,166 +73,490 @@ def _is_expired(expires_at) -> bool:
     return expires_at < datetime.utcnow()
 
 
-async def poll_once(bot) -> None:
+def _router_config_provider(router_id: Optional[int]):
+    def _cfg() -> Optional[RouterConfig]:
+        with db_session() as db:
+            return get_router_config(db, router_id)
+
+    return _cfg
+
+
+async def sync_session_watchers(bot) -> Dict[Optional[int], SessionWatcher]:
+    """
+    One UM session `listen` subscription per router (default + `routers` table);
+    connect events are processed immediately. Call again after routers were added/removed.
+    """
+    with db_session() as db:
+        targets: Dict[Optional[int], str] = {None: DEFAULT_ROUTER_NAME}
+        targets.update({r.id: r.name for r in list_routers(db)})
+
+    for rid in [rid for rid in _watchers if rid not in targets]:
+        await _watchers.pop(rid).stop()
+    for rid, name in targets.items():
+        w = _watchers.get(rid)
+        if w is None:
+            async def _on_change(usernames: Set[str], _rid: Optional[int] = rid) -> None:
+                await poll_users(bot, _rid, usernames)
+
+            w = _watchers[rid] = SessionWatcher(_on_change, router_config=_router_config_provider(rid), name=name)
+        w.start()
+    return dict(_watchers)
+
+
+async def stop_session_watchers() -> None:
+    watchers = list(_watchers.values())
+    _watchers.clear()
+    for w in watchers:
+        await w.stop()
+
+
+def get_session_watchers() -> Dict[Optional[int], SessionWatcher]:
+    return dict(_watchers)
+
+
+def _watched_views() -> Dict[Optional[int], Dict[str, ActiveSession]]:
+    return {rid: w.active_by_user() for rid, w in _watchers.items() if w.healthy}
+
+
+async def tick(bot) -> None:
+    """
+    Interval job (every POLL_INTERVAL_SECONDS); polls only when the pacer says the
+    adaptive interval is up. Routers with a healthy watcher are not queried at all: the
+    watcher's in-memory view drives expiry, resend, timeout and grace checks.
+    The other routers get a plain poll.
+    """
+    pacer = get_pacer()
+    if not pacer.due():
+        return
+    started = time.monotonic()
+    try:
+        await poll_once(bot, active_views=_watched_views())
+    finally:
+        pacer.schedule_next(started)
+
+
+async def reconcile(bot) -> None:
+    """
+    Low-frequency safety net for missed listen events: re-read active sessions from
+    every router with a healthy watcher (routers without one are polled by tick()).
+    Users whose state differs from the watcher's view are processed via on_change.
+    A failed reconcile means the view can't be trusted: the watcher is restarted, and
+    tick() polls that router until the new subscription is up.
+    """
+    async def _resync(w: SessionWatcher) -> None:
+        try:
+            await asyncio.wait_for(w.resync(), timeout=float(settings.POLL_MIKROTIK_TIMEOUT_SECONDS))
+            return
+        except asyncio.TimeoutError:
+            logger.error("MikroTik reconcile [%s] failed: timed out; restarting the watcher", w.name)
+        except RouterUnavailableError as e:
+            logger.debug("MikroTik reconcile [%s] skipped: %s; restarting the watcher", w.name, e)
+        except Exception as e:  # noqa: BLE001
+            logger.error("MikroTik reconcile [%s] failed: %s; restarting the watcher", w.name, e)
+        await w.restart()
+
+    await asyncio.gather(*(_resync(w) for w in list(_watchers.values()) if w.healthy))
+
+
+async def poll_users(bot, router_id: Optional[int], usernames: Set[str]) -> None:
+    """Run the state transitions for the given users of one router only (watcher events)."""
+    w = _watchers.get(router_id)
+    with db_session() as db:
+        session_ids = [s.id for s in list_sessions_to_poll_for_usernames(db, usernames, router_id)]
+    if not session_ids:
+        return
+    active_by_user = w.active_by_user() if w is not None else {}
+    plan = await apply_router_state(bot, router_id, session_ids, active_by_user)
+    # A connect seen by the watcher makes the session pending: resends and timeouts need the fast interval.
+    get_pacer().note_pending(plan.pending)
+
+
+async def poll_once(bot, active_views: Optional[Dict[Optional[int], Dict[str, ActiveSession]]] = None) -> None:
     """
     Poll RouterOS for active sessions and update DB sessions.
     This runs inside the Telegram bot process.
+
+    Sessions are grouped by router and every router is handled concurrently with its
+    own timeout: a slow or unreachable site does not delay the others.
+    Routers present in active_views (session watcher view) are not queried.
     """
-    # First: load sessions to poll (cheap) to know which usernames we care about.
+    # First: load sessions to poll (cheap) to know which routers/usernames we care about.
     with db_session() as db:
-        sessions = list_sessions_to_poll(db)
-        session_ids = [s.id for s in sessions]
-        usernames = {s.mikrotik_username for s in sessions if s.mikrotik_username}
+        by_router: Dict[Optional[int], List[VpnSession]] = {}
+        to_poll = list_sessions_to_poll(db)
+        get_pacer().observe(s.status for s in to_poll)
+        for s in to_poll:
+            by_router.setdefault(s.router_id, []).append(s)
+        jobs = [
+            (
+                rid,
+                router_name(db, rid),
+                get_router_config(db, rid),
+                [s.id for s in sessions],
+                {s.mikrotik_username for s in sessions if s.mikrotik_username},
+            )
+            for rid, sessions in by_router.items()
+        ]
 
-    if not session_ids:
+    if not jobs:
         return
+    views = active_views or {}
+    await asyncio.gather(*(
+        _poll_router(bot, rid, name, cfg, session_ids, usernames, views.get(rid))
+        for rid, name, cfg, session_ids, usernames in jobs
+    ))
 
-    # IMPORTANT: MikroTik API calls are synchronous and may block for seconds.
-    # Run them in a thread + enforce timeout so the Telegram event loop stays responsive.
-    try:
-        active_by_user = await asyncio.wait_for(
-            asyncio.to_thread(mikrotik_api.list_active_sessions_map_for_users, usernames, settings.SESSION_SOURCE),
-            timeout=float(settings.POLL_MIKROTIK_TIMEOUT_SECONDS),
+
+async def _poll_router(
+    bot,
+    router_id: Optional[int],
+    name: str,
+    cfg: Optional[RouterConfig],
+    session_ids: List[str],
+    usernames: Set[str],
+    active_by_user: Optional[Dict[str, ActiveSession]],
+) -> None:
+    if active_by_user is None:
+        if cfg is None:
+            logger.error("MikroTik poll [%s] skipped: router was removed", name)
+            return
+        # Native asyncio RouterOS client: the read never blocks the event loop.
+        # A timeout cancels the in-flight command on the router (/cancel).
+        read_started = time.perf_counter()
+        try:
+            active_by_user = await asyncio.wait_for(
+                mikrotik_api_async.list_active_sessions_map_for_users(usernames, settings.SESSION_SOURCE, cfg=cfg),
+                timeout=float(settings.POLL_MIKROTIK_TIMEOUT_SECONDS),
+            )
+        except asyncio.TimeoutError:
+            # ros_conn counted it against the router's breaker if the router went quiet.
+            get_pacer().record_rtt(float(settings.POLL_MIKROTIK_TIMEOUT_SECONDS))
+            logger.error("MikroTik poll [%s] failed: timed out", name)
+            return
+        except RouterUnavailableError as e:
+            # Circuit open: the transition was logged once by the breaker.
+            logger.debug("MikroTik poll [%s] skipped: %s", name, e)
+            return
+        except Exception as e:  # noqa: BLE001
+            logger.error("MikroTik poll [%s] failed: %s", name, e)
+            return
+        get_pacer().record_rtt(time.perf_counter() - read_started)
+
+    await apply_router_state(bot, router_id, session_ids, active_by_user)
+
+
+def _state_lock(router_id: Optional[int]) -> asyncio.Lock:
+    lock = _state_locks.get(router_id)
+    if lock is None:
+        lock = _state_locks[router_id] = asyncio.Lock()
+    return lock
+
+
+@dataclass(slots=True)
+class _RouterCall:
+    """Router work a planned transition needs, done after the plan was committed."""
+    session: VpnSession  # detached, as written by the plan
+    action: str  # "revoke" | "grant" | "move"
+    notice: Optional[str] = None  # sent to the user once the call is done
+
+
+@dataclass(frozen=True, slots=True)
+class _PlanStats:
+    sessions: int
+    changed: int
+    updates: int
+    conflicts: int
+    pending: int  # sessions waiting for a connect or a confirmation after the plan
+
+
+def _router_call_timeout() -> float:
+    # A transition makes up to four router commands (each also has its own timeout).
+    return 2.0 * max(1.0, float(settings.MIKROTIK_TIMEOUT_SECONDS))
+
+
+async def apply_router_state(
+    bot, router_id: Optional[int], session_ids: List[str], active_by_user: Dict[str, ActiveSession]
+) -> _PlanStats:
+    """
+    State transitions for the given DB sessions of one router against its active sessions.
+
+    The plan (DB reads and writes only) runs under the router's lock, in one transaction.
+    Router calls it needs (revoke, grant, move access) run afterwards, outside the lock and
+    without an open DB session, with a timeout each; what they return (rule / entry ids)
+    is written in a second short transaction.
+    """
+    started = time.perf_counter()
+    async with _state_lock(router_id):
+        with count_db_activity() as counters:
+            calls, cfg, plan = _plan_router_state(bot, router_id, session_ids, active_by_user)
+    if calls and cfg is not None:
+        await _run_router_calls(bot, cfg, calls)
+    cycle = _last_cycles[router_id] = PollCycleStats(
+        sessions=plan.sessions,
+        changed=plan.changed,
+        updates=plan.updates,
+        conflicts=plan.conflicts,
+        statements=counters.statements,
+        commits=counters.commits,
+        seconds=round(time.perf_counter() - started, 3),
+    )
+    logger.debug("Poll cycle [router %s]: %s", router_id, cycle)
+    return plan
+
+
+def _plan_router_state(
+    bot, router_id: Optional[int], session_ids: List[str], active_by_user: Dict[str, ActiveSession]
+) -> Tuple[List[_RouterCall], Optional[RouterConfig], _PlanStats]:
+    # Objects stay readable after the commit: router calls use them once the DB session is closed.
+    with db_session(expire_on_commit=False) as db:
+        writes = SessionWrites(db)
+        sessions = (
+            db.query(VpnSession)
+            .options(selectinload(VpnSession.user))  # prompts and notifications need the user
+            .filter(VpnSession.id.in_(session_ids), VpnSession.status.in_(list(ACTIVE_STATUSES)))
+            .all()
         )
-    except asyncio.TimeoutError:
-        logger.error("MikroTik poll failed: timed out")
-        return
-    except Exception as e:  # noqa: BLE001
-        logger.error("MikroTik poll failed: %s", e)
-        return
+        calls: List[_RouterCall] = []
+        prompts: List[Tuple[str, Callable[[], None]]] = []
+        try:
+            _transition_sessions(bot, db, writes, sessions, active_by_user, calls, prompts)
+        finally:
+            flushed = writes.flush()
+            # A handler changed these sessions meanwhile and their changes were dropped:
+            # nothing this cycle decided for them (prompts, router calls, notices) applies.
+            for sid, send in prompts:
+                if sid not in flushed.conflicted_ids:
+                    send()
+        calls = [c for c in calls if c.session.id not in flushed.conflicted_ids]
+        cfg = get_router_config(db, router_id) if calls else None
+        db.expunge_all()
+    stats = _PlanStats(
+        sessions=len(sessions),
+        changed=flushed.sessions,
+        updates=flushed.updates,
+        conflicts=flushed.conflicts,
+        pending=sum(1 for s in sessions if s.status in PENDING_STATUSES and s.id not in flushed.conflicted_ids),
+    )
+    return calls, cfg, stats
 
-    # Re-open DB session for updates (avoid holding DB connection during network calls)
-    with db_session() as db:
-        sessions = db.query(VpnSession).filter(VpnSession.id.in_(session_ids)).all()
-        for s in sessions:
-            now = datetime.utcnow()
-            # Expiry check
-            if _is_expired(s.expires_at):
-                expire_session(db, s)
-                try:
-                    await bot.send_message(chat_id=s.user.telegram_id, text="⌛️ VPN-сессия истекла. Доступ отключен.")
-                except Exception:
-                    pass
-                continue
-
-            a = active_by_user.get(s.mikrotik_username)
-            if a:
-                # seen as connected
-                mark_connected(db, s, mikrotik_session_id=a.session_id)
-
-                if s.status == SessionStatus.CONNECTED:
-                    # If confirmation is required, request it (once)
-                    per_user = getattr(s.user, "require_confirmation", None)
-                    require_confirm = bool(settings.REQUIRE_CONFIRMATION) if per_user is None else bool(per_user)
-                    if require_confirm:
-                        # Ask user
-                        try:
-                            from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-
-                            kb = InlineKeyboardMarkup(
-                                [[
-                                    InlineKeyboardButton("✅ Да", callback_data=f"confirm:{s.id}:yes"),
-                                    InlineKeyboardButton("❌ Нет", callback_data=f"confirm:{s.id}:no"),
-                                ]]
-                            )
-                            await bot.send_message(
-                                chat_id=s.user.telegram_id,
-                                text=(
-                                    "❓ Обнаружено подключение к VPN.\n\n"
-                                    f"MikroTik user: {s.mikrotik_username}\n"
-                                    f"Session: {a.session_id or '-'}\n\n"
-                                    "Это вы подключились?"
-                                ),
-                                reply_markup=kb,
-                            )
-                            mark_confirm_requested(db, s)
-                        except Exception as e:  # noqa: BLE001
-                            logger.error("Failed to send confirmation request: %s", e)
-                    else:
-                        # Auto-confirm
-                        try:
-                            _try_enable_firewall_for_user(db, s)
-                        except Exception:
-                            pass
-                        confirm_session(db, s, firewall_rule_id=s.firewall_rule_id)
-                        try:
-                            await bot.send_message(chat_id=s.user.telegram_id, text="✅ Подключение подтверждено. Доступ открыт.")
-                        except Exception:
-                            pass
-                elif s.status == SessionStatus.CONFIRM_REQUESTED:
-                    # Optional resend of confirmation request while client stays connected
+
+async def _run_router_calls(bot, cfg: RouterConfig, calls: List[_RouterCall]) -> None:
+    actions: Dict[str, Callable[[VpnSession, RouterConfig], Awaitable[Dict[str, Any]]]] = {
+        "revoke": _revoke_access,
+        "grant": _grant_access,
+        "move": _move_address_list_access,
+    }
+    limit = asyncio.Semaphore(_ROUTER_CALL_CONCURRENCY)
+    timeout = _router_call_timeout()
+
+    async def _one(call: _RouterCall) -> Dict[str, Any]:
+        async with limit:
+            try:
+                return await asyncio.wait_for(actions[call.action](call.session, cfg), timeout=timeout) or {}
+            except asyncio.TimeoutError:
+                logger.error("Router call (%s) for %s timed out", call.action, call.session.mikrotik_username)
+            except Exception as e:  # noqa: BLE001
+                logger.warning("Router call (%s) for %s failed: %s", call.action, call.session.mikrotik_username, e)
+            return {}
+
+    results = await asyncio.gather(*(_one(c) for c in calls))
+
+    granted = [(c, values) for c, values in zip(calls, results) if values]
+    if granted:
+        with db_session() as db:
+            writes = SessionWrites(db)
+            for c, values in granted:
+                writes.set(c.session, **values)
+            flushed = writes.flush()
+        for c, values in granted:
+            if c.session.id in flushed.conflicted_ids:
+                # Disconnected/expired by a handler while access was being granted: take it back.
+                logger.info("Session %s ended while access was granted: revoking again", c.session.mikrotik_username)
+                for key, value in values.items():
+                    setattr(c.session, key, value)
+                await _revoke_access(c.session, cfg)
+    for c in calls:
+        if c.notice:
+            notify(bot, c.session.user.telegram_id, c.notice)
+
+
+def _transition_sessions(
+    bot,
+    db,
+    writes: SessionWrites,
+    sessions: List[VpnSession],
+    active_by_user: Dict[str, ActiveSession],
+    calls: List[_RouterCall],
+    prompts: List[Tuple[str, Callable[[], None]]],
+) -> None:
+    """
+    Decide the transitions of one cycle: DB changes go to `writes`, router calls to `calls`
+    and confirmation prompts to `prompts` (session id, send); both run once `writes` is flushed.
+    """
+    now = datetime.utcnow()
+    for s in sessions:
+        # Expiry check
+        if _is_expired(s.expires_at):
+            set_session_fields(db, s, writes, status=SessionStatus.EXPIRED)
+            calls.append(_RouterCall(s, "revoke", "⌛️ VPN-сессия истекла. Доступ отключен."))
+            continue
+
+        a = active_by_user.get(s.mikrotik_username)
+        if a:
+            # seen as connected
+            prev_address = s.client_address
+            mark_connected(db, s, mikrotik_session_id=a.session_id, client_address=a.address, writes=writes)
+            if s.address_list_entry_id and s.status == SessionStatus.ACTIVE and s.client_address != prev_address:
+                # Reconnected with another framed IP: move the access entry along.
+                calls.append(_RouterCall(s, "move"))
+            if s.status == SessionStatus.CONNECTED:
+                # If confirmation is required, request it (once)
+                per_user = getattr(s.user, "require_confirmation", None)
+                require_confirm = bool(settings.REQUIRE_CONFIRMATION) if per_user is None else bool(per_user)
+                if require_confirm:
+                    # Ask user
                     try:
-                        resend_every = int(getattr(settings, "CONFIRMATION_RESEND_SECONDS", 0) or 0)
-                        max_resends = int(getattr(settings, "CONFIRMATION_MAX_RESENDS", 0) or 0)
-                        if resend_every > 0 and max_resends > 0:
-                            last_sent = getattr(s, "confirm_last_sent_at", None) or s.confirm_requested_at
-                            sent_count = int(getattr(s, "confirm_sent_count", 0) or 0)
-                            if last_sent and sent_count < max_resends:
-                                if (now - last_sent).total_seconds() >= resend_every:
-                                    from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-
-                                    kb = InlineKeyboardMarkup(
-                                        [[
-                                            InlineKeyboardButton("✅ Да", callback_data=f"confirm:{s.id}:yes"),
-                                            InlineKeyboardButton("❌ Нет", callback_data=f"confirm:{s.id}:no"),
-                                        ]]
-                                    )
-                                    await bot.send_message(
-                                        chat_id=s.user.telegram_id,
-                                        text=(
-                                            "⏳ Напоминание: подтвердите подключение к VPN.\n\n"
-                                            f"MikroTik user: {s.mikrotik_username}\n"
-                                            f"Session: {a.session_id or '-'}\n\n"
-                                            "Это вы подключились?"
-                                        ),
-                                        reply_markup=kb,
-                                    )
-                                    s.confirm_last_sent_at = now
-                                    s.confirm_sent_count = sent_count + 1
-                                    db.commit()
+                        from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+                        kb = InlineKeyboardMarkup(
+                            [[
+                                InlineKeyboardButton("✅ Да", callback_data=f"confirm:{s.id}:yes"),
+                                InlineKeyboardButton("❌ Нет", callback_data=f"confirm:{s.id}:no"),
+                            ]]
+                        )
+                        mark_confirm_requested(db, s, writes)
+                        send = functools.partial(
+                            notify,
+                            bot,
+                            s.user.telegram_id,
+                            (
+                                "❓ Обнаружено подключение к VPN.\n\n"
+                                f"MikroTik user: {s.mikrotik_username}\n"
+                                f"Session: {a.session_id or '-'}\n\n"
+                                "Это вы подключились?"
+                            ),
+                            Priority.PROMPT,
+                            on_dropped=functools.partial(_confirm_prompt_dropped, s.id, s.confirm_requested_at),
+                            reply_markup=kb,
+                        )
+                        prompts.append((s.id, send))
                     except Exception as e:  # noqa: BLE001
-                        logger.error("Failed to resend confirmation request: %s", e)
-
-                    # Total timeout?
-                    if s.confirm_requested_at:
-                        age = (now - s.confirm_requested_at).total_seconds()
-                        if age > int(settings.CONFIRMATION_TIMEOUT_SECONDS):
-                            disconnect_session(db, s)
-                            try:
-                                await bot.send_message(chat_id=s.user.telegram_id, text="❌ Подтверждение не получено вовремя. Доступ отключен.")
-                            except Exception:
-                                pass
-            else:
-                # not active on router
-                if s.status in {SessionStatus.CONNECTED, SessionStatus.CONFIRM_REQUESTED, SessionStatus.ACTIVE}:
-                    # grace via last_seen_at
-                    grace = int(getattr(settings, "DISCONNECT_GRACE_SECONDS", 0) or 0)
-                    if grace <= 0:
-                        grace = max(30, int(settings.POLL_INTERVAL_SECONDS) * 2)
-                    last_seen = s.last_seen_at or s.connected_at
-                    if last_seen and (now - last_seen).total_seconds() < grace:
-                        continue
-                    disconnect_session(db, s)
-                    try:
-                        await bot.send_message(chat_id=s.user.telegram_id, text="🔌 Подключение к VPN завершено. Доступ отключен.")
-                    except Exception:
-                        pass
+                        logger.error("Failed to queue confirmation request: %s", e)
+                else:
+                    # Auto-confirm; access is granted once the status change is committed.
+                    confirm_session(db, s, writes=writes)
+                    calls.append(_RouterCall(s, "grant", "✅ Подключение подтверждено. Доступ открыт."))
+            elif s.status == SessionStatus.CONFIRM_REQUESTED:
+                # Optional resend of confirmation request while client stays connected
+                try:
+                    resend_every = int(getattr(settings, "CONFIRMATION_RESEND_SECONDS", 0) or 0)
+                    max_resends = int(getattr(settings, "CONFIRMATION_MAX_RESENDS", 0) or 0)
+                    if resend_every > 0 and max_resends > 0:
+                        last_sent = getattr(s, "confirm_last_sent_at", None) or s.confirm_requested_at
+                        sent_count = int(getattr(s, "confirm_sent_count", 0) or 0)
+                        if last_sent and sent_count < max_resends:
+                            if (now - last_sent).total_seconds() >= resend_every:
+                                from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+                                kb = InlineKeyboardMarkup(
+                                    [[
+                                        InlineKeyboardButton("✅ Да", callback_data=f"confirm:{s.id}:yes"),
+                                        InlineKeyboardButton("❌ Нет", callback_data=f"confirm:{s.id}:no"),
+                                    ]]
+                                )
+                                send = functools.partial(
+                                    notify,
+                                    bot,
+                                    s.user.telegram_id,
+                                    (
+                                        "⏳ Напоминание: подтвердите подключение к VPN.\n\n"
+                                        f"MikroTik user: {s.mikrotik_username}\n"
+                                        f"Session: {a.session_id or '-'}\n\n"
+                                        "Это вы подключились?"
+                                    ),
+                                    Priority.PROMPT,
+                                    reply_markup=kb,
+                                )
+                                prompts.append((s.id, send))
+                                set_session_fields(
+                                    db, s, writes, confirm_last_sent_at=now, confirm_sent_count=sent_count + 1
+                                )
+                except Exception as e:  # noqa: BLE001
+                    logger.error("Failed to resend confirmation request: %s", e)
+
+                # Total timeout?
+                if s.confirm_requested_at:
+                    age = (now - s.confirm_requested_at).total_seconds()
+                    if age > int(settings.CONFIRMATION_TIMEOUT_SECONDS):
+                        set_session_fields(db, s, writes, status=SessionStatus.DISCONNECTED)
+                        calls.append(_RouterCall(s, "revoke", "❌ Подтверждение не получено вовремя. Доступ отключен."))
+        else:
+            # not active on router
+            if s.status in {SessionStatus.CONNECTED, SessionStatus.CONFIRM_REQUESTED, SessionStatus.ACTIVE}:
+                # grace via the last heartbeat (in memory, may be newer than last_seen_at)
+                seen = last_seen(s)
+                if seen and (now - seen).total_seconds() < disconnect_grace_seconds():
+                    continue
+                set_session_fields(db, s, writes, status=SessionStatus.DISCONNECTED)
+                calls.append(_RouterCall(s, "revoke", "🔌 Подключение к VPN завершено. Доступ отключен."))
+
+
+def _confirm_prompt_dropped(session_id: str, requested_at: Optional[datetime]) -> None:
+    """The first confirmation prompt could not be delivered: ask again on the next poll."""
+    with db_session() as db:
+        if revert_confirm_request(db, session_id, requested_at):
+            logger.warning("Confirmation prompt for session %s was not delivered: asking again", session_id)
 
 
-def _try_enable_firewall_for_user(db, session) -> Optional[str]:
+async def _revoke_access(session: VpnSession, cfg: RouterConfig) -> Dict[str, Any]:
+    await revoke_session_access_async(session, cfg)
+    return {}
+
+
+async def _grant_address_list_access(session: VpnSession, cfg: RouterConfig) -> Dict[str, Any]:
+    """FIREWALL_ACCESS_MODE=address_list: list the client's IP until the session expires."""
+    address = (session.client_address or "").strip()
+    if not address:
+        logger.warning("Router reported no address for %s: address-list access not granted", session.mikrotik_username)
+        return {}
+    if session.expires_at:
+        remaining = int((session.expires_at - datetime.utcnow()).total_seconds())
+    else:
+        remaining = int(settings.SESSION_DURATION_HOURS) * 3600
+    if remaining <= 0:
+        return {}
+    comment = f"{(settings.FIREWALL_COMMENT_PREFIX or '').strip()} {session.mikrotik_username}".strip()
+    entry_id = await mikrotik_api_async.add_address_list_entry(
+        settings.FIREWALL_ADDRESS_LIST, address, remaining, comment=comment, cfg=cfg
+    )
+    return {"address_list_entry_id": entry_id} if entry_id else {}
+
+
+async def _move_address_list_access(session: VpnSession, cfg: RouterConfig) -> Dict[str, Any]:
+    old_entry = session.address_list_entry_id
+    values = await _grant_address_list_access(session, cfg)
+    new_entry = values.get("address_list_entry_id")
+    if new_entry and new_entry != old_entry:
+        await mikrotik_api_async.remove_address_list_entry(old_entry, cfg=cfg)
+    return values
+
+
+async def _grant_access(session: VpnSession, cfg: RouterConfig) -> Dict[str, Any]:
     """
-    Prefer per-user firewall_rule_id if configured.
+    FIREWALL_ACCESS_MODE=address_list: add the client's IP to the access address-list.
+    Otherwise prefer per-user firewall_rule_id if configured (and it lives on the session's router).
     Otherwise:
       - If user has a configured firewall comment, try enabling the first rule that matches it.
       - Else try heuristic: FIREWALL_COMMENT_PREFIX + username.
+    Returns the session columns to store (firewall_rule_id / address_list_entry_id).
     """
     user = session.user
+    if settings.FIREWALL_ACCESS_MODE == "address_list":
+        return await _grant_address_list_access(session, cfg)
     rid_pref = (getattr(user, "firewall_rule_id", None) or "").strip()
-    if rid_pref:
-        mikrotik_api.set_firewall_rule_enabled(rid_pref, enabled=True)
-        session.firewall_rule_id = rid_pref
-        db.commit()
-        return rid_pref
+    if rid_pref and getattr(user, "firewall_router_id", None) == session.router_id:
+        await mikrotik_api_async.set_firewall_rule_enabled(rid_pref, enabled=True, cfg=cfg)
+        return {"firewall_rule_id": rid_pref}
 
     comment = (getattr(user, "firewall_rule_comment", None) or "").strip()
     if not comment:
@@ -195,15 +564,17 @@ def _try_enable_firewall_for_user(db, session) -> Optional[str]:
         if prefix:
             comment = f"{prefix} {session.mikrotik_username}"
     if not comment:
-        return None
-    rule = mikrotik_api.find_firewall_rule_by_comment_substring(comment)
-    if not rule:
-        return None
-    rid = rule.get(".id") or rule.get("id")
-    if not rid:
-        return None
-    mikrotik_api.set_firewall_rule_enabled(str(rid), enabled=True)
-    session.firewall_rule_id = str(rid)
-    db.commit()
-    return str(rid)
+        return {}
+    rid = await enable_firewall_rule_by_comment_async(comment, session.router_id, cfg=cfg)
+    return {"firewall_rule_id": rid} if rid else {}
 
+
+async def _try_enable_firewall_for_user(db, session) -> Optional[str]:
+    """Grant access for a session confirmed by the user and store the rule / entry id."""
+    cfg = get_router_config(db, session.router_id)
+    if cfg is None:
+        return None
+    values = await _grant_access(session, cfg)
+    if values:
+        set_session_fields(db, session, **values)
+    return values.get("firewall_rule_id") or values.get("address_list_entry_id")
@@ -0,0 +1,218 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from contextlib import aclosing
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from mikrotik_2fa_bot.services import mikrotik_api_async
+from mikrotik_2fa_bot.services.ros_common import (
+    ActiveSession,
+    MikroTikAPIError,
+    RouterConfig,
+    RouterUnavailableError,
+    current_router_config,
+    session_row_to_active,
+)
+from mikrotik_2fa_bot.services.ros_records import UmSession, _normalize_bool
+
+
+logger = logging.getLogger(__name__)
+
+_CLOSED = object()
+
+
+class SessionWatcher:
+    """
+    Event-driven view of active User Manager sessions.
+
+    Holds a `listen` subscription on the UM session table (asyncio client) and keeps
+    UM session .id -> ActiveSession for active rows. Whenever a user goes from
+    "no active session" to "active" (or back), `on_change({username})` is awaited.
+
+    `healthy` is True while the subscription is up, the snapshot was applied and the
+    connection answered within the last 2 * keepalive_seconds; callers fall back to
+    polling the router otherwise. A quiet subscription is probed every
+    keepalive_seconds (a silent router would otherwise look like "no changes").
+    The subscription is re-established with exponential backoff (also after router
+    settings change) and can be torn down explicitly with restart().
+
+    One watcher per router: `router_config` is called on every (re)connect, so it
+    follows router settings changes; returning None means the router is gone.
+    """
+
+    def __init__(
+        self,
+        on_change: Callable[[Set[str]], Awaitable[None]],
+        max_backoff_seconds: float = 60.0,
+        router_config: Callable[[], Optional[RouterConfig]] = current_router_config,
+        name: str = "default",
+        keepalive_seconds: float = 30.0,
+    ):
+        self._on_change = on_change
+        self._max_backoff = float(max_backoff_seconds)
+        self._router_config = router_config
+        self.name = name
+        self._active: Dict[str, ActiveSession] = {}
+        self._keepalive = max(1.0, float(keepalive_seconds))
+        self._task: Optional[asyncio.Task] = None
+        self._subscribed = False
+        self._alive_at = 0.0  # monotonic: snapshot, event or keepalive answer
+        self.events = 0
+        self.last_event_at: Optional[float] = None
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name=f"um-session-watcher:{self.name}")
+
+    @property
+    def healthy(self) -> bool:
+        return self._subscribed and time.monotonic() - self._alive_at < 2 * self._keepalive
+
+    async def stop(self) -> None:
+        task, self._task = self._task, None
+        self._subscribed = False
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+
+    async def restart(self) -> None:
+        """Drop the subscription and subscribe again (the view is not trusted meanwhile)."""
+        await self.stop()
+        self.start()
+
+    def active_by_user(self) -> Dict[str, ActiveSession]:
+        out: Dict[str, ActiveSession] = {}
+        for a in self._active.values():
+            out.setdefault(a.username, a)
+        return out
+
+    async def resync(self) -> None:
+        """Replace the in-memory view with a fresh `?active=yes` read (reconciliation)."""
+        async with mikrotik_api_async.ros_conn(self._cfg()) as conn:
+            path = (await mikrotik_api_async._get_capabilities(conn)).um_path("session")
+            rows = await conn.run(f"/{path}/print", f"=.proplist={UmSession.PROPLIST}", "?active=yes")
+        before = set(self.active_by_user())
+        self._load_snapshot(rows)
+        changed = before ^ set(self.active_by_user())
+        if changed:
+            await self._notify(changed)
+
+    # --- internals
+
+    def _cfg(self) -> RouterConfig:
+        cfg = self._router_config()
+        if cfg is None:
+            raise MikroTikAPIError(f"router '{self.name}' is not configured")
+        return cfg
+
+    def _is_user_active(self, username: str) -> bool:
+        return any(a.username == username for a in self._active.values())
+
+    def _load_snapshot(self, rows) -> None:
+        active: Dict[str, ActiveSession] = {}
+        for row in rows:
+            rid = row.get(".id")
+            a = session_row_to_active(row)
+            if rid and a:
+                active[str(rid)] = a
+        self._active = active
+
+    def _apply(self, row: Dict[str, Any]) -> Optional[str]:
+        """Apply one listen event; returns the username whose active state flipped, if any."""
+        rid = row.get(".id")
+        if not rid:
+            return None
+        rid = str(rid)
+        prev = self._active.get(rid)
+        a = None if _normalize_bool(row.get(".dead")) else session_row_to_active(row)
+        if a is None:
+            if prev is None:
+                return None
+            del self._active[rid]
+            return None if self._is_user_active(prev.username) else prev.username
+        was_active = self._is_user_active(a.username)
+        self._active[rid] = a
+        return None if was_active else a.username
+
+    async def _notify(self, usernames: Set[str]) -> None:
+        try:
+            await self._on_change(usernames)
+        except Exception as e:  # noqa: BLE001
+            logger.error("Session watcher [%s]: processing %s failed: %s", self.name, sorted(usernames), e)
+
+    async def _run(self) -> None:
+        backoff = 1.0
+        while True:
+            try:
+                await self._watch()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:  # noqa: BLE001
+                if self._subscribed:
+                    backoff = 1.0  # subscription had been up: reconnect quickly
+                # Circuit open: the outage is already logged by the breaker.
+                log = logger.debug if isinstance(e, RouterUnavailableError) else logger.warning
+                log("Session watcher [%s] stopped: %s (retry in %.0fs)", self.name, e, backoff)
+            self._subscribed = False
+            await asyncio.sleep(backoff)
+            backoff = min(self._max_backoff, backoff * 2)
+
+    async def _watch(self) -> None:
+        async with mikrotik_api_async.ros_conn(self._cfg()) as conn:
+            path = (await mikrotik_api_async._get_capabilities(conn)).um_path("session")
+            queue: asyncio.Queue = asyncio.Queue()
+
+            async def _pump() -> None:
+                try:
+                    async with aclosing(conn.stream(f"/{path}/listen", timeout=None)) as events:
+                        async for row in events:
+                            queue.put_nowait(row)
+                except BaseException as e:  # noqa: BLE001
+                    queue.put_nowait((_CLOSED, e))
+                    raise
+                queue.put_nowait((_CLOSED, None))
+
+            pump = asyncio.create_task(_pump())
+            try:
+                # `listen` is written before the snapshot print on the same connection, so the
+                # router sees them in that order: no change can fall between the two.
+                await asyncio.sleep(0)
+                before = set(self.active_by_user())
+                self._load_snapshot(await conn.run(f"/{path}/print", f"=.proplist={UmSession.PROPLIST}", "?active=yes"))
+                self._subscribed = True
+                self._alive_at = time.monotonic()
+                logger.info("Session watcher [%s]: listening on /%s (%d active)", self.name, path, len(self._active))
+                changed = before ^ set(self.active_by_user())
+                if changed:
+                    await self._notify(changed)
+
+                while True:
+                    try:
+                        item = await asyncio.wait_for(queue.get(), timeout=self._keepalive)
+                    except asyncio.TimeoutError:
+                        # Nothing heard for a while: make sure the router still answers on this
+                        # connection. A timeout or error here ends the watch and reconnects.
+                        await conn.run("/system/identity/print", "=.proplist=name")
+                        self._alive_at = time.monotonic()
+                        continue
+                    if isinstance(item, tuple) and item and item[0] is _CLOSED:
+                        if item[1] is not None:
+                            raise item[1]
+                        raise MikroTikAPIError("listen ended")
+                    self.events += 1
+                    self.last_event_at = time.time()
+                    self._alive_at = time.monotonic()
+                    flipped = self._apply(item)
+                    if flipped:
+                        await self._notify({flipped})
+            finally:
+                pump.cancel()
+                try:
+                    await pump
+                except (asyncio.CancelledError, Exception):
+                    pass
@@ -1,69 +1,70 @@
 from __future__ import annotations
 
-from datetime import datetime
-
 from sqlalchemy.orm import Session
-from sqlalchemy.exc import IntegrityError
 
 from mikrotik_2fa_bot.models import UmUserCache
-from mikrotik_2fa_bot.services import mikrotik_api
+from mikrotik_2fa_bot.services import mikrotik_api_async
+from mikrotik_2fa_bot.services.cache_sync import CacheSync, KeysetPage, SyncStats, keyset_page, prefix_range
+from mikrotik_2fa_bot.services.routers import require_router_config, router_key
 
 
-def refresh_um_users_cache(db: Session) -> int:
+async def refresh_um_users_cache_async(db: Session, router_id: int | None = None, force: bool = False) -> SyncStats:
     """
-    Refresh UM users cache in SQLite without holding a full list in memory.
-    Returns number of usernames seen.
+    Refresh UM users cache (of one router) in SQLite without holding a full list in memory.
 
     Strategy:
-      - stream usernames from router, upsert each with fetched_at=now
+      - read the .id fingerprint; unchanged since the last refresh (and not force): done
+      - stream usernames from router, bulk-upsert them in chunks with fetched_at=now
       - delete rows not seen in this refresh (fetched_at < now)
     """
-    now = datetime.utcnow()
-    seen = 0
-    for uname in mikrotik_api.iter_user_manager_usernames():
-        u = (uname or "").strip()
-        if not u:
-            continue
-        seen += 1
-        row = UmUserCache(username=u, fetched_at=now)
-        db.add(row)
-        try:
-            db.commit()
-        except IntegrityError:
-            db.rollback()
-            existing = db.query(UmUserCache).filter(UmUserCache.username == u).first()
-            if existing:
-                existing.fetched_at = now
-                db.commit()
-    # Remove entries that no longer exist on router
-    db.query(UmUserCache).filter(UmUserCache.fetched_at < now).delete(synchronize_session=False)
-    db.commit()
-    return seen
+    cfg = require_router_config(db, router_id)
+    sync = _um_sync(db, router_id)
+    sync.fingerprint = await mikrotik_api_async.user_manager_users_fingerprint(cfg=cfg)
+    if not force and sync.is_current():
+        return sync.skipped()
+    async for uname in mikrotik_api_async.iter_user_manager_usernames(cfg=cfg):
+        _add_username(sync, uname)
+    return sync.finish()
 
 
-def refresh_um_users_cache_in_new_session() -> int:
-    """
-    Convenience wrapper for running in a thread:
-    opens its own DB session (SQLAlchemy sessions are not thread-safe).
-    """
-    from mikrotik_2fa_bot.db import db_session
+def _um_sync(db: Session, router_id: int | None) -> CacheSync:
+    return CacheSync(db, UmUserCache, router_key(router_id), key_columns=("username",), update_columns=("username_lc",))
 
-    with db_session() as db:
-        return refresh_um_users_cache(db)
 
+def _add_username(sync: CacheSync, uname: str | None) -> None:
+    u = (uname or "").strip()
+    if u:
+        sync.add(username=u, username_lc=u.lower())
 
-def count_um_users_cache(db: Session) -> int:
-    return int(db.query(UmUserCache).count())
 
+def _um_query(db: Session, router_id: int | None, prefix: str | None):
+    # Prefix search ignores case, like the firewall comment search; pages stay ordered by username.
+    q = db.query(UmUserCache).filter(UmUserCache.router_id == router_key(router_id))
+    return prefix_range(q, UmUserCache.username_lc, (prefix or "").strip().lower() or None)
 
-def list_um_users_page(db: Session, page: int, page_size: int) -> list[UmUserCache]:
-    page = max(0, int(page))
-    size = max(1, int(page_size))
-    return (
-        db.query(UmUserCache)
-        .order_by(UmUserCache.username.asc())
-        .offset(page * size)
-        .limit(size)
-        .all()
-    )
 
+def count_um_users_cache(db: Session, router_id: int | None = None, prefix: str | None = None) -> int:
+    return int(_um_query(db, router_id, prefix).count())
+
+
+def list_um_users_page(
+    db: Session,
+    page_size: int,
+    router_id: int | None = None,
+    prefix: str | None = None,
+    after_id: int | None = None,
+    before_id: int | None = None,
+) -> KeysetPage:
+    """
+    Picker page by username, continuing after/before the cache row `after_id`/`before_id`
+    (row ids keep callback data short). A row gone since then restarts from the first page.
+    """
+    anchor = db.get(UmUserCache, after_id or before_id) if (after_id or before_id) else None
+    key = anchor.username if anchor else None
+    return keyset_page(
+        _um_query(db, router_id, prefix),
+        UmUserCache.username,
+        page_size,
+        after=key if after_id else None,
+        before=key if before_id else None,
+    )
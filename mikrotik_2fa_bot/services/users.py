@@ -1,10 +1,12 @@
 from __future__ import annotations
 
 from datetime import datetime
+from sqlalchemy import or_
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
 
 from mikrotik_2fa_bot.models import User, UserStatus, MikrotikAccount
+from mikrotik_2fa_bot.services.cache_sync import KeysetPage, keyset_page
 
 
 def get_user_by_telegram_id(db: Session, telegram_id: int) -> User | None:
@@ -36,6 +38,43 @@ def list_users(db: Session, limit: int = 200) -> list[User]:
     return db.query(User).order_by(User.created_at.desc()).limit(int(limit)).all()
 
 
+def _users_query(db: Session, search: str | None):
+    q = db.query(User)
+    search = (search or "").strip()
+    if not search:
+        return q
+    # SQLite only folds ASCII case, so also try the capitalized form ("иван" -> "Иван")
+    variants = {search, search.lower(), search[:1].upper() + search[1:]}
+    conds = [User.full_name.icontains(v, autoescape=True) for v in variants]
+    if search.isdigit():
+        conds.append(User.telegram_id == int(search))
+    return q.filter(or_(*conds))
+
+
+def count_users(db: Session, search: str | None = None) -> int:
+    return int(_users_query(db, search).count())
+
+
+def list_users_page(
+    db: Session,
+    page_size: int,
+    search: str | None = None,
+    after_telegram_id: int | None = None,
+    before_telegram_id: int | None = None,
+) -> KeysetPage:
+    """
+    Picker page by telegram_id (unique, indexed), continuing after/before the given id;
+    `search` matches a part of the name or the exact telegram_id.
+    """
+    return keyset_page(
+        _users_query(db, search),
+        User.telegram_id,
+        page_size,
+        after=after_telegram_id,
+        before=before_telegram_id,
+    )
+
+
 def approve_user(db: Session, telegram_id: int) -> User:
     user = get_user_by_telegram_id(db, telegram_id)
     if not user:
@@ -93,12 +132,15 @@ def set_user_firewall_comment(db: Session, telegram_id: int, comment: str) -> Us
     return user
 
 
-def set_user_firewall_rule_id(db: Session, telegram_id: int, rule_id: str | None) -> User:
+def set_user_firewall_rule_id(
+    db: Session, telegram_id: int, rule_id: str | None, router_id: int | None = None
+) -> User:
     user = get_user_by_telegram_id(db, telegram_id)
     if not user:
         raise ValueError("user_not_found")
     rid = (rule_id or "").strip() or None
     user.firewall_rule_id = rid
+    user.firewall_router_id = router_id if rid else None
     db.commit()
     db.refresh(user)
     return user
@@ -132,7 +174,14 @@ def list_user_accounts(db: Session, user_id: str) -> list[MikrotikAccount]:
     )
 
 
-def bind_account(db: Session, telegram_id: int, mikrotik_username: str) -> MikrotikAccount:
+def _account_query(db: Session, user_id: str, mikrotik_username: str, router_id: int | None):
+    on_router = MikrotikAccount.router_id.is_(None) if router_id is None else MikrotikAccount.router_id == router_id
+    return db.query(MikrotikAccount).filter(
+        MikrotikAccount.user_id == user_id, MikrotikAccount.mikrotik_username == mikrotik_username, on_router
+    )
+
+
+def bind_account(db: Session, telegram_id: int, mikrotik_username: str, router_id: int | None = None) -> MikrotikAccount:
     user = get_user_by_telegram_id(db, telegram_id)
     if not user:
         # Allow admin to bind UM user before the Telegram user registers.
@@ -144,18 +193,14 @@ def bind_account(db: Session, telegram_id: int, mikrotik_username: str) -> Mikro
     uname = (mikrotik_username or "").strip()
     if not uname:
         raise ValueError("invalid_username")
-    acct = MikrotikAccount(user_id=user.id, mikrotik_username=uname, is_active=True)
+    acct = MikrotikAccount(user_id=user.id, mikrotik_username=uname, router_id=router_id, is_active=True)
     db.add(acct)
     try:
         db.commit()
     except IntegrityError:
         db.rollback()
-        # If exists, reactivate
-        acct2 = (
-            db.query(MikrotikAccount)
-            .filter(MikrotikAccount.user_id == user.id, MikrotikAccount.mikrotik_username == uname)
-            .first()
-        )
+        # If exists (on this router), reactivate
+        acct2 = _account_query(db, user.id, uname, router_id).first()
         if not acct2:
             raise
         acct2.is_active = True
@@ -166,16 +211,12 @@ def bind_account(db: Session, telegram_id: int, mikrotik_username: str) -> Mikro
     return acct
 
 
-def unbind_account(db: Session, telegram_id: int, mikrotik_username: str) -> None:
+def unbind_account(db: Session, telegram_id: int, mikrotik_username: str, router_id: int | None = None) -> None:
     user = get_user_by_telegram_id(db, telegram_id)
     if not user:
         raise ValueError("user_not_found")
     uname = (mikrotik_username or "").strip()
-    acct = (
-        db.query(MikrotikAccount)
-        .filter(MikrotikAccount.user_id == user.id, MikrotikAccount.mikrotik_username == uname)
-        .first()
-    )
+    acct = _account_query(db, user.id, uname, router_id).first()
     if not acct:
         raise ValueError("account_not_found")
     acct.is_active = False
@@ -1,12 +1,23 @@
 from __future__ import annotations
 
+import logging
+import time
+from dataclasses import dataclass
 from datetime import datetime, timedelta
+from typing import Any, Dict, List, Tuple
+
 from sqlalchemy.orm import Session
-from sqlalchemy import and_
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy import and_, bindparam, select, update
 
 from mikrotik_2fa_bot.config import settings
 from mikrotik_2fa_bot.models import SessionStatus, User, UserStatus, VpnSession
-from mikrotik_2fa_bot.services import mikrotik_api
+from mikrotik_2fa_bot.services import mikrotik_api_async, poll_pacer
+from mikrotik_2fa_bot.services.ros_common import RouterConfig
+from mikrotik_2fa_bot.services.routers import get_router_config, require_router_config
+
+
+logger = logging.getLogger(__name__)
 
 
 ACTIVE_STATUSES = {
@@ -17,6 +28,31 @@ ACTIVE_STATUSES = {
 }
 
 
+# Latest "seen connected" time per session id. Heartbeats only reach the DB when the stored
+# last_seen_at gets older than heartbeat_write_seconds() or with a status change.
+_heartbeats: Dict[str, datetime] = {}
+
+
+def disconnect_grace_seconds() -> int:
+    grace = int(getattr(settings, "DISCONNECT_GRACE_SECONDS", 0) or 0)
+    if grace <= 0:
+        grace = max(30, int(settings.POLL_INTERVAL_SECONDS) * 2)
+    return grace
+
+
+def heartbeat_write_seconds() -> float:
+    return max(0.0, float(settings.HEARTBEAT_WRITE_FRACTION)) * disconnect_grace_seconds()
+
+
+def last_seen(session: VpnSession) -> datetime | None:
+    """When the router last reported the session: the in-memory heartbeat, else the stored value."""
+    seen = _heartbeats.get(session.id)
+    stored = session.last_seen_at or session.connected_at
+    if seen is None or (stored is not None and stored > seen):
+        return stored
+    return seen
+
+
 def get_active_session_for_user(db: Session, user_id: str) -> VpnSession | None:
     return (
         db.query(VpnSession)
@@ -44,6 +80,26 @@ def list_sessions_to_poll(db: Session) -> list[VpnSession]:
     )
 
 
+def list_sessions_to_poll_for_usernames(
+    db: Session, usernames: set[str], router_id: int | None = None
+) -> list[VpnSession]:
+    if not usernames:
+        return []
+    on_router = VpnSession.router_id.is_(None) if router_id is None else VpnSession.router_id == router_id
+    return (
+        db.query(VpnSession)
+        .filter(
+            and_(
+                VpnSession.status.in_(list(ACTIVE_STATUSES)),
+                on_router,
+                VpnSession.mikrotik_username.in_(list(usernames)),
+            )
+        )
+        .order_by(VpnSession.created_at.asc())
+        .all()
+    )
+
+
 def list_recent_sessions(db: Session, limit: int = 30) -> list[VpnSession]:
     return (
         db.query(VpnSession)
@@ -62,7 +118,7 @@ def list_active_sessions_all_users(db: Session) -> list[VpnSession]:
     )
 
 
-def create_vpn_request(db: Session, user: User, mikrotik_username: str) -> VpnSession:
+def _check_can_request(db: Session, user: User) -> None:
     if user.status != UserStatus.APPROVED:
         raise ValueError("user_not_approved")
 
@@ -70,97 +126,257 @@ def create_vpn_request(db: Session, user: User, mikrotik_username: str) -> VpnSe
     if existing:
         raise ValueError("session_already_active")
 
-    # Enable user on MikroTik BEFORE creating DB record.
-    mikrotik_api.set_vpn_user_disabled(mikrotik_username, disabled=False)
 
+def _insert_request(db: Session, user: User, mikrotik_username: str, router_id: int | None) -> VpnSession:
     now = datetime.utcnow()
     session = VpnSession(
         user_id=user.id,
         mikrotik_username=mikrotik_username,
+        router_id=router_id,
         status=SessionStatus.REQUESTED,
         expires_at=now + timedelta(hours=int(settings.SESSION_DURATION_HOURS)),
     )
     db.add(session)
     db.commit()
     db.refresh(session)
+    # The user is about to connect: don't let an idle poll interval delay the 2FA prompt.
+    poll_pacer.wake()
     return session
 
 
-def mark_connected(db: Session, session: VpnSession, mikrotik_session_id: str | None) -> VpnSession:
+async def create_vpn_request_async(
+    db: Session, user: User, mikrotik_username: str, router_id: int | None = None
+) -> VpnSession:
+    _check_can_request(db, user)
+    cfg = require_router_config(db, router_id)
+    await mikrotik_api_async.set_vpn_user_disabled(mikrotik_username, disabled=False, cfg=cfg)
+    return _insert_request(db, user, mikrotik_username, router_id)
+
+
+@dataclass(frozen=True, slots=True)
+class WriteStats:
+    sessions: int  # sessions with changes
+    updates: int  # UPDATE statements issued
+    conflicts: int  # sessions whose status changed meanwhile (their changes were dropped)
+    seconds: float
+    conflicted_ids: frozenset = frozenset()
+
+
+class SessionWrites:
+    """
+    Session state changes of one poll cycle, written by flush() in a single transaction.
+
+    Changes are applied to the loaded objects right away (without marking them dirty) and
+    sessions that end up with the same values share one `UPDATE ... WHERE id IN (...)`;
+    the rest is written with one executemany per set of columns. Timestamps are taken when
+    a change is made, not once per cycle.
+    Every UPDATE also requires the status the session had when first changed: if a button
+    handler moved it meanwhile (confirmed, disconnected), that session's changes are dropped.
+    """
+
+    def __init__(self, db: Session, chunk_size: int = 500):
+        self.db = db
+        self._chunk_size = max(1, int(chunk_size))
+        self._changes: Dict[str, Dict[str, Any]] = {}
+        self._expected: Dict[str, SessionStatus] = {}
+
+    def set(self, session: VpnSession, **values: Any) -> None:
+        if session.id not in self._expected:
+            self._expected[session.id] = session.status
+        for key, value in values.items():
+            set_committed_value(session, key, value)
+        self._changes.setdefault(session.id, {}).update(values)
+
+    def flush(self) -> WriteStats:
+        started = time.perf_counter()
+        table = VpnSession.__table__
+        groups: Dict[Tuple, List[str]] = {}
+        for sid, values in self._changes.items():
+            groups.setdefault((self._expected[sid], tuple(sorted(values.items()))), []).append(sid)
+        # Values only one session has (a new session id or address on connect) go into a
+        # single executemany per set of columns instead of one UPDATE each.
+        single: Dict[Tuple[str, ...], List[Dict[str, Any]]] = {}
+        updates = matched = 0
+        for (expected, values), ids in groups.items():
+            if len(ids) == 1:
+                columns = tuple(k for k, _ in values)
+                single.setdefault(columns, []).append({"_id": ids[0], "_expected": expected, **dict(values)})
+                continue
+            for i in range(0, len(ids), self._chunk_size):
+                result = self.db.execute(
+                    update(table)
+                    .where(table.c.id.in_(ids[i : i + self._chunk_size]), table.c.status == expected)
+                    .values(dict(values))
+                )
+                updates += 1
+                matched += int(result.rowcount or 0)
+        for rows in single.values():
+            result = self.db.execute(
+                update(table).where(table.c.id == bindparam("_id"), table.c.status == bindparam("_expected")),
+                rows,
+            )
+            updates += 1
+            matched += int(result.rowcount or 0)
+        if updates:
+            self.db.commit()
+        conflicted: frozenset = frozenset()
+        if matched < len(self._changes):
+            # Which ones: their status is no longer the one this cycle wrote (or expected).
+            target = {sid: values.get("status", self._expected[sid]) for sid, values in self._changes.items()}
+            rows = self.db.execute(select(table.c.id, table.c.status).where(table.c.id.in_(list(target)))).all()
+            current = {sid: status for sid, status in rows}
+            conflicted = frozenset(sid for sid, status in target.items() if current.get(sid) != status)
+        stats = WriteStats(
+            sessions=len(self._changes),
+            updates=updates,
+            conflicts=len(self._changes) - matched,
+            seconds=round(time.perf_counter() - started, 3),
+            conflicted_ids=conflicted,
+        )
+        self._changes.clear()
+        self._expected.clear()
+        return stats
+
+
+def set_session_fields(db: Session, session: VpnSession, writes: SessionWrites | None = None, **values: Any) -> None:
+    """Change session columns: deferred to `writes` in a poll cycle, committed right away otherwise."""
+    if "status" in values:
+        # A status change persists the latest heartbeat; final states drop it.
+        seen = _heartbeats.get(session.id)
+        if seen is not None and "last_seen_at" not in values:
+            values["last_seen_at"] = seen
+        if values["status"] not in ACTIVE_STATUSES:
+            _heartbeats.pop(session.id, None)
+    if writes is not None:
+        writes.set(session, **values)
+        return
+    for key, value in values.items():
+        setattr(session, key, value)
+    db.commit()
+
+
+def mark_connected(
+    db: Session,
+    session: VpnSession,
+    mikrotik_session_id: str | None,
+    client_address: str | None = None,
+    writes: SessionWrites | None = None,
+) -> VpnSession:
     now = datetime.utcnow()
+    _heartbeats[session.id] = now
+    values: Dict[str, Any] = {}
     if session.status == SessionStatus.REQUESTED:
-        session.status = SessionStatus.CONNECTED
-        session.connected_at = now
-    session.last_seen_at = now
-    if mikrotik_session_id:
-        session.mikrotik_session_id = mikrotik_session_id
-    db.commit()
-    db.refresh(session)
+        values["status"] = SessionStatus.CONNECTED
+        values["connected_at"] = now
+    if mikrotik_session_id and mikrotik_session_id != session.mikrotik_session_id:
+        values["mikrotik_session_id"] = mikrotik_session_id
+    if client_address and client_address != session.client_address:
+        values["client_address"] = client_address
+    stored = session.last_seen_at
+    if values or stored is None or (now - stored).total_seconds() >= heartbeat_write_seconds():
+        values["last_seen_at"] = now
+    if values:
+        set_session_fields(db, session, writes, **values)
     return session
 
 
-def mark_confirm_requested(db: Session, session: VpnSession) -> VpnSession:
+def mark_confirm_requested(db: Session, session: VpnSession, writes: SessionWrites | None = None) -> VpnSession:
     now = datetime.utcnow()
-    session.status = SessionStatus.CONFIRM_REQUESTED
-    session.confirm_requested_at = now
-    session.confirm_last_sent_at = now
-    # first prompt counts as 1
-    session.confirm_sent_count = max(1, int(getattr(session, "confirm_sent_count", 0) or 0))
-    db.commit()
-    db.refresh(session)
+    set_session_fields(
+        db,
+        session,
+        writes,
+        status=SessionStatus.CONFIRM_REQUESTED,
+        confirm_requested_at=now,
+        confirm_last_sent_at=now,
+        # first prompt counts as 1
+        confirm_sent_count=max(1, int(getattr(session, "confirm_sent_count", 0) or 0)),
+    )
     return session
 
 
-def confirm_session(db: Session, session: VpnSession, firewall_rule_id: str | None = None) -> VpnSession:
+def confirm_session(
+    db: Session, session: VpnSession, firewall_rule_id: str | None = None, writes: SessionWrites | None = None
+) -> VpnSession:
     now = datetime.utcnow()
-    session.status = SessionStatus.ACTIVE
-    session.confirmed_at = now
+    values: Dict[str, Any] = {"status": SessionStatus.ACTIVE, "confirmed_at": now}
     if firewall_rule_id:
-        session.firewall_rule_id = firewall_rule_id
-    db.commit()
-    db.refresh(session)
+        values["firewall_rule_id"] = firewall_rule_id
+    set_session_fields(db, session, writes, **values)
     return session
 
 
-def disconnect_session(db: Session, session: VpnSession) -> VpnSession:
-    session.status = SessionStatus.DISCONNECTED
+def revert_confirm_request(db: Session, session_id: str, requested_at: datetime | None) -> bool:
+    """
+    Undo mark_confirm_requested() for a prompt that never reached the user: the session goes
+    back to CONNECTED and the next poll asks again. Only if it still waits for that prompt.
+    """
+    result = db.execute(
+        update(VpnSession)
+        .where(
+            VpnSession.id == session_id,
+            VpnSession.status == SessionStatus.CONFIRM_REQUESTED,
+            VpnSession.confirm_requested_at == requested_at,
+        )
+        .values(
+            status=SessionStatus.CONNECTED,
+            confirm_requested_at=None,
+            confirm_last_sent_at=None,
+            confirm_sent_count=0,
+        )
+    )
     db.commit()
-    db.refresh(session)
+    return bool(result.rowcount)
 
-    # Best-effort: revoke access and tear down connection.
-    try:
-        if session.firewall_rule_id:
-            mikrotik_api.set_firewall_rule_enabled(session.firewall_rule_id, enabled=False)
-    except Exception:
-        pass
-    try:
-        mikrotik_api.disconnect_active_connections(session.mikrotik_username)
-    except Exception:
-        pass
-    try:
-        mikrotik_api.set_vpn_user_disabled(session.mikrotik_username, disabled=True)
-    except Exception:
-        pass
 
-    return session
+async def _revoke_with_script_async(session: VpnSession, cfg: RouterConfig) -> bool:
+    """
+    REVOKE_MODE=script: revoke everything with one router-side script call.
+    False if the mode is off or the call failed (callers fall back to the separate steps).
+    """
+    if settings.REVOKE_MODE != "script":
+        return False
+    try:
+        await mikrotik_api_async.revoke_access(
+            session.mikrotik_username, session.firewall_rule_id, cfg=cfg, address_list_entry_id=session.address_list_entry_id
+        )
+        return True
+    except Exception as e:  # noqa: BLE001
+        logger.warning("Revoke script for %s failed, falling back to separate steps: %s", session.mikrotik_username, e)
+        return False
 
 
-def expire_session(db: Session, session: VpnSession) -> VpnSession:
-    session.status = SessionStatus.EXPIRED
-    db.commit()
-    db.refresh(session)
-    try:
-        if session.firewall_rule_id:
-            mikrotik_api.set_firewall_rule_enabled(session.firewall_rule_id, enabled=False)
-    except Exception:
-        pass
+async def _best_effort(step: str, session: VpnSession, coro) -> None:
     try:
-        mikrotik_api.set_vpn_user_disabled(session.mikrotik_username, disabled=True)
-    except Exception:
-        pass
-    try:
-        mikrotik_api.disconnect_active_connections(session.mikrotik_username)
-    except Exception:
-        pass
+        await coro
+    except Exception as e:  # noqa: BLE001
+        logger.warning("Revoke step '%s' for %s failed: %s", step, session.mikrotik_username, e)
+
+
+async def revoke_session_access_async(session: VpnSession, cfg: RouterConfig) -> None:
+    """
+    Router side of a disconnect/expiry (best-effort, failed steps are logged): firewall rule
+    off, address-list entry removed, UM user disabled, live connections kicked. Needs no DB session.
+    """
+    if await _revoke_with_script_async(session, cfg):
+        return
+    name = session.mikrotik_username
+    if session.firewall_rule_id:
+        await _best_effort(
+            "firewall", session, mikrotik_api_async.set_firewall_rule_enabled(session.firewall_rule_id, enabled=False, cfg=cfg)
+        )
+    if session.address_list_entry_id:
+        await _best_effort(
+            "address-list", session, mikrotik_api_async.remove_address_list_entry(session.address_list_entry_id, cfg=cfg)
+        )
+    await _best_effort("disable", session, mikrotik_api_async.set_vpn_user_disabled(name, disabled=True, cfg=cfg))
+    await _best_effort("kick", session, mikrotik_api_async.disconnect_active_connections(name, cfg=cfg))
+
+
+async def disconnect_session_async(db: Session, session: VpnSession) -> VpnSession:
+    """The user ended the session: mark it DISCONNECTED and revoke access on its router."""
+    set_session_fields(db, session, status=SessionStatus.DISCONNECTED)
+    cfg = get_router_config(db, session.router_id)
+    if cfg is not None:
+        await revoke_session_access_async(session, cfg)
     return session
-
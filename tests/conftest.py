@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+# Before the package is imported: the engine is created from DATABASE_URL at import time.
+_TMP = Path(tempfile.mkdtemp(prefix="mikrotik-2fa-tests-"))
+os.environ["DATABASE_URL"] = f"sqlite:///{_TMP / 'test.db'}"
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from mikrotik_2fa_bot.config import settings  # noqa: E402
+from mikrotik_2fa_bot.routeros_sim import FaultConfig, RouterModel, RouterOSSimulator  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def _isolated(monkeypatch):
+    """Settings changed by a test are restored afterwards; the settings key stays out of ./data."""
+    from mikrotik_2fa_bot.services import app_settings
+
+    monkeypatch.setattr(app_settings, "_KEY_PATH", _TMP / "settings.key")
+    saved = settings.model_dump()
+    yield
+    for k, v in saved.items():
+        setattr(settings, k, v)
+
+
+@pytest.fixture
+def db():
+    from mikrotik_2fa_bot.db import Base, SessionLocal, engine, init_db
+
+    Base.metadata.drop_all(bind=engine)
+    init_db()
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+def _start_simulator(um_prefix: str = "user-manager") -> RouterOSSimulator:
+    model = RouterModel(um_prefix=um_prefix)
+    model.seed(users=20, sessions=0, active=0, fw_rules=5)
+    return RouterOSSimulator(model, faults=FaultConfig()).start()
+
+
+@pytest.fixture
+def router():
+    """A RouterOS simulator the bot's settings point at: yields (simulator, model)."""
+    yield from _default_router(_start_simulator())
+
+
+@pytest.fixture
+def router_v6():
+    """Like `router`, with RouterOS v6 User Manager (/tool/user-manager, users keyed by `username`)."""
+    yield from _default_router(_start_simulator("tool/user-manager"))
+
+
+def _default_router(sim: RouterOSSimulator):
+    settings.MIKROTIK_HOST = sim.host
+    settings.MIKROTIK_PORT = sim.port
+    settings.MIKROTIK_USERNAME = "admin"
+    settings.MIKROTIK_PASSWORD = "admin"
+    settings.MIKROTIK_USE_SSL = False
+    try:
+        yield sim, sim.model
+    finally:
+        sim.stop()
+
+
+@pytest.fixture
+def site_b(db):
+    """A second simulator registered in the `routers` table: yields (router_id, simulator)."""
+    from mikrotik_2fa_bot.services.routers import create_router
+
+    sim = _start_simulator()
+    r = create_router(db, "site-b", sim.host, sim.port, "admin", "admin")
+    try:
+        yield r.id, sim
+    finally:
+        sim.stop()
@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import asyncio
+
+from mikrotik_2fa_bot.services import cache_refresher, fw_cache, mikrotik_api_async
+
+_FILTER = "ip/firewall/filter"
+
+
+def _rule(model, comment: str) -> dict:
+    return next(r for r in model.rows(_FILTER) if r["comment"] == comment)
+
+
+def _enable(rid: str, needle: str) -> bool:
+    return asyncio.run(mikrotik_api_async.enable_firewall_rule_checked(rid, needle))
+
+
+def test_indexed_enable_checks_the_comment_first(router):
+    sim, model = router
+    other = _rule(model, "2FA user000001")
+
+    # The indexed .id now belongs to a rule with another comment: it is never enabled.
+    assert not _enable(other[".id"], "user000002")
+    assert sim.stats.by_verb.get("set", 0) == 0
+    assert _rule(model, "2FA user000001")["disabled"] == "true"
+
+    assert _enable(_rule(model, "2FA user000002")[".id"], "USER000002")
+    assert _rule(model, "2FA user000002")["disabled"] == "false"
+    # Already enabled: nothing to write.
+    assert _enable(_rule(model, "2FA user000002")[".id"], "user000002")
+    assert sim.stats.by_verb["set"] == 1
+
+    assert not _enable("*FFFF", "user000002")
+
+
+def test_index_misses_share_one_forced_refresh(db, router, monkeypatch):
+    calls = []
+    refresh = cache_refresher.refresh_firewall_rules_cache_async
+
+    async def _counting(router_id=None, force=False):
+        calls.append(force)
+        return await refresh(router_id, force=force)
+
+    monkeypatch.setattr(cache_refresher, "refresh_firewall_rules_cache_async", _counting)
+    fw_cache._index_built_at.clear()
+
+    async def main():
+        return await asyncio.gather(*(fw_cache.enable_firewall_rule_by_comment_async("no such rule") for _ in range(3)))
+
+    assert asyncio.run(main()) == [None, None, None]
+    assert calls == [True]
+
+
+def test_unchanged_fingerprint_keeps_the_index_fresh(db, router):
+    asyncio.run(fw_cache.refresh_firewall_rules_cache_async(force=True))
+    fw_cache._index_built_at.clear()
+
+    assert asyncio.run(fw_cache.refresh_firewall_rules_cache_async()).skipped
+    assert fw_cache._index_is_fresh(None)
+
+
+def test_refresh_counts_only_changed_rows_as_updated(db, router):
+    _, model = router
+    first = asyncio.run(fw_cache.refresh_firewall_rules_cache_async(force=True))
+    rule = _rule(model, "2FA user000001")
+    model.set(_FILTER, [rule[".id"]], {"comment": "2FA user000001 (edited)"})
+
+    stats = asyncio.run(fw_cache.refresh_firewall_rules_cache_async(force=True))
+    assert (stats.inserted, stats.updated, stats.deleted) == (0, 1, 0)
+    stats = asyncio.run(fw_cache.refresh_firewall_rules_cache_async(force=True))
+    assert (stats.inserted, stats.updated, stats.deleted) == (0, 0, 0)
+    assert fw_cache.count_firewall_rules_cache(db) == first.seen
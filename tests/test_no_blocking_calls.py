@@ -0,0 +1,38 @@
+from __future__ import annotations
+
+import ast
+from pathlib import Path
+from typing import List
+
+PACKAGE = Path(__file__).resolve().parents[1] / "mikrotik_2fa_bot"
+SIMULATOR = PACKAGE / "routeros_sim.py"
+
+# librouteros is only used for its exception types and word codec: the blocking client
+# (librouteros.connect / librouteros.api) must not come back.
+_ALLOWED_LIBROUTEROS = {"librouteros.exceptions", "librouteros.protocol"}
+_THREAD_HOPS = {"to_thread", "run_in_executor"}
+
+
+def _blocking_uses(path: Path) -> List[str]:
+    tree = ast.parse(path.read_text(encoding="utf-8"))
+    found: List[str] = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ImportFrom) and (node.module or "").split(".")[0] == "librouteros":
+            if node.module not in _ALLOWED_LIBROUTEROS:
+                found.append(f"from {node.module} import ...")
+        elif isinstance(node, ast.Import):
+            found.extend(f"import {a.name}" for a in node.names if a.name.split(".")[0] == "librouteros")
+        elif isinstance(node, ast.Attribute) and node.attr in _THREAD_HOPS:
+            found.append(node.attr)
+    return found
+
+
+def test_bot_never_calls_a_blocking_router_client():
+    offenders = {}
+    for path in sorted(PACKAGE.rglob("*.py")):
+        if path == SIMULATOR:
+            continue
+        used = _blocking_uses(path)
+        if used:
+            offenders[str(path.relative_to(PACKAGE))] = used
+    assert offenders == {}
@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import asyncio
+
+from telegram.error import Forbidden, NetworkError, RetryAfter
+
+from mikrotik_2fa_bot.services.notifier import Notifier
+
+
+class ScriptedBot:
+    """Raises the queued errors in order, then sends."""
+
+    def __init__(self, *errors: Exception):
+        self.errors = list(errors)
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.sent.append(text)
+
+
+def _run(bot, max_attempts: int = 2):
+    dropped = []
+
+    async def main():
+        n = Notifier(bot, rate_per_second=0, chat_rate_per_second=0, max_attempts=max_attempts)
+        n.submit(1, "hello", on_dropped=lambda: dropped.append("hello"))
+        await n.drain()
+        await n.stop()
+        return n.stats()
+
+    return asyncio.run(main()), dropped
+
+
+def test_flood_waits_do_not_use_up_attempts():
+    bot = ScriptedBot(RetryAfter(0), RetryAfter(0), RetryAfter(0))
+    stats, dropped = _run(bot, max_attempts=1)
+    assert bot.sent == ["hello"]
+    assert (stats.sent, stats.failed, stats.flood_waits, stats.retries) == (1, 0, 3, 0)
+    assert dropped == []
+
+
+def test_dropped_after_retries_calls_back():
+    stats, dropped = _run(ScriptedBot(NetworkError("a"), NetworkError("b")))
+    assert (stats.sent, stats.failed) == (0, 1)
+    assert dropped == ["hello"]
+
+
+def test_refused_chat_is_not_called_back():
+    stats, dropped = _run(ScriptedBot(Forbidden("bot was blocked by the user")))
+    assert stats.failed == 1
+    assert dropped == []
+
+
+def test_messages_left_on_stop_are_called_back():
+    dropped = []
+
+    async def main():
+        n = Notifier(ScriptedBot(), rate_per_second=0, chat_rate_per_second=0.001)
+        for i in range(3):
+            n.submit(1, f"m{i}", on_dropped=lambda i=i: dropped.append(i))
+        await asyncio.sleep(0.1)
+        await n.stop(drain_timeout=0)
+
+    asyncio.run(main())
+    assert sorted(dropped) == [1, 2]
@@ -0,0 +1,38 @@
+from __future__ import annotations
+
+import asyncio
+
+from sqlalchemy import text
+
+from mikrotik_2fa_bot.db import engine, init_db
+from mikrotik_2fa_bot.models import CacheFingerprint, UmUserCache
+from mikrotik_2fa_bot.services.um_cache import count_um_users_cache, list_um_users_page, refresh_um_users_cache_async
+
+
+def test_um_user_search_ignores_case(db, router):
+    _, model = router
+    for name in ("Alice01", "alice02", "ALICE03", "bob"):
+        model.add("user-manager/user", {"name": name, "disabled": "false"})
+    asyncio.run(refresh_um_users_cache_async(db))
+
+    assert count_um_users_cache(db, None, "aLi") == 3
+    first = list_um_users_page(db, 2, None, "ALI")
+    assert [r.username for r in first.rows] == ["ALICE03", "Alice01"]
+    rest = list_um_users_page(db, 2, None, "ALI", after_id=first.rows[-1].id)
+    assert [r.username for r in rest.rows] == ["alice02"] and not rest.has_next
+
+
+def test_migration_rebuilds_the_um_cache(db):
+    db.add(CacheFingerprint(table_name="um_user_cache", router_id=0, fingerprint="x"))
+    db.commit()
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE um_user_cache"))
+        conn.execute(text("CREATE TABLE um_user_cache (id INTEGER PRIMARY KEY, router_id INTEGER, username VARCHAR(255))"))
+    init_db()
+    with engine.connect() as conn:
+        cols = {row[1] for row in conn.execute(text("PRAGMA table_info(um_user_cache)"))}
+    assert "username_lc" in cols
+    # The empty cache must be refilled on the next refresh, not skipped as unchanged.
+    db.expire_all()
+    assert db.query(CacheFingerprint).filter_by(table_name="um_user_cache").count() == 0
+    assert db.query(UmUserCache).count() == 0
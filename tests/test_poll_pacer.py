@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+import asyncio
+import time
+
+from mikrotik_2fa_bot.config import settings
+from mikrotik_2fa_bot.models import SessionStatus, User, UserStatus, VpnSession
+from mikrotik_2fa_bot.services import poll_pacer, scheduler
+from mikrotik_2fa_bot.services.poll_pacer import PollPacer
+
+
+def _bounds(lo: int = 5, hi: int = 300) -> None:
+    settings.POLL_INTERVAL_SECONDS = lo
+    settings.POLL_INTERVAL_MAX_SECONDS = hi
+
+
+def test_rtt_widening_is_capped_while_pending():
+    _bounds()
+    pacer = PollPacer()
+    pacer.record_rtt(10.0)
+
+    pacer.observe([SessionStatus.REQUESTED, SessionStatus.ACTIVE])
+    assert pacer.interval() == (15.0, "pending+rtt")
+
+    pacer.observe([SessionStatus.ACTIVE])
+    assert pacer.interval() == (100.0, "active+rtt")
+
+
+def test_pending_between_polls_pulls_the_next_poll_in():
+    _bounds()
+    pacer = PollPacer()
+    assert pacer.current_interval == 0
+    pacer.observe([])
+    pacer.schedule_next(time.monotonic())
+    assert pacer.current_interval == 300
+
+    pacer.note_pending(1)
+    assert (pacer.current_interval, pacer.stats().reason) == (5, "pending")
+    assert not pacer.due()
+
+
+def test_watcher_events_feed_the_pacer(db, monkeypatch):
+    _bounds()
+    pacer = PollPacer()
+    monkeypatch.setattr(poll_pacer, "_pacer", pacer)
+    pacer.observe([])
+    pacer.schedule_next(time.monotonic())
+
+    user = User(telegram_id=1, full_name="x", status=UserStatus.APPROVED)
+    user.sessions.append(VpnSession(mikrotik_username="user000001", status=SessionStatus.REQUESTED))
+    db.add(user)
+    db.commit()
+
+    asyncio.run(scheduler.poll_users(None, None, {"user000001"}))
+    assert pacer.current_interval == 5
+    assert poll_pacer.pacer_stats().pending == 1
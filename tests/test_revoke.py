@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+
+import pytest
+
+from mikrotik_2fa_bot.config import settings
+from mikrotik_2fa_bot.models import VpnSession
+from mikrotik_2fa_bot.services import mikrotik_api_async
+from mikrotik_2fa_bot.services.ros_common import MikroTikAPIError, current_router_config
+from mikrotik_2fa_bot.services.vpn_sessions import revoke_session_access_async
+
+
+def _user(model, name: str) -> dict:
+    return next(r for r in model.rows("user-manager/user") if r["name"] == name)
+
+
+def test_revoke_script_reports_failed_steps(router):
+    _, model = router
+    rule = next(r for r in model.rows("ip/firewall/filter") if r["comment"] == "2FA user000001")
+    model.set("ip/firewall/filter", [rule[".id"]], {"disabled": "false"})
+    model.connect("user000001")
+
+    asyncio.run(mikrotik_api_async.revoke_access("user000001", rule[".id"]))
+    assert _user(model, "user000001")["disabled"] == "true"
+    assert not any(s["user"] == "user000001" and s["active"] == "true" for s in model.rows("user-manager/session"))
+
+    # A stale rule .id fails its own step only: the user is still disabled and the error says so.
+    with pytest.raises(MikroTikAPIError, match=r"failed: rule; done: user"):
+        asyncio.run(mikrotik_api_async.revoke_access("user000002", "*FFFF"))
+    assert _user(model, "user000002")["disabled"] == "true"
+
+
+def test_script_failure_falls_back_to_logged_steps(router, caplog):
+    _, model = router
+    settings.REVOKE_MODE = "script"
+    session = VpnSession(mikrotik_username="user000003", firewall_rule_id="*FFFF")
+
+    with caplog.at_level(logging.WARNING, logger="mikrotik_2fa_bot.services.vpn_sessions"):
+        asyncio.run(revoke_session_access_async(session, current_router_config()))
+
+    messages = [r.getMessage() for r in caplog.records]
+    assert any("Revoke script for user000003 failed" in m and "failed: rule" in m for m in messages)
+    assert any("Revoke step 'firewall' for user000003 failed" in m for m in messages)
+    assert _user(model, "user000003")["disabled"] == "true"
+
+
+def test_revoke_script_on_v6_user_manager(router_v6):
+    _, model = router_v6
+    v6_user = lambda name: next(r for r in model.rows("tool/user-manager/user") if r["username"] == name)  # noqa: E731
+    model.set("tool/user-manager/user", [v6_user("user000001")[".id"]], {"disabled": "false"})
+
+    asyncio.run(mikrotik_api_async.revoke_access("user000001"))
+    assert v6_user("user000001")["disabled"] == "true"
+
+    # No UM user by that name: a failure, not a silent "ok".
+    with pytest.raises(MikroTikAPIError, match=r"failed: user"):
+        asyncio.run(mikrotik_api_async.revoke_access("nobody"))
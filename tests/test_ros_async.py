@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import asyncio
+import time
+
+import pytest
+
+from mikrotik_2fa_bot.config import settings
+from mikrotik_2fa_bot.services import mikrotik_api_async
+from mikrotik_2fa_bot.services.circuit_breaker import get_breaker
+from mikrotik_2fa_bot.services.ros_common import MikroTikAPIError, current_router_config
+from mikrotik_2fa_bot.services.ros_async import get_async_pool
+
+
+def test_command_times_out_and_counts_against_breaker(router):
+    sim, _ = router
+    settings.MIKROTIK_TIMEOUT_SECONDS = 1
+
+    async def main():
+        await mikrotik_api_async.get_router_capabilities()
+        sim.faults.latency["print"] = 5
+        started = time.monotonic()
+        with pytest.raises(MikroTikAPIError, match="did not answer"):
+            await mikrotik_api_async.get_router_capabilities(refresh=True)
+        elapsed = time.monotonic() - started
+        # The router stayed silent the whole time: the connection was dropped.
+        assert get_async_pool().size() == 0
+        sim.faults.latency.clear()
+        caps = await mikrotik_api_async.get_router_capabilities(refresh=True)
+        return elapsed, caps
+
+    elapsed, caps = asyncio.run(main())
+    assert elapsed < 3
+    assert caps.identity == "sim-router"
+    # One failure, then the successful call closed the circuit again.
+    assert get_breaker(current_router_config()).snapshot().failures == 0
+
+
+def test_timeout_failures_open_the_breaker(router):
+    sim, _ = router
+    settings.MIKROTIK_TIMEOUT_SECONDS = 1
+    settings.MIKROTIK_BREAKER_FAILURES = 2
+    sim.faults.latency["print"] = 5
+
+    async def main():
+        for _ in range(2):
+            with pytest.raises(MikroTikAPIError):
+                await mikrotik_api_async.get_router_capabilities(refresh=True)
+        with pytest.raises(mikrotik_api_async.RouterUnavailableError):
+            await mikrotik_api_async.get_router_capabilities(refresh=True)
+
+    asyncio.run(main())
+    assert get_breaker(current_router_config()).snapshot().state == "open"
+
+
+def test_outer_cancellation_of_a_hung_call_is_recorded(router):
+    sim, _ = router
+    settings.MIKROTIK_TIMEOUT_SECONDS = 30
+
+    async def main():
+        await mikrotik_api_async.get_router_capabilities()
+        sim.faults.latency["print"] = 5
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(mikrotik_api_async.get_router_capabilities(refresh=True), timeout=1.5)
+
+    asyncio.run(main())
+    snap = get_breaker(current_router_config()).snapshot()
+    assert snap.failures == 1
+    assert "cancelled" in (snap.last_error or "")
+
+
+def test_timed_out_command_is_cancelled_on_a_live_connection(router):
+    sim, _ = router
+    settings.MIKROTIK_TIMEOUT_SECONDS = 1
+
+    async def main():
+        pool = get_async_pool()
+        conn = await pool.acquire(current_router_config())
+        user_id = (await conn.run("/user-manager/user/print", "=.proplist=.id"))[0][".id"]
+        sim.faults.latency["set"] = 1.5
+
+        async def _chatter():
+            # Keeps replies flowing on the connection while the slow set waits.
+            for _ in range(12):
+                await conn.run("/system/identity/print")
+                await asyncio.sleep(0.1)
+
+        chatter = asyncio.create_task(_chatter())
+        with pytest.raises(TimeoutError):
+            await conn.run("/user-manager/user/set", f"=.id={user_id}", "=comment=x", timeout=0.5)
+        await chatter
+        # Only the command was abandoned, the connection is still usable.
+        assert not conn.closed
+        return await conn.run("/system/identity/print")
+
+    rows = asyncio.run(main())
+    assert rows[0]["name"] == "sim-router"
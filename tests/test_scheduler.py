@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+from telegram.error import NetworkError
+
+from mikrotik_2fa_bot.config import settings
+from mikrotik_2fa_bot.models import SessionStatus, User, UserStatus, VpnSession
+from mikrotik_2fa_bot.services import scheduler
+from mikrotik_2fa_bot.services.ros_common import ActiveSession
+from mikrotik_2fa_bot.services.notifier import get_notifier, stop_notifier
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+        self.started = time.monotonic()
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((round(time.monotonic() - self.started, 2), chat_id, text))
+
+
+def _requested(db, telegram_id: int, username: str, router_id=None) -> VpnSession:
+    user = User(
+        telegram_id=telegram_id,
+        full_name="x",
+        status=UserStatus.APPROVED,
+        firewall_rule_id="*1",
+        firewall_router_id=router_id,
+    )
+    s = VpnSession(
+        mikrotik_username=username,
+        router_id=router_id,
+        status=SessionStatus.REQUESTED,
+        expires_at=datetime.utcnow() + timedelta(hours=1),
+    )
+    user.sessions.append(s)
+    db.add(user)
+    db.commit()
+    return s
+
+
+def _active(username: str) -> dict:
+    return {username: ActiveSession(username=username, session_id="*1", source="user_manager", address="10.0.0.1")}
+
+
+def test_slow_router_does_not_hold_up_another(db, router, site_b):
+    sim_a, _ = router
+    rid_b, _ = site_b
+    settings.REQUIRE_CONFIRMATION = False
+    settings.MIKROTIK_TIMEOUT_SECONDS = 10
+    settings.NOTIFY_RATE_PER_SECOND = 0
+    settings.NOTIFY_CHAT_RATE_PER_SECOND = 0
+    a = _requested(db, 1, "user000001")
+    b = _requested(db, 2, "user000002", rid_b)
+    sim_a.faults.latency["set"] = 3  # granting access on the default router is slow
+
+    bot = FakeBot()
+
+    async def main():
+        await scheduler.poll_once(bot, active_views={None: _active(a.mikrotik_username), rid_b: _active(b.mikrotik_username)})
+        await get_notifier(bot).drain()
+        await stop_notifier()
+
+    asyncio.run(main())
+    at = {chat_id: t for t, chat_id, _ in bot.sent}
+    assert at[2] < 1.5  # site B was not stuck behind the default router's grant
+    assert at[1] >= 2.5
+    db.expire_all()
+    rows = {s.mikrotik_username: s for s in db.query(VpnSession)}
+    assert rows["user000001"].status == SessionStatus.ACTIVE
+    assert rows["user000001"].firewall_rule_id == "*1"
+    assert rows["user000002"].firewall_rule_id == "*1"
+
+
+def test_poll_stats_are_kept_per_router(db, site_b):
+    rid_b, _ = site_b
+    _requested(db, 1, "user000001")
+    _requested(db, 2, "user000002")
+    _requested(db, 3, "user000003", rid_b)
+
+    asyncio.run(scheduler.poll_once(FakeBot(), active_views={None: {}, rid_b: {}}))
+    assert scheduler.last_poll_stats(None).sessions == 2
+    assert scheduler.last_poll_stats(rid_b).sessions == 1
+
+
+def test_grant_is_taken_back_if_the_session_ended_meanwhile(db, router):
+    sim, model = router
+    settings.REQUIRE_CONFIRMATION = False
+    settings.MIKROTIK_TIMEOUT_SECONDS = 10
+    s = _requested(db, 1, "user000001")
+    sim.faults.latency["set"] = 1
+
+    async def main():
+        task = asyncio.create_task(scheduler.poll_once(FakeBot(), active_views={None: _active(s.mikrotik_username)}))
+        await asyncio.sleep(0.5)
+        # The user disconnects from a button while the rule is being enabled.
+        db.expire_all()
+        row = db.get(VpnSession, s.id)
+        row.status = SessionStatus.DISCONNECTED
+        db.commit()
+        await task
+        await stop_notifier()
+
+    asyncio.run(main())
+    rule = next(r for r in model.rows("ip/firewall/filter") if r[".id"] == "*1")
+    assert rule.get("disabled") == "true"
+    db.expire_all()
+    assert db.get(VpnSession, s.id).firewall_rule_id is None
+
+
+class FailingBot(FakeBot):
+    """Telegram is unreachable for the first `failures` sends."""
+
+    def __init__(self, failures: int):
+        super().__init__()
+        self.failures = failures
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if self.failures > 0:
+            self.failures -= 1
+            raise NetworkError("connection reset")
+        await super().send_message(chat_id, text, **kwargs)
+
+
+def test_undelivered_prompt_is_asked_again(db):
+    settings.REQUIRE_CONFIRMATION = True
+    settings.NOTIFY_RATE_PER_SECOND = 0
+    settings.NOTIFY_CHAT_RATE_PER_SECOND = 0
+    s = _requested(db, 1, "user000001")
+    bot = FailingBot(failures=3)  # the notifier's max_attempts
+
+    async def main():
+        await scheduler.poll_once(bot, active_views={None: _active(s.mikrotik_username)})
+        await get_notifier(bot).drain()
+        db.expire_all()
+        first = db.get(VpnSession, s.id).status
+        await scheduler.poll_once(bot, active_views={None: _active(s.mikrotik_username)})
+        await get_notifier(bot).drain()
+        await stop_notifier()
+        return first
+
+    assert asyncio.run(main()) == SessionStatus.CONNECTED
+    assert [text for _, _, text in bot.sent if "Это вы подключились?" in text]
+    db.expire_all()
+    assert db.get(VpnSession, s.id).status == SessionStatus.CONFIRM_REQUESTED
+
+
+def test_conflicting_session_gets_no_router_calls_or_notices(db, router, monkeypatch):
+    sim, _ = router
+    settings.NOTIFY_RATE_PER_SECOND = 0
+    settings.NOTIFY_CHAT_RATE_PER_SECOND = 0
+    s = _requested(db, 1, "user000001")
+    s.status = SessionStatus.ACTIVE
+    s.expires_at = datetime.utcnow() - timedelta(minutes=1)
+    db.commit()
+
+    plan = scheduler._transition_sessions
+
+    def _with_handler_racing(bot, plan_db, *args):
+        plan(bot, plan_db, *args)
+        # A button handler disconnects the session before the cycle's writes are flushed.
+        db.get(VpnSession, s.id).status = SessionStatus.DISCONNECTED
+        db.commit()
+
+    monkeypatch.setattr(scheduler, "_transition_sessions", _with_handler_racing)
+    bot = FakeBot()
+
+    async def main():
+        await scheduler.poll_once(bot, active_views={None: {}})
+        await get_notifier(bot).drain()
+        await stop_notifier()
+
+    asyncio.run(main())
+    assert bot.sent == []
+    assert sim.stats.by_verb.get("set", 0) == 0
+    db.expire_all()
+    assert db.get(VpnSession, s.id).status == SessionStatus.DISCONNECTED
@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+import asyncio
+
+from mikrotik_2fa_bot.config import settings
+from mikrotik_2fa_bot.services import scheduler
+from mikrotik_2fa_bot.services.ros_common import MikroTikAPIError
+from mikrotik_2fa_bot.services.session_watcher import SessionWatcher
+
+
+async def _until(predicate, timeout: float = 5.0) -> bool:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not predicate():
+        if loop.time() > deadline:
+            return False
+        await asyncio.sleep(0.05)
+    return True
+
+
+async def _ignore(usernames) -> None:
+    pass
+
+
+def test_silent_router_is_detected_by_the_keepalive(router):
+    sim, _ = router
+    settings.MIKROTIK_TIMEOUT_SECONDS = 1
+
+    async def main():
+        w = SessionWatcher(_ignore, keepalive_seconds=1)
+        w.start()
+        try:
+            assert await _until(lambda: w.healthy)
+            # The subscription stays open but the router stops answering.
+            sim.faults.latency["print"] = 10
+            return await _until(lambda: not w.healthy, timeout=4)
+        finally:
+            await w.stop()
+
+    assert asyncio.run(main())
+
+
+def test_failed_reconcile_restarts_the_watcher(router):
+    async def main():
+        w = SessionWatcher(_ignore)
+        scheduler._watchers[None] = w
+        w.start()
+        try:
+            assert await _until(lambda: w.healthy)
+            first = w._task
+
+            async def _broken() -> None:
+                raise MikroTikAPIError("boom")
+
+            w.resync = _broken
+            await scheduler.reconcile(bot=None)
+            assert w._task is not first and first.done()
+            return await _until(lambda: w.healthy)
+        finally:
+            await scheduler.stop_session_watchers()
+
+    assert asyncio.run(main())
@@ -0,0 +1,40 @@
+from __future__ import annotations
+
+import asyncio
+
+from mikrotik_2fa_bot.services import mikrotik_api_async
+from mikrotik_2fa_bot.services.mikrotik_api_async import _um_user_ids
+from mikrotik_2fa_bot.services.ros_records import UmSession, UmUser
+
+_USERS = "user-manager/user"
+
+
+def _numeric_user(model) -> str:
+    # Read back by the client as an int, not as the string "1001".
+    model.add(_USERS, {"name": "1001", "disabled": "false"})
+    return "1001"
+
+
+def _disabled(model, name: str) -> str:
+    return next(r for r in model.rows(_USERS) if r["name"] == name)["disabled"]
+
+
+def test_numeric_usernames_are_found(router):
+    _, model = router
+    name = _numeric_user(model)
+
+    async def main():
+        _um_user_ids.clear()
+        await mikrotik_api_async.set_vpn_user_disabled(name, disabled=True)
+        _um_user_ids.clear()
+        return await mikrotik_api_async.set_vpn_users_disabled([name, "user000001"], disabled=True)
+
+    assert asyncio.run(main()) == []
+    assert _disabled(model, name) == "true"
+    assert _disabled(model, "user000001") == "true"
+
+
+def test_numeric_zero_is_a_username():
+    assert UmUser.from_row({".id": "*1", "name": 0}) == UmUser(id="*1", name="0")
+    s = UmSession.from_row({".id": "*2", "user": 0, "active": "true", "acct-session-id": 0})
+    assert (s.user, s.acct_session_id) == ("0", "0")
@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import asyncio
+
+from sqlalchemy import text
+
+from mikrotik_2fa_bot.db import engine, init_db
+from mikrotik_2fa_bot.handlers.user import _create_request_for_account
+from mikrotik_2fa_bot.models import MikrotikAccount, VpnSession
+from mikrotik_2fa_bot.services.notifier import stop_notifier
+from mikrotik_2fa_bot.services.users import bind_account, get_user_by_telegram_id, list_user_accounts, unbind_account
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append(text)
+
+
+def test_same_username_on_two_routers(db, site_b):
+    rid_b, _ = site_b
+    a = bind_account(db, 1, "alice")
+    b = bind_account(db, 1, "alice", rid_b)
+    assert a.id != b.id
+    assert {acct.router_id for acct in list_user_accounts(db, a.user_id)} == {None, rid_b}
+
+    # Rebinding reactivates the account of that router and leaves the other one alone.
+    unbind_account(db, 1, "alice", rid_b)
+    again = bind_account(db, 1, "alice", rid_b)
+    assert again.id == b.id and again.is_active
+    db.refresh(a)
+    assert a.router_id is None and a.is_active
+
+    unbind_account(db, 1, "alice")
+    assert [acct.router_id for acct in list_user_accounts(db, a.user_id)] == [rid_b]
+    assert db.query(MikrotikAccount).count() == 2
+
+
+def test_request_uses_the_chosen_router(db, router, site_b):
+    _, model_a = router
+    rid_b, sim_b = site_b
+    bind_account(db, 1, "user000003")
+    b = bind_account(db, 1, "user000003", rid_b)
+    for model in (model_a, sim_b.model):
+        for row in model.rows("user-manager/user"):
+            if row["name"] == "user000003":
+                model.set("user-manager/user", [row[".id"]], {"disabled": "true"})
+
+    bot = FakeBot()
+
+    async def main():
+        await _create_request_for_account(bot, 1, 1, b.id)
+        await stop_notifier()
+
+    asyncio.run(main())
+    s = db.query(VpnSession).one()
+    assert s.router_id == rid_b
+    enabled = {
+        name: next(r for r in m.rows("user-manager/user") if r["name"] == "user000003")["disabled"]
+        for name, m in (("a", model_a), ("b", sim_b.model))
+    }
+    assert enabled == {"a": "true", "b": "false"}
+
+
+def test_old_request_buttons_with_a_username(db, router):
+    bind_account(db, 1, "user000004")
+    bot = FakeBot()
+
+    async def main():
+        await _create_request_for_account(bot, 1, 1, "user000004")
+        await stop_notifier()
+
+    asyncio.run(main())
+    s = db.query(VpnSession).one()
+    assert s.mikrotik_username == "user000004"
+    assert get_user_by_telegram_id(db, 1).id == s.user_id
+
+
+def test_migration_replaces_the_per_user_unique_index(db):
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX uq_user_mikrotik_account"))
+        conn.execute(text("CREATE UNIQUE INDEX uq_user_mikrotik_username ON mikrotik_accounts (user_id, mikrotik_username)"))
+    init_db()
+    with engine.connect() as conn:
+        names = {row[1] for row in conn.execute(text("PRAGMA index_list(mikrotik_accounts)"))}
+    assert "uq_user_mikrotik_account" in names
+    assert "uq_user_mikrotik_username" not in names